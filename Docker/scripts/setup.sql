@@ -19,4 +19,12 @@ CREATE TABLE cerealpictures (
     cerealid INT FOREIGN KEY REFERENCES cereal(id) ON DELETE CASCADE, 
     picturepath VARCHAR(50));
 GO
-
+CREATE TABLE cerealversion (id INT PRIMARY KEY, version BIGINT NOT NULL);
+GO
+INSERT INTO cerealversion (id, version) VALUES (1, 0);
+GO
+CREATE TRIGGER cereal_version ON cereal AFTER INSERT, UPDATE, DELETE AS BEGIN SET NOCOUNT ON; UPDATE cerealversion SET version = version + 1; END
+GO
+CREATE TABLE importprogress (job_id VARCHAR(32) PRIMARY KEY, committed_rows INT NOT NULL,
+                             rows_inserted INT NOT NULL, rows_rejected INT NOT NULL);
+GO
@@ -1,7 +1,6 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-import logging
 
 """
 The entry point for the flask webapp, initializes the database connection, login manager and imports the blueprints.
@@ -16,6 +15,7 @@ db = SQLAlchemy()
 def create_app():
     app = Flask(__name__, static_folder='static')
     from .config import secret,db_uri
+    from . import config
     #Create the PYODBC string for a MSSQL database
     
 
@@ -23,18 +23,70 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
     app.config['SECRET_KEY'] = secret
 
+    #Optional settings, configs without them get the defaults
+    #Cache-Control header per api endpoint, keys are endpoint names like 'api.api_get_all_cereals'
+    app.config['API_CACHE_CONTROL'] = getattr(config, 'api_cache_control', {})
+    #Rows per executemany for bulk inserts
+    app.config['BULK_INSERT_CHUNK_SIZE'] = getattr(config, 'bulk_insert_chunk_size', 1000)
+    #Auth caches, max entries and seconds an entry is valid for successful api password checks and for users of login sessions
+    app.config['CREDENTIAL_CACHE_SIZE'] = getattr(config, 'credential_cache_size', 1024)
+    app.config['CREDENTIAL_CACHE_TTL'] = getattr(config, 'credential_cache_ttl', 300)
+    app.config['USER_CACHE_SIZE'] = getattr(config, 'user_cache_size', 1024)
+    app.config['USER_CACHE_TTL'] = getattr(config, 'user_cache_ttl', 60)
+    #Background csv imports, amount of worker threads, max waiting jobs, the folder uploads are kept in while importing(None for instance/imports)
+    #and seconds a finished job is kept before it is removed
+    app.config['IMPORT_WORKERS'] = getattr(config, 'import_workers', 2)
+    app.config['IMPORT_MAX_QUEUED'] = getattr(config, 'import_max_queued', 10)
+    app.config['IMPORT_SPOOL_DIR'] = getattr(config, 'import_spool_dir', None)
+    app.config['IMPORT_JOB_TTL'] = getattr(config, 'import_job_ttl', 86400)
+    #Worker threads generating the resized versions of uploaded images
+    app.config['IMAGE_WORKERS'] = getattr(config, 'image_workers', 2)
+    #Connection pool, settings that are None keep the SQLAlchemy default. Pre ping and recycle replace connections the server has dropped
+    from .src.db.pool import instrument_engine, pool_engine_options
+    engine_options = pool_engine_options(db_uri,
+                                         pool_size=getattr(config, 'pool_size', None),
+                                         max_overflow=getattr(config, 'max_overflow', None),
+                                         pool_timeout=getattr(config, 'pool_timeout', None),
+                                         pool_recycle=getattr(config, 'pool_recycle', 1800),
+                                         pool_pre_ping=getattr(config, 'pool_pre_ping', True))
+    #pyodbc sends executemany parameters as one array instead of a round trip per row, only exists for MSSQL
+    if db_uri.startswith('mssql+pyodbc'):
+        engine_options['fast_executemany'] = getattr(config, 'fast_executemany', True)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
     db.init_app(app)
+    #Counters and checkout wait times of the connection pool, reported by /api/internal/pool
+    with app.app_context():
+        app.extensions['pool_monitor'] = instrument_engine(db.engine)
 
     #Flask login manager for handling user auth
     login_manager = LoginManager()
     login_manager.login_view = 'auth.login'
     login_manager.init_app(app)
-    from .src.db.models import User
+    from .src.db.authdbfunctions import load_user_by_id
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return load_user_by_id(int(user_id))
+
+    #Request count, latency, database time and response size per route, exposed for Prometheus on /metrics
+    if getattr(config, 'metrics_enabled', True):
+        from .src.misc.metrics import init_metrics
+        with app.app_context():
+            init_metrics(app, db.engine)
+
+    #Json lines log written by a background thread, info and debug records can be sampled when the volume is too high
+    from .src.misc.applog import init_logging
+    init_logging(app,
+                 filename=getattr(config, 'log_file', 'record.log'),
+                 level=getattr(config, 'log_level', 'INFO'),
+                 max_bytes=getattr(config, 'log_max_bytes', 10485760),
+                 backup_count=getattr(config, 'log_backup_count', 5),
+                 info_sample_rate=getattr(config, 'log_info_sample_rate', 1.0),
+                 queue_size=getattr(config, 'log_queue_size', 10000))
 
-    logging.basicConfig(filename='record.log', level=logging.DEBUG, format=f'%(asctime)s %(levelname)s %(name)s %(threadName)s : %(message)s')
+    #Cli commands, like flask generate-cereals
+    from .src.misc.commands import register_commands
+    register_commands(app)
 
     # Import blueprints for subsections of the page
     #Auth pages
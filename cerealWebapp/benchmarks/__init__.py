@@ -0,0 +1,4 @@
+"""
+Microbenchmarks of the filter, validation, database loading and serialization functions, run with python -m cerealWebapp.benchmarks
+from the folder above cerealWebapp. See readme.txt in this folder
+"""
@@ -0,0 +1,51 @@
+import csv
+import os
+import numpy as np
+from ..src.constants import CEREAL_HEADERS_WITH_ID, CEREAL_HEADERS_WITHOUT_ID
+from ..src.db.models import Cereal
+
+"""
+Synthetic cereal datasets for the benchmarks. Every column is sampled from the values of that column in cereals.csv,
+so the value ranges and the selectivity of filters are close to the real data
+"""
+
+CEREALS_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cereals.csv')
+
+def load_column_values(path=CEREALS_CSV):
+    """
+    Returns a dictionary of column name to the list of values of that column in the csv, converted to the column type
+    """
+    values = {col : [] for col in CEREAL_HEADERS_WITHOUT_ID}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            for col in CEREAL_HEADERS_WITHOUT_ID:
+                values[col].append(Cereal.__table__.c[col].type.python_type(row[col]))
+    return values
+
+def make_columns(size,seed=0,column_values=None):
+    """
+    Returns a synthetic dataset as columns
+    args:
+        size: Integer value of the amount of rows
+        seed: Integer seed of the random generator, the same seed gives the same dataset
+        column_values: Dictionary from load_column_values, None to load cereals.csv
+    returns:
+        Dictionary of column name to a list of values, ordered as CEREAL_HEADERS_WITH_ID
+    """
+    if column_values is None:
+        column_values = load_column_values()
+    rng = np.random.default_rng(seed)
+    columns = {'id' : list(range(1,size + 1))}
+    for col in CEREAL_HEADERS_WITHOUT_ID:
+        if col == 'name':
+            columns[col] = ['Cereal %d' % i for i in range(1,size + 1)]
+        else:
+            columns[col] = rng.choice(np.array(column_values[col]), size).tolist()
+    return {col : columns[col] for col in CEREAL_HEADERS_WITH_ID}
+
+def make_rows(size,seed=0,column_values=None):
+    """
+    Returns a synthetic dataset as a list of row tuples ordered as CEREAL_HEADERS_WITH_ID, see make_columns
+    """
+    columns = make_columns(size,seed,column_values)
+    return list(zip(*columns.values()))
@@ -0,0 +1,252 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+from flask import Flask, jsonify
+from .. import db
+from ..src.constants import CEREAL_HEADERS_WITH_ID
+from ..src.db.dbfunctions import db_get_all_cereals_as_df, db_invalidate_cereal_cache
+from ..src.db.models import Cereal
+from ..src.misc.filterfunctions import check_valid_filters, filter_cereals
+from ..src.misc.helperfuncs import change_to_column_type, set_cereal_value
+from ..src.misc.serializer import compact_serializer
+from .datasets import load_column_values, make_rows
+
+"""
+Runs the benchmarks and writes the results as json. Every benchmark is timed repeat times and the min, median and mean time per call are saved,
+a result file can be compared to an earlier one with --compare to fail on regressions
+"""
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+#Rows the per value benchmarks convert, they dont depend on the dataset size
+VALUE_SAMPLE_ROWS = 10000
+#Rows inserted per executemany when loading a dataset into SQLite
+LOAD_CHUNK_SIZE = 10000
+
+FILTERS = {'range' : [('calories','<=',100), ('sugars','>',5)],
+           'strings' : [('mfr','=','K'), ('type','!=','H')],
+           'mixed' : [('mfr','=','G'), ('fat','<',2), ('rating','>=',40), ('cups','<=',1.0)]}
+#check_valid_filters treats type as a number column, so its filter lists leave type out
+VALIDATION_FILTERS = [FILTERS['range'], FILTERS['mixed'], [('mfr','=','K'), ('mfr','!=','G'), ('calories','>',50), ('calories','<',60), ('calories','!=',55)]]
+
+
+class Benchmark():
+    """
+    A benchmark is a setup function run once per dataset that returns the function being timed.
+    Benchmarks that are not sized are only run once, on the smallest dataset
+    """
+
+    def __init__(self,name,setup,sized=True,number=1):
+        """
+        args:
+            name: String of the benchmark name
+            setup: Function taking the Context and returning a function without arguments that is timed
+            sized: Boolean, false if the time dosent depend on the dataset size
+            number: Integer value of how many times the function is called per timing
+        """
+        self.name = name
+        self.setup = setup
+        self.sized = sized
+        self.number = number
+
+
+class Context():
+    """
+    A dataset loaded for the benchmarks, as rows, as a DataFrame and in the SQLite database of the app
+    """
+
+    def __init__(self,app,rows):
+        self.app = app
+        self.rows = rows
+        self.df = pd.DataFrame(rows,columns=CEREAL_HEADERS_WITH_ID)
+        #String values of the sample rows, like they arrive from a form or a csv
+        self.value_rows = [{col : str(value) for (col,value) in zip(CEREAL_HEADERS_WITH_ID[1:],row[1:])} for row in rows[:VALUE_SAMPLE_ROWS]]
+
+
+def bench_filter(args):
+    def setup(ctx):
+        return lambda: filter_cereals(ctx.df,args)
+    return setup
+
+def bench_check_valid_filters(ctx):
+    def run():
+        for args in VALIDATION_FILTERS:
+            check_valid_filters(args)
+    return run
+
+def bench_change_to_column_type(ctx):
+    def run():
+        for row in ctx.value_rows:
+            for (col,value) in row.items():
+                change_to_column_type(col,value)
+    return run
+
+def bench_set_cereal_value(ctx):
+    def run():
+        for row in ctx.value_rows:
+            cereal = Cereal()
+            for (col,value) in row.items():
+                set_cereal_value(col,value,cereal)
+    return run
+
+def bench_db_cold(ctx):
+    def run():
+        db_invalidate_cereal_cache()
+        db_get_all_cereals_as_df()
+    return run
+
+def bench_db_warm(ctx):
+    db_get_all_cereals_as_df()
+    return db_get_all_cereals_as_df
+
+def bench_jsonify(ctx):
+    def run():
+        with ctx.app.test_request_context():
+            jsonify(ctx.df.to_dict('index'))
+    return run
+
+def bench_serializer(ctx):
+    return lambda: compact_serializer.encode_table(ctx.rows)
+
+BENCHMARKS = [Benchmark('filter_cereals.%s' % name, bench_filter(args)) for (name,args) in FILTERS.items()] + [
+    Benchmark('check_valid_filters', bench_check_valid_filters, sized=False, number=1000),
+    Benchmark('change_to_column_type', bench_change_to_column_type, sized=False),
+    Benchmark('set_cereal_value', bench_set_cereal_value, sized=False),
+    Benchmark('db_get_all_cereals_as_df.cold', bench_db_cold),
+    Benchmark('db_get_all_cereals_as_df.warm', bench_db_warm, number=100),
+    Benchmark('to_dict_jsonify', bench_jsonify),
+    Benchmark('serializer.encode_table', bench_serializer),
+]
+
+
+def make_app(path):
+    """
+    Returns a flask app using a SQLite database at path, the config module of the webapp is not needed
+    """
+    app = Flask('benchmarks')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///%s' % path
+    app.config['SECRET_KEY'] = 'benchmarks'
+    db.init_app(app)
+    return app
+
+def load_dataset(rows):
+    """
+    Replaces the cereal table with the rows, must be called in the app context
+    """
+    db.drop_all()
+    db.create_all()
+    with db.engine.begin() as conn:
+        for start in range(0,len(rows),LOAD_CHUNK_SIZE):
+            conn.execute(Cereal.__table__.insert(), [dict(zip(CEREAL_HEADERS_WITH_ID,row)) for row in rows[start:start + LOAD_CHUNK_SIZE]])
+    db_invalidate_cereal_cache()
+
+def time_benchmark(benchmark,ctx,repeat):
+    """
+    Returns a dictionary with the min, median and mean seconds per call of a benchmark
+    """
+    func = benchmark.setup(ctx)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(benchmark.number):
+            func()
+        times.append((time.perf_counter() - start) / benchmark.number)
+    return {'min' : min(times), 'median' : statistics.median(times), 'mean' : statistics.mean(times), 'repeat' : repeat, 'number' : benchmark.number}
+
+def git_commit():
+    try:
+        return subprocess.run(['git','rev-parse','HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks(sizes,repeat,only=None,seed=0):
+    """
+    Runs the benchmarks on datasets of the given sizes
+    args:
+        sizes: List of integer dataset sizes
+        repeat: Integer value of how many times each benchmark is timed
+        only: String, only benchmarks with this in their name are run, None runs all
+        seed: Integer seed of the synthetic datasets
+    returns:
+        Dictionary with the run metadata and the results keyed by benchmark name and dataset size
+    """
+    benchmarks = [benchmark for benchmark in BENCHMARKS if only is None or only in benchmark.name]
+    results = {benchmark.name : dict() for benchmark in benchmarks}
+    column_values = load_column_values()
+    with tempfile.TemporaryDirectory() as folder:
+        app = make_app(os.path.join(folder,'benchmarks.db'))
+        with app.app_context():
+            for (pos,size) in enumerate(sorted(sizes)):
+                rows = make_rows(size,seed,column_values)
+                load_dataset(rows)
+                ctx = Context(app,rows)
+                for benchmark in benchmarks:
+                    if not benchmark.sized and pos > 0:
+                        continue
+                    key = str(size) if benchmark.sized else 'all'
+                    results[benchmark.name][key] = time_benchmark(benchmark,ctx,repeat)
+                    print('%-36s %10s %12.6f s' % (benchmark.name,key,results[benchmark.name][key]['median']), file=sys.stderr)
+            db.engine.dispose()
+    return {'meta' : {'commit' : git_commit(), 'time' : datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                      'python' : platform.python_version(), 'platform' : platform.platform(), 'pandas' : pd.__version__,
+                      'sizes' : sorted(sizes), 'repeat' : repeat, 'seed' : seed},
+            'results' : results}
+
+def compare_results(baseline,current,threshold):
+    """
+    Compares the median times of two result files
+    args:
+        baseline: Dictionary of earlier results
+        current: Dictionary of the new results
+        threshold: Allowed slowdown, 0.2 allows the median to be 20% slower than the baseline
+    returns:
+        List of (benchmark name,size,baseline median,current median,ratio,regressed) of the benchmarks in both files
+    """
+    comparisons = []
+    for (name,sizes) in current['results'].items():
+        for (size,result) in sizes.items():
+            base = baseline['results'].get(name,{}).get(size)
+            if base is None:
+                continue
+            ratio = result['median'] / base['median'] if base['median'] > 0 else float('inf')
+            comparisons.append((name,size,base['median'],result['median'],ratio,ratio > 1 + threshold))
+    return comparisons
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cerealWebapp.benchmarks', description='Microbenchmarks of the cereal webapp')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES), help='Comma separated dataset sizes')
+    parser.add_argument('--repeat', type=int, default=5, help='Times each benchmark is timed')
+    parser.add_argument('--only', default=None, help='Only run benchmarks with this in their name')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic datasets')
+    parser.add_argument('--output', default=None, help='File the json results are written to, default is stdout')
+    parser.add_argument('--compare', default=None, help='Result file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown of the median compared to --compare')
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run_benchmarks(sizes,args.repeat,args.only,args.seed)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output,'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = 0
+        for (name,size,base,current,ratio,regressed) in compare_results(baseline,results,args.threshold):
+            print('%-36s %10s %12.6f s %12.6f s %6.2fx%s' % (name,size,base,current,ratio,'  REGRESSION' if regressed else ''), file=sys.stderr)
+            regressions += regressed
+        if regressions:
+            print('%d benchmarks are more than %d%% slower' % (regressions,args.threshold * 100), file=sys.stderr)
+            return 1
+    return 0
@@ -0,0 +1,3 @@
+"""
+HTTP load generator of the webapp, run with python -m cerealWebapp.loadtest from the folder above cerealWebapp. See readme.txt in this folder
+"""
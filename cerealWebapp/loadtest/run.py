@@ -0,0 +1,355 @@
+import argparse
+import base64
+import datetime
+import http.client
+import itertools
+import json
+import math
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from ..src.constants import ALLOWED_MFR, ALLOWED_TYPES
+
+"""
+Drives the webapp with concurrent http requests and reports the throughput and the p50, p95 and p99 latency per endpoint.
+Requests are either made from a weighted mix of the endpoints or replayed from an access log
+"""
+
+DEFAULT_MIX = 'list=10,filter=30,detail=40,image=10,add=4,update=4,delete=2'
+
+#Method, path and protocol of a request in a common or combined format access log, like the one werkzeug writes
+ACCESS_LOG_REQUEST = re.compile(r'"([A-Z]+) (\S+) HTTP/[\d.]+"')
+#Methods that are replayed, the bodies of the other requests are not in the logs
+REPLAYED_METHODS = {'GET','HEAD'}
+#Numeric path segments, replaced by <id> so a replayed endpoint is reported once and not per id
+PATH_ID = re.compile(r'/\d+(?=/|$)')
+
+
+class Request():
+    def __init__(self,label,method,path,body=None,auth=False):
+        self.label = label
+        self.method = method
+        self.path = path
+        self.body = body
+        self.auth = auth
+
+
+class Workload():
+    """
+    Makes requests from a weighted mix of the endpoints. Reads and updates use the ids 1 to size, deletes use the ids after that,
+    so deletes dont make the other requests miss
+    """
+
+    def __init__(self,mix,size,deletable):
+        """
+        args:
+            mix: Dictionary of endpoint kind to its weight, the kinds are list, filter, detail, image, add, update and delete
+            size: Integer value of the cereals that are read and updated
+            deletable: Integer value of the cereals after size that can be deleted
+        """
+        unknown = set(mix) - set(self.kinds())
+        if unknown:
+            raise ValueError('Unknown endpoints in the mix: %s' % ', '.join(sorted(unknown)))
+        self.kinds_list = [kind for kind in mix if mix[kind] > 0]
+        self.weights = [mix[kind] for kind in self.kinds_list]
+        self.size = size
+        self.lock = threading.Lock()
+        self.next_delete = size + 1
+
+    @staticmethod
+    def kinds():
+        return ('list','filter','detail','image','add','update','delete')
+
+    def next(self,rng):
+        kind = rng.choices(self.kinds_list, self.weights)[0]
+        return getattr(self,'make_%s' % kind)(rng)
+
+    def make_list(self,rng):
+        return Request('GET /api/cereals/', 'GET', '/api/cereals/')
+
+    def make_filter(self,rng):
+        filters = rng.choice([{'calories' : '<=%d' % rng.randrange(50,160,10)},
+                              {'mfr' : '=%s' % rng.choice(sorted(ALLOWED_MFR))},
+                              {'sugars' : '>%d' % rng.randrange(0,15), 'type' : '=%s' % rng.choice(sorted(ALLOWED_TYPES))},
+                              {'fat' : '<%d' % rng.randrange(1,5), 'rating' : '>=%d' % rng.randrange(20,80,10)}])
+        return Request('GET /api/cereals/filter', 'GET', '/api/cereals/filter?%s' % urllib.parse.urlencode(filters))
+
+    def make_detail(self,rng):
+        return Request('GET /api/cereals/<id>', 'GET', '/api/cereals/%d' % rng.randint(1,self.size))
+
+    def make_image(self,rng):
+        return Request('GET /api/cereals/getimage/<id>', 'GET', '/api/cereals/getimage/%d' % rng.randint(1,self.size))
+
+    def make_add(self,rng):
+        body = {'name' : 'Load test %d' % rng.randrange(1 << 30), 'mfr' : rng.choice(sorted(ALLOWED_MFR)), 'type' : rng.choice(sorted(ALLOWED_TYPES)),
+                'calories' : str(rng.randrange(50,160,10)), 'sugars' : str(rng.randrange(0,15))}
+        return Request('POST /api/cereals/add/', 'POST', '/api/cereals/add/', json.dumps(body), True)
+
+    def make_update(self,rng):
+        body = {'calories' : str(rng.randrange(50,160,10))}
+        return Request('PUT /api/cereals/add/<id>', 'PUT', '/api/cereals/add/%d' % rng.randint(1,self.size), json.dumps(body), True)
+
+    def make_delete(self,rng):
+        #When the deletable cereals are used up the deletes are made on ids that dont exist
+        with self.lock:
+            id = self.next_delete
+            self.next_delete += 1
+        return Request('DELETE /api/cereals/delete/<id>', 'DELETE', '/api/cereals/delete/%d' % id, None, True)
+
+
+class Replay():
+    """
+    Makes the requests of an access log in the order they were logged. Werkzeug, common and combined format logs are read,
+    and so are the json lines log of the webapp
+    """
+
+    def __init__(self,path,loop=False):
+        self.requests = []
+        self.skipped = 0
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                parsed = parse_log_line(line)
+                if parsed is None:
+                    continue
+                (method,target) = parsed
+                if method not in REPLAYED_METHODS:
+                    self.skipped += 1
+                    continue
+                label = '%s %s' % (method, PATH_ID.sub('/<id>', target.split('?',1)[0]))
+                self.requests.append(Request(label,method,target))
+        self.lock = threading.Lock()
+        self.iterator = itertools.cycle(self.requests) if loop else iter(self.requests)
+
+    def next(self,rng):
+        with self.lock:
+            return next(self.iterator,None)
+
+
+def parse_log_line(line):
+    """
+    Returns (method,path with query string) of a logged request, None if the line is not a request
+    """
+    line = line.strip()
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        if entry.get('message') == 'Request handled' and 'method' in entry and 'path' in entry:
+            return (entry['method'],entry['path'])
+        return None
+    match = ACCESS_LOG_REQUEST.search(line)
+    if match is None:
+        return None
+    return (match.group(1),match.group(2))
+
+def parse_mix(mix):
+    """
+    Returns a dictionary of endpoint kind to weight of a string like list=10,detail=40
+    """
+    weights = dict()
+    for part in mix.split(','):
+        (kind,weight) = part.split('=')
+        weights[kind.strip()] = float(weight)
+    return weights
+
+
+class Results():
+    """
+    Latencies and status codes of the requests, per endpoint label
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = dict()
+        self.statuses = dict()
+        self.errors = dict()
+
+    def add(self,label,latency,status):
+        with self.lock:
+            self.latencies.setdefault(label,[]).append(latency)
+            statuses = self.statuses.setdefault(label,dict())
+            statuses[status] = statuses.get(status,0) + 1
+
+    def add_error(self,label,error):
+        with self.lock:
+            errors = self.errors.setdefault(label,dict())
+            errors[error] = errors.get(error,0) + 1
+
+    def report(self,elapsed):
+        """
+        Returns a dictionary with the total and per endpoint request counts, errors, throughput and latency percentiles in milliseconds
+        """
+        endpoints = dict()
+        for label in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies.get(label,[]))
+            errors = sum(self.errors.get(label,{}).values())
+            endpoints[label] = {'requests' : len(latencies), 'errors' : errors, 'error_types' : self.errors.get(label,{}),
+                                'statuses' : {str(status) : count for (status,count) in sorted(self.statuses.get(label,{}).items())},
+                                'throughput' : len(latencies) / elapsed if elapsed > 0 else 0.0}
+            if latencies:
+                endpoints[label].update({'mean_ms' : sum(latencies) / len(latencies) * 1000, 'p50_ms' : percentile(latencies,50) * 1000,
+                                         'p95_ms' : percentile(latencies,95) * 1000, 'p99_ms' : percentile(latencies,99) * 1000,
+                                         'max_ms' : latencies[-1] * 1000})
+        requests = sum(endpoint['requests'] for endpoint in endpoints.values())
+        all_latencies = sorted(itertools.chain.from_iterable(self.latencies.values()))
+        total = {'requests' : requests, 'errors' : sum(endpoint['errors'] for endpoint in endpoints.values()),
+                 'elapsed_s' : elapsed, 'throughput' : requests / elapsed if elapsed > 0 else 0.0}
+        if all_latencies:
+            total.update({'p50_ms' : percentile(all_latencies,50) * 1000, 'p95_ms' : percentile(all_latencies,95) * 1000,
+                          'p99_ms' : percentile(all_latencies,99) * 1000})
+        return {'total' : total, 'endpoints' : endpoints}
+
+
+def percentile(values,pct):
+    """
+    Returns the nearest rank percentile of a sorted list
+    """
+    return values[max(0, min(len(values) - 1, math.ceil(pct / 100 * len(values)) - 1))]
+
+def worker(host,port,source,results,stop,auth_header,seed,timeout):
+    """
+    Sends requests from the source on one keep alive connection until the source runs out or stop is set
+    """
+    rng = random.Random(seed)
+    conn = None
+    while not stop.is_set():
+        request = source.next(rng)
+        if request is None:
+            break
+        headers = {'Accept' : '*/*'}
+        if request.body is not None:
+            headers['Content-Type'] = 'application/json'
+        if request.auth:
+            headers['Authorization'] = auth_header
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(host,port,timeout=timeout)
+            conn.request(request.method,request.path,body=request.body,headers=headers)
+            response = conn.getresponse()
+            response.read()
+            results.add(request.label,time.perf_counter() - start,response.status)
+            if response.will_close:
+                conn.close()
+                conn = None
+        except (OSError,http.client.HTTPException) as e:
+            results.add_error(request.label,type(e).__name__)
+            if conn is not None:
+                conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+
+def run_load(host,port,source,concurrency,duration,requests,username,password,seed,timeout):
+    """
+    Runs the load test
+    args:
+        host: String of the host of the app
+        port: Integer value of the port of the app
+        source: Workload or Replay the requests are taken from
+        concurrency: Integer value of the amount of connections sending requests at the same time
+        duration: Seconds the test runs, None to run until the requests are sent or the replay ends
+        requests: Integer value of the max amount of requests, None for no limit
+        username: String of the user of the authenticated requests
+        password: String of the password of the user
+        seed: Integer seed of the random request choices
+        timeout: Seconds a request can take before it is counted as an error
+    returns:
+        Dictionary from Results.report
+    """
+    if requests is not None:
+        source = LimitedSource(source,requests)
+    auth_header = 'Basic ' + base64.b64encode(('%s:%s' % (username,password)).encode()).decode()
+    results = Results()
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker, args=(host,port,source,results,stop,auth_header,seed + i,timeout), name='loadtest-%d' % i)
+               for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    if duration is not None:
+        stop.wait(duration)
+        stop.set()
+    for thread in threads:
+        thread.join()
+    return results.report(time.perf_counter() - start)
+
+
+class LimitedSource():
+    """
+    Stops a request source after a max amount of requests
+    """
+
+    def __init__(self,source,limit):
+        self.source = source
+        self.remaining = limit
+        self.lock = threading.Lock()
+
+    def next(self,rng):
+        with self.lock:
+            if self.remaining <= 0:
+                return None
+            self.remaining -= 1
+        return self.source.next(rng)
+
+
+def print_report(report,file=sys.stderr):
+    print('%-40s %8s %7s %9s %9s %9s %9s' % ('endpoint','requests','errors','req/s','p50 ms','p95 ms','p99 ms'), file=file)
+    for (label,endpoint) in list(report['endpoints'].items()) + [('total',report['total'])]:
+        print('%-40s %8d %7d %9.1f %9.2f %9.2f %9.2f' % (label, endpoint['requests'], endpoint['errors'], endpoint['throughput'],
+                                                        endpoint.get('p50_ms',0.0), endpoint.get('p95_ms',0.0), endpoint.get('p99_ms',0.0)), file=file)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cerealWebapp.loadtest', description='HTTP load test of the cereal webapp')
+    parser.add_argument('--url', default=None, help='Url of a running app, without it the app is started on a seeded local SQLite database')
+    parser.add_argument('--size', type=int, default=10000, help='Cereals the load test reads and updates, the ids 1 to size')
+    parser.add_argument('--deletable', type=int, default=1000, help='Cereals after size that are seeded for the deletes')
+    parser.add_argument('--concurrency', type=int, default=8, help='Connections sending requests at the same time')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds the test runs, 0 runs until --requests are sent or the replay ends')
+    parser.add_argument('--requests', type=int, default=None, help='Max amount of requests')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Weights of the endpoints, the kinds are list, filter, detail, image, add, update and delete')
+    parser.add_argument('--replay', default=None, help='Access log to replay instead of the mix, only GET and HEAD requests are replayed')
+    parser.add_argument('--loop', action='store_true', help='Start the replay over when it ends')
+    parser.add_argument('--user', default='loadtest', help='User of the authenticated requests')
+    parser.add_argument('--password', default='loadtest', help='Password of the user')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic cereals and the request choices')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as an error')
+    parser.add_argument('--output', default=None, help='File the json report is written to')
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        source = Replay(args.replay,args.loop)
+        if source.skipped:
+            print('Skipping %d logged requests that are not GET or HEAD' % source.skipped, file=sys.stderr)
+    else:
+        source = Workload(parse_mix(args.mix),args.size,args.deletable)
+    duration = args.duration if args.duration > 0 else None
+
+    with tempfile.TemporaryDirectory() as folder:
+        server = None
+        if args.url:
+            url = urllib.parse.urlsplit(args.url)
+            (host,port) = (url.hostname, url.port or 80)
+        else:
+            from .server import start_local_app
+            print('Seeding %d cereals' % (args.size + args.deletable), file=sys.stderr)
+            server = start_local_app(folder,args.size,args.deletable,args.seed,args.user,args.password,args.concurrency)
+            (host,port) = ('127.0.0.1', server.server_port)
+        try:
+            report = run_load(host,port,source,args.concurrency,duration,args.requests,args.user,args.password,args.seed,args.timeout)
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    report['meta'] = {'time' : datetime.datetime.now(datetime.timezone.utc).isoformat(), 'url' : args.url, 'size' : args.size,
+                      'concurrency' : args.concurrency, 'mix' : None if args.replay else parse_mix(args.mix), 'replay' : args.replay}
+    print_report(report)
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
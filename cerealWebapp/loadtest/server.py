@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+import types
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+from .. import db
+from ..src.constants import CEREAL_HEADERS_WITH_ID
+from ..src.db.authdbfunctions import gen_user
+from ..src.db.models import Cereal, CerealPicture
+from ..benchmarks.datasets import load_column_values, make_columns
+
+"""
+Starts the webapp on a local SQLite database seeded with synthetic cereals, for load tests that dont need a real database server
+"""
+
+#Rows inserted per executemany when seeding the database
+SEED_CHUNK_SIZE = 10000
+
+def stand_in_config(folder,pool_size):
+    """
+    Returns a config module for the local app, it is used instead of config.py
+    args:
+        folder: String of the folder the database and the log file are created in
+        pool_size: Integer value of the connections kept open, should be at least the load test concurrency
+    """
+    config = types.ModuleType('cerealWebapp.config')
+    config.secret = os.urandom(16).hex()
+    config.db_uri = 'sqlite:///%s' % os.path.join(folder,'loadtest.db')
+    config.log_file = os.path.join(folder,'record.log')
+    config.pool_size = pool_size
+    config.import_spool_dir = os.path.join(folder,'imports')
+    return config
+
+def seed_database(size,deletable,seed):
+    """
+    Creates the tables and inserts size + deletable synthetic cereals, every cereal gets one of the pictures in the static folder.
+    Must be called in the app context
+    args:
+        size: Integer value of the cereals the load test reads and updates, they get the ids 1 to size
+        deletable: Integer value of the extra cereals after those that the load test deletes
+        seed: Integer seed of the synthetic cereals
+    """
+    db.create_all()
+    column_values = load_column_values()
+    columns = make_columns(size + deletable,seed,column_values)
+    static_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'static')
+    pictures = sorted(name for name in os.listdir(static_folder) if os.path.isfile(os.path.join(static_folder,name)))
+    rows = list(zip(*columns.values()))
+    with db.engine.begin() as conn:
+        for start in range(0,len(rows),SEED_CHUNK_SIZE):
+            chunk = rows[start:start + SEED_CHUNK_SIZE]
+            conn.execute(Cereal.__table__.insert(), [dict(zip(CEREAL_HEADERS_WITH_ID,row)) for row in chunk])
+            if pictures:
+                conn.execute(CerealPicture.__table__.insert(), [{'cerealid' : row[0], 'picturepath' : pictures[row[0] % len(pictures)]} for row in chunk])
+
+def start_local_app(folder,size,deletable,seed,username,password,pool_size):
+    """
+    Creates the app on a seeded SQLite database in folder and serves it on a free local port in a background thread
+    args:
+        folder: String of the folder the database is created in
+        size: Integer value of the cereals the load test reads and updates
+        deletable: Integer value of the extra cereals the load test deletes
+        seed: Integer seed of the synthetic cereals
+        username: String of the api user that is created
+        password: String of the password of the api user
+        pool_size: Integer value of the database connections kept open
+    returns:
+        The werkzeug server, call shutdown() to stop it. The port is server.server_port
+    """
+    sys.modules['cerealWebapp.config'] = stand_in_config(folder,pool_size)
+    from .. import create_app
+    app = create_app()
+    with app.app_context():
+        seed_database(size,deletable,seed)
+        gen_user(username,generate_password_hash(password))
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='loadtest-server', daemon=True).start()
+    return server
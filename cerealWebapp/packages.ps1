@@ -4,4 +4,5 @@ pip install pandas
 pip install flask.helpers
 pip install flask_sqlalchemy
 pip install pyodbc
-pip install flask_httpauth
\ No newline at end of file
+pip install flask_httpauth
+pip install pillow
\ No newline at end of file
@@ -2,4 +2,50 @@ import urllib
 secret = 'secret-key-goes-here'
 dbstring = 'DRIVER={SQL Server};SERVER=localhost;PORT=1433;DATABASE=cereals;UID=sa;PWD=Password1!'
 params = urllib.parse.quote_plus(dbstring)
-db_uri = "mssql+pyodbc:///?odbc_connect=%s" % params
\ No newline at end of file
+db_uri = "mssql+pyodbc:///?odbc_connect=%s" % params
+
+#Optional, Cache-Control header per api read endpoint. Endpoints not listed use 'no-cache'
+api_cache_control = {'api.api_get_all_cereals' : 'no-cache',
+                     'api.api_get_cereal_id' : 'private, max-age=5',
+                     'api.api_filter_cereals' : 'no-cache'}
+
+#Optional, rows per executemany when bulk inserting cereals and if pyodbc fast_executemany is used on MSSQL
+bulk_insert_chunk_size = 1000
+fast_executemany = True
+
+#Optional, database connection pool. Connections kept open per worker process, extra connections allowed when they are all in use,
+#seconds to wait for a free connection, seconds before a connection is replaced and if connections are tested before they are used.
+#None keeps the SQLAlchemy default(5, 10 and 30 seconds)
+pool_size = 5
+max_overflow = 10
+pool_timeout = 30
+pool_recycle = 1800
+pool_pre_ping = True
+
+#Optional, background csv imports. Worker threads, max jobs waiting for a worker, the folder uploads are saved in while importing
+#and seconds a finished or failed job can be looked up before it and its files are removed
+import_workers = 2
+import_max_queued = 10
+import_spool_dir = None
+import_job_ttl = 86400
+
+#Optional, auth caches. Max entries and seconds a successful api password check or a loaded session user is cached, size 0 disables a cache
+credential_cache_size = 1024
+credential_cache_ttl = 300
+user_cache_size = 1024
+user_cache_ttl = 60
+
+#Optional, worker threads generating thumbnails of uploaded images(requires pillow)
+image_workers = 2
+
+#Optional, request metrics in the Prometheus text format on /metrics
+metrics_enabled = True
+
+#Optional, logging. Json lines file rotated at log_max_bytes with log_backup_count old files kept, lowest level logged,
+#share of info and debug records kept and max records waiting to be written before new records are dropped
+log_file = 'record.log'
+log_level = 'INFO'
+log_max_bytes = 10485760
+log_backup_count = 5
+log_info_sample_rate = 1.0
+log_queue_size = 10000
@@ -1,9 +1,19 @@
-from flask import Blueprint, request,jsonify
+from flask import Blueprint, request,jsonify,current_app,Response,stream_with_context,make_response,url_for,redirect
 from flask.helpers import send_from_directory
-from ..db.dbfunctions import  db_add_cereal, db_delete_cereal, db_get_all_cereals_as_df, db_get_cereal_imagepath, db_get_id_cereal_as_df, db_update_cereal
-from ..misc.helperfuncs import change_to_column_type
+from ..db.authdbfunctions import get_auth_cache_stats
+from ..db.pool import get_pool_stats
+from ..db.dbfunctions import  db_add_cereal, db_batch_delete_cereals, db_batch_update_cereals, db_delete_cereal, db_get_all_cereal_rows, db_get_cereal_cache_stats, db_get_cereal_detail, db_get_cereal_imagepath, db_get_cereal_nan_positions, db_get_cereal_rows_by_ids, db_get_cereal_stats, db_get_similar_cereals, db_get_cereal_table_version, db_get_cereals_page, db_get_filtered_cereal_rows, db_get_sorted_cereal_rows, db_iter_cereals, db_search_cereals, db_update_cereal
+from ..constants import ALLOWED_DATA_EXTENSIONS, CEREAL_HEADERS_WITH_ID, DEFAULT_CACHE_CONTROL, DEFAULT_SEARCH_LIMIT, DEFAULT_SIMILAR_COUNT, IMAGE_FORMATS, IMAGE_SIZES, MAX_BATCH_SIZE, MAX_PAGE_SIZE
+from ..misc.images import image_url
+from ..misc.serializer import compact_serializer, default_serializer
+from ..misc.sortfunctions import parse_sort
+from ..misc.helperfuncs import allowed_file, change_to_column_type
+from ..errors import ImportQueueFullError
+from ..imports.jobs import get_import_job, resume_import_job, start_import_job
+from functools import wraps
+from urllib.parse import urlencode
+import hashlib
 import re
-from ..misc.filterfunctions import filter_cereals
 from ..auth.auth import auth_api
 
 """
@@ -12,70 +22,422 @@ API blueprint file, all functions related to the /api/ part of the webpage are p
 
 api = Blueprint('api', __name__)
 
+def request_etag():
+    """
+    Returns the weak etag of the current request, derived from the cereal table version kept in the database and the normalized request path
+    and arguments. Every worker gives the same etag while the table is unchanged. None if the version could not be read
+    """
+    version = db_get_cereal_table_version()
+    if version is None:
+        return None
+    args = urlencode(sorted(request.args.items(multi=True)))
+    key = '%d|%s?%s' % (version, request.path, args)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def conditional_get(view):
+    """
+    Decorator for read endpoints, answers 304 Not Modified without calling the view when If-None-Match has the current etag.
+    Successful responses get the etag and the Cache-Control header configured for the endpoint in API_CACHE_CONTROL
+    """
+    @wraps(view)
+    def wrapper(*args,**kwargs):
+        etag = request_etag()
+        if etag is None:
+            return view(*args,**kwargs)
+        cache_control = current_app.config.get('API_CACHE_CONTROL',{}).get(request.endpoint,DEFAULT_CACHE_CONTROL)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args,**kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag,weak=True)
+        response.headers['Cache-Control'] = cache_control
+        return response
+    return wrapper
+
+def json_response(body):
+    """
+    Returns a json response of an already encoded body, the same response as jsonify gives
+    """
+    return Response(body + '\n', mimetype='application/json')
+
+def stream_ndjson(chunks):
+    """
+    Generator that turns chunks of cereal rows into newline delimited json, one cereal per line. Errors reading the chunks abort the response, see stream_json_array
+    """
+    for rows in chunks:
+        yield ''.join(cereal + '\n' for cereal in default_serializer.encode_rows(rows))
+
+def stream_json_array(chunks):
+    """
+    Generator that turns chunks of cereal rows into a single json array sent a chunk at a time. If reading the chunks fails the
+    error is raised before the closing ], the server then aborts the response so the client never gets a valid but truncated array
+    """
+    yield '['
+    first = True
+    for rows in chunks:
+        for cereal in default_serializer.encode_rows(rows):
+            if first:
+                first = False
+                yield cereal
+            else:
+                yield ',' + cereal
+    yield ']'
+
+#Checks for the pattern "<>!=" as the first char and an optional = afterwards and stores is in group 1. While == is accepted there is not a valid request
+#The second part checks for any word pattern to follow and is stored in group 2
+FILTER_PATTERN = re.compile(r'([<>!=]=?)([ -%,.\w]+)')
+
+def parse_filter(col,val):
+    """
+    Parses a filter argument of a request into a filter tuple
+    args:
+        col: String of the column being filtered
+        val: String with the operator first and the value being filtered at last, like "<=20"
+    returns:
+        Tuple of (column,operator,value) with the value translated to the type of the column
+    throws:
+        AttributeError: If val does not start with an operator
+        KeyError: If the column does not exist
+        ValueError: If the value can not be translated to the type of the column
+    """
+    res = FILTER_PATTERN.match(val)
+    op = res.group(1)
+    value = res.group(2)
+
+    #Translate the value to its proper type to make it compatable with the column
+    value = change_to_column_type(col,value)
+    return (col,op,value)
+
 @api.route('/api/cereals/',methods = ['GET'])
+@conditional_get
 def api_get_all_cereals():
     """
-    Get request endpoint that returns all cereal products from database as json with 200 status code
+    Get request endpoint that returns all cereal products from database as json with 200 status code.
+    Optional query arguments:
+        limit: Page size, returns {"cereals": [...], "next_after_id": id} where next_after_id is passed as after_id to get the next page, null on the last page
+        after_id: Id of the last cereal of the previous page
+        stream: "ndjson" or "json", streams every cereal after after_id as newline delimited json or a json array without loading the table into memory
+        sort: Comma separated columns, - in front of a column sorts it descending. Returns {"cereals": [...]} with the first limit cereals in that order,
+              can not be combined with after_id or stream
+    Returns 400 on invalid arguments
     """
-    df = db_get_all_cereals_as_df()
-    return jsonify(df.to_dict('index')), 200
+    limit = request.args.get('limit')
+    after_id = request.args.get('after_id')
+    stream = request.args.get('stream')
+    sort = request.args.get('sort')
+
+    #No arguments given, keep the original response of the whole table
+    if limit is None and after_id is None and stream is None and sort is None:
+        return json_response(compact_serializer.encode_table(db_get_all_cereal_rows())), 200
+
+    try:
+        if after_id is not None:
+            after_id = int(after_id)
+        if limit is not None:
+            limit = int(limit)
+            if limit < 1 or limit > MAX_PAGE_SIZE:
+                raise ValueError()
+    except ValueError:
+        return "", 400
+
+    if sort is not None:
+        if after_id is not None or stream is not None:
+            return "", 400
+        try:
+            sort = parse_sort(sort)
+        except (KeyError,ValueError):
+            return "", 400
+        rows = db_get_sorted_cereal_rows([],sort,MAX_PAGE_SIZE if limit is None else limit)
+        return json_response('{"cereals":%s}' % compact_serializer.encode_list(rows)), 200
+
+    if stream is not None:
+        if stream == 'ndjson':
+            generator = stream_ndjson(db_iter_cereals(after_id))
+            mimetype = 'application/x-ndjson'
+        elif stream == 'json':
+            generator = stream_json_array(db_iter_cereals(after_id))
+            mimetype = 'application/json'
+        else:
+            return "", 400
+        return Response(stream_with_context(generator), mimetype=mimetype), 200
+
+    if limit is None:
+        limit = MAX_PAGE_SIZE
+    rows, next_id = db_get_cereals_page(limit,after_id)
+    next_after_id = 'null' if next_id is None else str(int(next_id))
+    return json_response('{"cereals":%s,"next_after_id":%s}' % (compact_serializer.encode_list(rows),next_after_id)), 200
 
 @api.route('/api/cereals/<int:id>',methods = ['GET'])
+@conditional_get
 def api_get_cereal_id(id):
     """
     Get request endpoint with specific id integer value that 
     returns cereal json of the specified id, if id dosent exist it returns nothing with 204 status code
     """
     try:
-        df = db_get_id_cereal_as_df(id)
-        return (df.iloc[0].to_dict()), 200
+        detail = db_get_cereal_detail(id)
     except LookupError:
         return "", 204
+    if detail is None:
+        return "", 503
+    return json_response(compact_serializer.encode_row([detail[header] for header in CEREAL_HEADERS_WITH_ID])), 200
+
+def parse_batch_ids(ids):
+    """
+    Parses the ids of a batch request
+    args:
+        ids: String of comma separated ids or a list of ids
+    returns:
+        List of integer ids in the given order
+    throws:
+        ValueError: If an id is not an integer, there are no ids or more than MAX_BATCH_SIZE ids
+        TypeError: If ids is not a string or a list
+    """
+    if isinstance(ids,str):
+        ids = ids.split(',')
+    elif not isinstance(ids,list):
+        raise TypeError()
+    ids = [int(id) for id in ids]
+    if not ids or len(ids) > MAX_BATCH_SIZE:
+        raise ValueError()
+    return ids
+
+@api.route('/api/cereals/batch',methods = ['GET'])
+@conditional_get
+def api_get_cereal_batch():
+    """
+    Get request for many cereals in one request, the ids argument is a comma separated list of ids.
+    Returns json {"cereals": [...], "missing": [ids]} with the cereals in the order of the ids and the ids that dont exist, with a 200 status code
+    Returns nothing and 400 bad argument if ids is missing or ill formed, 503 on DB failure
+    """
+    try:
+        ids = parse_batch_ids(request.args.get('ids',''))
+    except (TypeError,ValueError):
+        return "", 400
+    found = db_get_cereal_rows_by_ids(ids)
+    if found is None:
+        return "", 503
+    rows = [found[id] for id in dict.fromkeys(ids) if id in found]
+    missing = [id for id in dict.fromkeys(ids) if id not in found]
+    return json_response('{"cereals":%s,"missing":[%s]}' % (compact_serializer.encode_list(rows),','.join(str(id) for id in missing))), 200
+
+@api.route('/api/cereals/batch',methods = ['PUT'])
+@auth_api.login_required
+def api_update_cereal_batch():
+    """
+    PUT request to update many cereals in one transaction, the json is a list of patches each with the id of the cereal and the fields being updated.
+    Requires user login info in the request
+    Returns json {"results": [{"id": id, "status": "updated"|"not_found"|"invalid", "reason": ...}]} in the order of the patches with a 200 status code,
+    invalid patches and ids that dont exist are skipped. Returns 400 if the json is not a list or has more than MAX_BATCH_SIZE patches, 503 on DB failure
+    """
+    patches = request.get_json(silent=True)
+    if not isinstance(patches,list) or not patches or len(patches) > MAX_BATCH_SIZE:
+        return "", 400
+    results = db_batch_update_cereals(patches)
+    if results is None:
+        return "", 503
+    return jsonify({'results' : results}), 200
+
+@api.route('/api/cereals/batch',methods = ['DELETE'])
+@auth_api.login_required
+def api_delete_cereal_batch():
+    """
+    DELETE request to delete many cereals in one transaction, the ids are a json list or the comma separated ids argument.
+    Requires user login info in the request
+    Returns json {"results": [{"id": id, "status": "deleted"|"not_found"}]} in the order of the ids with a 200 status code.
+    Returns 400 if the ids are missing or ill formed, 503 on DB failure
+    """
+    ids = request.get_json(silent=True)
+    if ids is None:
+        ids = request.args.get('ids','')
+    try:
+        ids = parse_batch_ids(ids)
+    except (TypeError,ValueError):
+        return "", 400
+    results = db_batch_delete_cereals(ids)
+    if results is None:
+        return "", 503
+    return jsonify({'results' : results}), 200
+
+def encode_similar(result):
+    """
+    Encodes the similar cereals of a cereal as json {"cereals": [...], "distances": [...]}, the distances are in the order of the cereals
+    """
+    rows = [row for (row,_) in result]
+    distances = ','.join(repr(round(distance,6)) for (_,distance) in result)
+    return '{"cereals":%s,"distances":[%s]}' % (compact_serializer.encode_list(rows),distances)
+
+def parse_similar_count():
+    """
+    Returns the k argument of a similar request, DEFAULT_SIMILAR_COUNT if it is not given
+    throws:
+        ValueError: If k is not an integer between 1 and MAX_PAGE_SIZE
+    """
+    k = int(request.args.get('k',DEFAULT_SIMILAR_COUNT))
+    if k < 1 or k > MAX_PAGE_SIZE:
+        raise ValueError()
+    return k
+
+@api.route('/api/cereals/<int:id>/similar',methods = ['GET'])
+@conditional_get
+def api_get_similar_cereals(id):
+    """
+    Get request for the cereals with the nutrition most similar to a cereal. Every nutrition value is standardized so they count the same and 
+    the cereals are ordered by the euclidean distance to the cereal
+    Optional query arguments:
+        k: Amount of similar cereals, default DEFAULT_SIMILAR_COUNT
+    Returns json {"cereals": [...], "distances": [...]} with a 200 status code, 204 if the id dosent exist
+    Returns nothing and 400 bad argument if k is invalid, 503 on DB failure
+    """
+    try:
+        k = parse_similar_count()
+    except ValueError:
+        return "", 400
+    results = db_get_similar_cereals([id],k)
+    if results is None:
+        return "", 503
+    if results[0] is None:
+        return "", 204
+    return json_response(encode_similar(results[0])), 200
+
+@api.route('/api/cereals/similar',methods = ['GET'])
+@conditional_get
+def api_get_similar_cereals_batch():
+    """
+    Get request for the similar cereals of many cereals at once, the ids argument is a comma separated list of ids, see api_get_similar_cereals
+    Optional query arguments:
+        k: Amount of similar cereals per cereal, default DEFAULT_SIMILAR_COUNT
+    Returns json {"results": [{"id": id, "cereals": [...], "distances": [...]}], "missing": [ids]} in the order of the ids with a 200 status code
+    Returns nothing and 400 bad argument if ids is missing or ill formed or k is invalid, 503 on DB failure
+    """
+    try:
+        ids = list(dict.fromkeys(parse_batch_ids(request.args.get('ids',''))))
+        k = parse_similar_count()
+    except (TypeError,ValueError):
+        return "", 400
+    results = db_get_similar_cereals(ids,k)
+    if results is None:
+        return "", 503
+    encoded = ['{"id":%d,%s' % (id,encode_similar(result)[1:]) for (id,result) in zip(ids,results) if result is not None]
+    missing = [str(id) for (id,result) in zip(ids,results) if result is None]
+    return json_response('{"results":[%s],"missing":[%s]}' % (','.join(encoded),','.join(missing))), 200
 
 @api.route('/api/cereals/filter',methods = ['GET'])
+@conditional_get
 def api_filter_cereals():
     """
     Get request for filtering the cereal database. A filter request is a get request of key,value pair. The key is the column and value is a string with 
     the operator being the first(and second if a <= type operator) character, and the remaining chars of the string being the value being filtered at
     Returns json with the cereals that furfils the filters with a 200 status code on success
     Returns nothing and 400 bad argument if ill formed request
+    Optional arguments that are not filters:
+        sort: Comma separated columns, - in front of a column sorts it descending. The cereals are keyed by their position in the sort order
+        limit: Max amount of cereals returned, without sort the cereals with the lowest ids are returned
     """
 
-    #Checks for the pattern "<>!=" as the first char and an optional = afterwards and stores is in group 1. While == is accepted there is not a valid request
-    #The second part checks for any word pattern to follow and is stored in group 2
-    prog = re.compile(r'([<>!=]=?)([ -%,.\w]+)')
-
     #Get arguments
     filters = request.args
     try:
         #List of tuples (column,operator,value)
         args = []
+        sort = None
+        limit = None
         #Package the args for the filter function
         for (col,val) in filters.items():
-            res = prog.match(val)
-            op = res.group(1)
-            value = res.group(2)
-
-            #Translate the value to its proper type to make it compatable for pandas function
-            value = change_to_column_type(col,value)
-            args.append((col,op,value))
-
-        #Arguments are valid pass them create DF and pass to filter function
-        df = db_get_all_cereals_as_df()
-        df = filter_cereals(df,args)
-        if df.empty:
+            if col == 'sort':
+                sort = parse_sort(val)
+                continue
+            if col == 'limit':
+                limit = int(val)
+                if limit < 1:
+                    raise ValueError()
+                continue
+            args.append(parse_filter(col,val))
+
+        #Sorted or limited, only the first rows in sort order are picked
+        if sort is not None or limit is not None:
+            rows = db_get_sorted_cereal_rows(args,sort or [],limit)
+            if not rows:
+                return "", 204
+            return json_response(compact_serializer.encode_table(rows,nan_positions=db_get_cereal_nan_positions())), 200
+
+        #Arguments are valid, the database does the filtering and only returns the matching rows
+        (keys,rows) = db_get_filtered_cereal_rows(args)
+        if not rows:
             return "", 204
-        return jsonify(df.to_dict('index')), 200
+        #The columns are written like the DataFrame of the whole table had them, not only of the matching rows
+        return json_response(compact_serializer.encode_table(rows,keys,db_get_cereal_nan_positions())), 200
     except:
         return "", 400
 
+@api.route('/api/cereals/search',methods = ['GET'])
+@conditional_get
+def api_search_cereals():
+    """
+    Get request for searching the cereal names, the q argument is the text searched for. Names equal to q are first, then names starting with q,
+    names with words starting with the words of q, names containing q and last names that are close to q, so typos still find the cereal.
+    Optional query arguments:
+        limit: Max amount of cereals returned, default DEFAULT_SEARCH_LIMIT
+    Returns json {"cereals": [...]} in ranked order with a 200 status code
+    Returns nothing and 400 bad argument if q is missing or limit is invalid, 503 on DB failure
+    """
+    query = request.args.get('q','')
+    try:
+        limit = int(request.args.get('limit',DEFAULT_SEARCH_LIMIT))
+        if not query.strip() or limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError()
+    except ValueError:
+        return "", 400
+    rows = db_search_cereals(query,limit)
+    if rows is None:
+        return "", 503
+    return json_response('{"cereals":%s}' % compact_serializer.encode_list(rows)), 200
+
+@api.route('/api/cereals/stats',methods = ['GET'])
+@conditional_get
+def api_get_cereal_stats():
+    """
+    Get request for the count, mean, standard deviation, min and max of the calories, sugars and rating of the cereals grouped by mfr, type or shelf.
+    The group_by argument is required, every other argument is a filter with the same syntax as api_filter_cereals
+    Returns json {"group_by": column, "groups": [{"group": value, "count": cereals, "calories": {...}, ...}]} with a 200 status code,
+    the groups are ordered by their value and the group of cereals missing the value is last
+    Returns nothing and 400 bad argument if ill formed request, 503 on DB failure
+    """
+    group_by = request.args.get('group_by')
+    try:
+        args = [parse_filter(col,val) for (col,val) in request.args.items() if col != 'group_by']
+        stats = db_get_cereal_stats(group_by,args)
+    except:
+        return "", 400
+    if stats is None:
+        return "", 503
+    groups = []
+    for (key,group) in stats:
+        groups.append({'group' : key, **group})
+    return jsonify({'group_by' : group_by, 'groups' : groups}), 200
+
 @api.route('/api/cereals/getimage/<int:id>',methods = ['GET'])
 def api_get_image(id):
     """
-    GET request for getting a image, returns the image from a given id, and 204 on no file
+    GET request for getting a image, returns the image from a given id, and 204 on no file.
+    With the size argument(thumb, medium or original) it redirects to the content hashed url of that size, which is cached forever.
+    The format argument(jpeg or webp) picks the derivative format, without it webp is used if the client accepts it.
+    The original is used while the derivatives are being generated. Returns 400 on invalid size or format
     """
+    size = request.args.get('size')
+    image_format = request.args.get('format')
+    if size is not None and size != 'original' and size not in IMAGE_SIZES:
+        return "",400
+    if image_format is None:
+        image_format = 'webp' if request.accept_mimetypes['image/webp'] else 'jpeg'
+    elif image_format not in IMAGE_FORMATS:
+        return "",400
     try:
         filename = db_get_cereal_imagepath(id)
+        if size is not None:
+            return redirect(image_url(filename,size,image_format))
         return send_from_directory('static', path=filename, as_attachment=True), 200
     except LookupError:
         return "",204
@@ -133,3 +495,69 @@ def api_update_cereal(id):
         return "",204
     except ValueError:
         return "",400
+
+
+@api.route('/api/imports/', methods=['POST'])
+@auth_api.login_required
+def api_start_import():
+    """
+    POST request with a csv file in the "file" field, queues a background import of the file. Requires user auth
+    returns 202 with the job id and status url, 400 if no csv file is given and 503 if too many imports are queued
+    """
+    file = request.files.get('file')
+    if file is None or not allowed_file(file.filename,ALLOWED_DATA_EXTENSIONS):
+        return "",400
+    try:
+        job = start_import_job(file)
+    except ImportQueueFullError:
+        return "",503
+    return jsonify({'job_id' : job.id, 'status' : url_for('api.api_get_import_job', job_id=job.id)}), 202
+
+@api.route('/api/imports/<string:job_id>', methods=['GET'])
+@auth_api.login_required
+def api_get_import_job(job_id):
+    """
+    GET request for the status of an import job, returns the state, rows processed, rows rejected and throughput as json with 200, 404 if the job dosent exist.
+    Requires user auth, the rejected rows are from the uploaded file
+    """
+    try:
+        job = get_import_job(job_id)
+    except LookupError:
+        return "",404
+    return jsonify(job.to_dict()), 200
+
+@api.route('/api/imports/<string:job_id>/resume', methods=['POST'])
+@auth_api.login_required
+def api_resume_import_job(job_id):
+    """
+    POST request that resumes a failed import job from its last committed chunk. Requires user auth
+    returns 202 when queued, 404 if the job dosent exist, 409 if the job has not failed and 503 if too many imports are queued
+    """
+    try:
+        job = resume_import_job(job_id)
+    except LookupError:
+        return "",404
+    except ValueError:
+        return "",409
+    except ImportQueueFullError:
+        return "",503
+    return jsonify({'job_id' : job.id, 'status' : url_for('api.api_get_import_job', job_id=job.id)}), 202
+
+@api.route('/api/internal/caches', methods=['GET'])
+@auth_api.login_required
+def api_get_cache_stats():
+    """
+    GET request that returns the hit, miss and eviction counters of the in process caches as json with 200. Requires user auth
+    """
+    stats = get_auth_cache_stats()
+    stats['cereals'] = db_get_cereal_cache_stats()
+    return jsonify(stats), 200
+
+@api.route('/api/internal/pool', methods=['GET'])
+@auth_api.login_required
+def api_get_pool_stats():
+    """
+    GET request that returns the checked out, idle and overflow connections of the database connection pool, its event counters
+    and a histogram of the seconds spent getting a connection as json with 200. Requires user auth
+    """
+    return jsonify(get_pool_stats()), 200
@@ -39,14 +39,14 @@ def login_post():
     # Check for user, if wrong we send them back with a message that it is wrong
     login_status = check_user(name,pwd)
     if not login_status:
-        current_app.logger.info('%s failed to login' % name)
+        current_app.logger.info('%s failed to login', name)
         flash('Invalid login credentials')
         return redirect(url_for('auth.login')) 
-    current_app.logger.info('%s failed to authenticated on api' % login_status)
+    current_app.logger.info('%s failed to authenticated on api', login_status)
     user = get_user(name)
     #Login user, return to main index
     login_user(user, remember=remember)
-    current_app.logger.info('%s Logged in successfully' % name)
+    current_app.logger.info('%s Logged in successfully', name)
     return redirect(url_for('main.index'))
 
 
@@ -76,6 +76,6 @@ def signup_post():
 def logout():
     name = current_user.name
     logout_user()
-    current_app.logger.info('%s logged out' % name)
+    current_app.logger.info('%s logged out', name)
     return redirect(url_for('main.index'))
 
@@ -1,5 +1,13 @@
 #Allowed extensions for file uploads for cereals pictures
 ALLOWED_IMAGE_EXTENSIONS = {'jfif', 'png', 'jpg', 'jpeg'}
+#Amount of hex characters of the content hash used as the filename of uploaded images
+CONTENT_HASH_LENGTH = 16
+#Max width and height in pixels of the generated image derivatives, keyed by the size name used in the api
+IMAGE_SIZES = {'thumb' : 150, 'medium' : 600}
+#Formats the image derivatives are generated in, format name to file extension
+IMAGE_FORMATS = {'jpeg' : 'jpg', 'webp' : 'webp'}
+#Cache-Control of content hashed files, their content can never change under the same name
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
 #Allowed extensions for bulk upload of new entries
 ALLOWED_DATA_EXTENSIONS = {'csv'}
 #The valid strings for the "types" field in the cereal model
@@ -12,6 +20,36 @@ CEREAL_HEADERS_WITH_ID = ['id', 'name', 'mfr', 'type', 'calories', 'protein', 'f
 #List of the header names for the cereals model, id not included(Used for uploading new cereals as ID is assigned from DB)
 CEREAL_HEADERS_WITHOUT_ID = ['name', 'mfr', 'type', 'calories', 'protein', 'fat', 'sodium', 'fiber', 'carbo',
                              'sugars', 'potass', 'vitamins', 'shelf', 'weight', 'cups', 'rating']
+#Largest page size a client can request from the paginated cereal endpoint
+MAX_PAGE_SIZE = 1000
+#Page sizes offered on the cereal list page
+LIST_PAGE_SIZES = (25, 50, 100, 250)
+#Amount of cereals on a list page when no page size is chosen
+DEFAULT_LIST_PAGE_SIZE = 50
+#Amount of template pieces rendered before they are sent when a page is streamed
+TEMPLATE_STREAM_BUFFER = 100
+#Default amount of cereals returned by a name search
+DEFAULT_SEARCH_LIMIT = 20
+#Default amount of similar cereals returned per cereal
+DEFAULT_SIMILAR_COUNT = 10
+#Amount of rows fetched from the database cursor at a time when streaming cereals
+STREAM_CHUNK_SIZE = 1000
+#Max amount of ids found with the sorted indexes that are fetched with an id lookup, larger results are filtered by the database instead
+INDEX_LOOKUP_LIMIT = 1000
+#Default amount of rows sent per executemany when bulk inserting cereals
+BULK_INSERT_CHUNK_SIZE = 1000
+#Max amount of ids or patches in one batch request
+MAX_BATCH_SIZE = 10000
+#Max amount of ids in one IN (...) of a batch statement, SQL Server allows at most 2100 parameters in a statement
+BATCH_IN_CHUNK_SIZE = 1000
+#Upper bounds in seconds of the histogram buckets of the time spent waiting for a database connection
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+#Upper bounds in seconds of the histogram buckets of request latency and database time per request
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+#Upper bounds in bytes of the histogram buckets of response sizes
+RESPONSE_SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+#Cache-Control header of the api read endpoints that are not set in the api_cache_control config, clients have to revalidate with the etag
+DEFAULT_CACHE_CONTROL = 'no-cache'
 #
 FILTER_OPERATORS = {'eq' : '=', 'noteq' : '!=', 'less' : '<', 'greater' : '>', 'lesseq' : '<=', 'greatereq' : '>=' }
 
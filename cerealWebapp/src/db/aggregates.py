@@ -0,0 +1,228 @@
+import math
+from ..constants import CEREAL_HEADERS_WITH_ID
+from .structure import CerealStructure
+
+"""
+Running aggregates of the cereal nutrition values per manufacturer, type and shelf. Every group keeps the count, sum, sum of squares,
+min and max of each stat column, so the stats of a group are read without looking at its rows. The aggregates are kept up to date by
+the write functions in dbfunctions, a delete or update that removes the min or max of a group marks it stale and it is recomputed from the table
+"""
+
+#Columns the cereals can be grouped by
+STATS_GROUP_COLUMNS = ['mfr','type','shelf']
+#Columns the stats are computed for
+STATS_COLUMNS = ['calories','sugars','rating']
+
+
+def is_missing(value):
+    """
+    Returns True for missing values, None in rows and NaN in DataFrames
+    """
+    return value is None or value != value
+
+
+class RunningStat():
+    """
+    Count, sum, sum of squares, min and max of the values of one column in a group
+    """
+    __slots__ = ('count','total','squares','min','max','stale')
+
+    def __init__(self,count=0,total=0,squares=0.0,min=None,max=None):
+        self.count = count
+        self.total = total
+        self.squares = squares
+        self.min = min
+        self.max = max
+        #True when a removed value was the min or max, the min and max have to be recomputed from the table
+        self.stale = False
+
+    def add(self,value):
+        """
+        Adds a value, missing values are not counted
+        """
+        if is_missing(value):
+            return
+        self.count += 1
+        self.total += value
+        self.squares += float(value) * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def remove(self,value):
+        """
+        Removes a value that was added before, the min and max can not be known without the other values if it was one of them
+        """
+        if is_missing(value):
+            return
+        self.count -= 1
+        self.total -= value
+        self.squares -= float(value) * value
+        if self.count == 0:
+            self.total = 0
+            self.squares = 0.0
+            self.min = None
+            self.max = None
+            self.stale = False
+        elif value == self.min or value == self.max:
+            self.stale = True
+
+    def to_dict(self):
+        """
+        Returns the count, mean, population standard deviation, min and max. The mean and standard deviation are None without values
+        """
+        if self.count == 0:
+            return {'count' : 0, 'mean' : None, 'std' : None, 'min' : None, 'max' : None}
+        mean = self.total / self.count
+        #Rounding can make the variance slightly negative when every value is the same
+        variance = max(self.squares / self.count - mean * mean, 0.0)
+        return {'count' : self.count, 'mean' : mean, 'std' : math.sqrt(variance), 'min' : self.min, 'max' : self.max}
+
+
+class GroupStats():
+    """
+    The amount of cereals in a group and a RunningStat for every column in STATS_COLUMNS
+    """
+    __slots__ = ('count','stats')
+
+    def __init__(self):
+        self.count = 0
+        self.stats = {col : RunningStat() for col in STATS_COLUMNS}
+
+    @property
+    def stale(self):
+        return any(stat.stale for stat in self.stats.values())
+
+    def add_row(self,row):
+        """
+        Adds a row ordered as CEREAL_HEADERS_WITH_ID
+        """
+        self.count += 1
+        for (col,stat) in self.stats.items():
+            stat.add(row[CEREAL_HEADERS_WITH_ID.index(col)])
+
+    def remove_row(self,row):
+        """
+        Removes a row ordered as CEREAL_HEADERS_WITH_ID
+        """
+        self.count -= 1
+        for (col,stat) in self.stats.items():
+            stat.remove(row[CEREAL_HEADERS_WITH_ID.index(col)])
+
+    def to_dict(self):
+        """
+        Returns the amount of cereals and the stats of every column
+        """
+        result = {'count' : self.count}
+        for (col,stat) in self.stats.items():
+            result[col] = stat.to_dict()
+        return result
+
+
+def aggregate_rows(rows,group_by):
+    """
+    Computes the stats of every group of a list of rows
+    args:
+        rows: Iterable of rows ordered as CEREAL_HEADERS_WITH_ID
+        group_by: String of the column to group by, must be in STATS_GROUP_COLUMNS
+    returns:
+        Dictionary of group value to GroupStats
+    """
+    pos = CEREAL_HEADERS_WITH_ID.index(group_by)
+    groups = dict()
+    for row in rows:
+        key = None if is_missing(row[pos]) else row[pos]
+        if key not in groups:
+            groups[key] = GroupStats()
+        groups[key].add_row(row)
+    return groups
+
+def sorted_groups(groups):
+    """
+    Returns the (group value,GroupStats) pairs of a dictionary of groups ordered by the group value, the group of missing values is last
+    """
+    return sorted(groups.items(), key=lambda item: (item[0] is None, item[0] if item[0] is not None else 0))
+
+
+class CerealAggregates(CerealStructure):
+    """
+    The running aggregates of every column in STATS_GROUP_COLUMNS. The aggregates are empty until loaded with build, see CerealStructure.
+    build takes a dictionary of every column in STATS_GROUP_COLUMNS to a dictionary of group value to GroupStats of the whole table
+    """
+
+    def _clear(self):
+        self.groups = {col : dict() for col in STATS_GROUP_COLUMNS}
+
+    def _prepare(self,groups):
+        return groups
+
+    def _load(self,groups):
+        self.groups = groups
+
+    def _add(self,row):
+        for (col,groups) in self.groups.items():
+            key = row[CEREAL_HEADERS_WITH_ID.index(col)]
+            key = None if is_missing(key) else key
+            if key not in groups:
+                groups[key] = GroupStats()
+            groups[key].add_row(row)
+
+    def _remove(self,row):
+        for (col,groups) in self.groups.items():
+            key = row[CEREAL_HEADERS_WITH_ID.index(col)]
+            key = None if is_missing(key) else key
+            group = groups.get(key)
+            if group is None:
+                continue
+            group.remove_row(row)
+            if group.count <= 0:
+                del groups[key]
+
+    def _insert_rows(self,rows):
+        for row in rows:
+            self._add(row)
+
+    def _delete_rows(self,rows):
+        for row in rows:
+            self._remove(row)
+
+    def _update_row(self,old_row,new_row):
+        #The old values are removed and the new values added
+        self._remove(old_row)
+        self._add(new_row)
+
+    def stale_groups(self,group_by):
+        """
+        Returns the group values of group_by where a min or max has to be recomputed
+        """
+        with self.lock:
+            return [key for (key,group) in self.groups[group_by].items() if group.stale]
+
+    def replace_group(self,group_by,key,group,version):
+        """
+        Replaces the stats of a group with stats recomputed from the table at a version, a group that no longer has cereals is removed.
+        Nothing is replaced if the aggregates are not at that version
+        """
+        with self.lock:
+            if self.version != version:
+                return
+            if group is None or group.count == 0:
+                self.groups[group_by].pop(key,None)
+            else:
+                self.groups[group_by][key] = group
+
+    def stats(self,group_by,matches=None):
+        """
+        Returns the stats of the groups of group_by
+        args:
+            group_by: String of the column to group by, must be in STATS_GROUP_COLUMNS
+            matches: Function that takes a group value and returns if the group is included, None includes every group
+        returns:
+            List of tuples (group value,dictionary of the stats, see GroupStats.to_dict) ordered by the group value, None if one of the groups is stale
+        """
+        with self.lock:
+            groups = [(key,group) for (key,group) in sorted_groups(self.groups[group_by]) if matches is None or matches(key)]
+            if any(group.stale for (_,group) in groups):
+                return None
+            return [(key,group.to_dict()) for (key,group) in groups]
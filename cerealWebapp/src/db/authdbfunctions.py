@@ -1,20 +1,98 @@
 from flask import current_app
 from .models import User
 from ... import db
+from ..misc.ttlcache import TTLCache
 from werkzeug.security import check_password_hash
+import hashlib
+import hmac
+import threading
+
+#Caches of successful password checks and of users loaded for sessions, created from the config the first time they are used
+_auth_caches = dict()
+_auth_caches_lock = threading.Lock()
+
+def get_credential_cache():
+    """
+    Returns the cache of successful password checks, keys are credential_key digests and values are (username,hash_key of the password hash) tuples
+    """
+    with _auth_caches_lock:
+        if 'credentials' not in _auth_caches:
+            _auth_caches['credentials'] = TTLCache(current_app.config.get('CREDENTIAL_CACHE_SIZE',1024),
+                                                   current_app.config.get('CREDENTIAL_CACHE_TTL',300))
+        return _auth_caches['credentials']
+
+def get_user_cache():
+    """
+    Returns the cache of users loaded for login sessions, keys are the user ids and values are User objects detached from the DB session.
+    Nothing evicts a changed or deleted user, the cached user is used for at most USER_CACHE_TTL seconds
+    """
+    with _auth_caches_lock:
+        if 'users' not in _auth_caches:
+            _auth_caches['users'] = TTLCache(current_app.config.get('USER_CACHE_SIZE',1024),
+                                             current_app.config.get('USER_CACHE_TTL',60))
+        return _auth_caches['users']
+
+def get_auth_cache_stats():
+    """
+    Returns a dictionary with the hit, miss and eviction counters of the credential and user caches
+    """
+    return {'credentials' : get_credential_cache().stats(), 'users' : get_user_cache().stats()}
+
+def credential_key(username,password):
+    """
+    Returns the cache key of a username and password, a keyed digest so the cache never holds the password
+    """
+    message = ('%s\0%s' % (username,password)).encode()
+    return hmac.new(current_app.config['SECRET_KEY'].encode(), message, hashlib.sha256).hexdigest()
+
+def hash_key(pwd_hash):
+    """
+    Returns a keyed digest of a stored password hash, a cached password check is only used while the hash in the DB has the same digest
+    """
+    return hmac.new(current_app.config['SECRET_KEY'].encode(), pwd_hash.encode(), hashlib.sha256).hexdigest()
 
 def check_user(username,password):
+    cache = get_credential_cache()
+    key = credential_key(username,password)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == username:
+        #The password hash is read again so a deleted user or changed password is not accepted from the cache,
+        #also when it was changed by another process or outside the webapp. Comparing the digests is much cheaper than checking the password
+        pwd_hash = db.session.query(User.pwd).filter_by(name=username).scalar()
+        if pwd_hash is not None and hmac.compare_digest(cached[1],hash_key(pwd_hash)):
+            return username
+        cache.evict(lambda entry_key,value: entry_key == key)
     user = User.query.filter_by(name=username).first()
     if user and check_password_hash(user.pwd, password):
+        cache.set(key,(username,hash_key(user.pwd)))
         return username
-    current_app.logger.info('%s failed to authenticated on api' % username)
+    current_app.logger.info('%s failed to authenticated on api', username)
 
 def get_user(username):
     user = User.query.filter_by(name=username).first()
     return user
 
+def load_user_by_id(user_id):
+    """
+    Returns the user of a login session, served from the user cache when possible
+    args:
+        user_id: Integer value of the user id
+    returns:
+        User object or None if the user dosent exist
+    """
+    cache = get_user_cache()
+    user = cache.get(user_id)
+    if user is not None:
+        return user
+    user = db.session.get(User,user_id)
+    if user is not None:
+        #Detached so the cached object can be shared by requests after this session ends
+        db.session.expunge(user)
+        cache.set(user_id,user)
+    return user
+
 def gen_user(username,password):
     new_user = User(name=username, pwd=password)
     db.session.add(new_user)
     db.session.commit()
-    current_app.logger.info('%s added as a user to DB' % username)
+    current_app.logger.info('%s added as a user to DB', username)
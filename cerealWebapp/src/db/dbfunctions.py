@@ -1,29 +1,644 @@
 from flask import current_app
-from ..constants import CEREAL_HEADERS_WITH_ID
-from ..misc.helperfuncs import get_cereal_value, set_cereal_value
+from ..constants import BATCH_IN_CHUNK_SIZE, BULK_INSERT_CHUNK_SIZE, CEREAL_HEADERS_WITH_ID, CEREAL_HEADERS_WITHOUT_ID, INDEX_LOOKUP_LIMIT, STREAM_CHUNK_SIZE
+from ..misc.helperfuncs import change_to_column_type, get_cereal_value, read_csv_chunks, set_cereal_value, validate_cereal_row
+from ..misc.filterfunctions import SQL_OPERATORS, filter_to_sql
+from ..misc.sortfunctions import sort_to_sql, top_rows
+from ..misc.columnstore import CerealColumnStore
+from ..misc.serializer import nan_positions_of_counts, table_nan_positions
 from ... import db
-from ..db.models import Cereal, CerealPicture
-import pandas as pd
+from ..db.models import Cereal, CerealPicture, CerealVersion, ImportProgress
+from .indexes import CerealIndexes
+from .search import CerealNameIndex
+from .similarity import SIMILARITY_COLUMNS, CerealFeatureMatrix
+from .aggregates import STATS_COLUMNS, STATS_GROUP_COLUMNS, CerealAggregates, GroupStats, RunningStat, aggregate_rows, sorted_groups
 import sqlalchemy
+import threading
 """
 File for all database functions
 """
 
+#In process snapshot of the cereal table, it is only used while the table is at the version the snapshot was loaded at
+_cereal_cache_lock = threading.Lock()
+#rows is the snapshot as a list of row tuples, df and store are built from it when first needed.
+#nan_positions are the columns with missing values of the table at nan_version, see db_get_cereal_nan_positions
+_cereal_cache = {'version' : None, 'rows' : None, 'df' : None, 'store' : None, 'nan_version' : None, 'nan_positions' : None,
+                 'hits' : 0, 'misses' : 0}
+
+def db_get_cereal_table_version():
+    """
+    Returns the version of the cereal table kept in the cerealversion table, the value increases every time the table is written to by any process
+    returns:
+        Integer value of the version, None on DB failure
+    """
+    stmt = sqlalchemy.select(CerealVersion.version).where(CerealVersion.id == 1)
+    try:
+        return db.session.execute(stmt).scalar()
+    except (sqlalchemy.exc.OperationalError,sqlalchemy.exc.ProgrammingError):
+        current_app.logger.critical('DB Error occured when getting cereal table version')
+        return None
+
+def begin_cereal_write():
+    """
+    Bumps the cereal table version, must be the first statement of every transaction that writes to the cereal table. The version row stays locked
+    until the transaction ends, so rows read after this are not changed by anyone else before the commit
+    returns:
+        Integer value of the version of the table before the write
+    throws:
+        sqlalchemy.exc.OperationalError: On DB failure
+    """
+    table = CerealVersion.__table__
+    db.session.execute(table.update().where(table.c.id == 1).values(version=table.c.version + 1))
+    return db.session.execute(sqlalchemy.select(table.c.version).where(table.c.id == 1)).scalar() - 1
+
+def commit_cereal_write():
+    """
+    Commits a transaction started with begin_cereal_write
+    returns:
+        Integer value of the version of the table after the write, triggers on the cereal table can have bumped it more than once
+    throws:
+        sqlalchemy.exc.OperationalError: On DB failure
+    """
+    version = db.session.execute(sqlalchemy.select(CerealVersion.version).where(CerealVersion.id == 1)).scalar()
+    db.session.commit()
+    return version
+
+def db_get_cereal_cache_stats():
+    """
+    Returns a dictionary with the version, hit and miss counters of the cereal table cache and if a snapshot is currently cached
+    """
+    with _cereal_cache_lock:
+        return {'version' : _cereal_cache['version'], 'hits' : _cereal_cache['hits'], 
+                'misses' : _cereal_cache['misses'], 'cached' : _cereal_cache['rows'] is not None}
+
+def db_invalidate_cereal_cache():
+    """
+    Drops the cached snapshot, called after every commit of this process that changes the cereal table
+    """
+    with _cereal_cache_lock:
+        _cereal_cache['version'] = None
+        _cereal_cache['rows'] = None
+        _cereal_cache['df'] = None
+        _cereal_cache['store'] = None
+        _cereal_cache['nan_version'] = None
+        _cereal_cache['nan_positions'] = None
+
+#In memory structures kept up to date by the write functions, each is a CerealStructure
+#Rows are lists of cereal values ordered as CEREAL_HEADERS_WITH_ID
+_cereal_listeners = []
+_cereal_indexes = CerealIndexes()
+_cereal_listeners.append(_cereal_indexes)
+_cereal_aggregates = CerealAggregates()
+_cereal_listeners.append(_cereal_aggregates)
+_cereal_name_index = CerealNameIndex()
+_cereal_listeners.append(_cereal_name_index)
+_cereal_features = CerealFeatureMatrix()
+_cereal_listeners.append(_cereal_features)
+
+def notify_cereal_write(before,after,inserted=(),deleted=(),updated=()):
+    """
+    Invalidates the table cache and updates the in memory structures after a commit that changed the cereal table
+    args:
+        before: Integer value of the table version before the write, see begin_cereal_write
+        after: Integer value of the table version after the write, see commit_cereal_write
+        inserted: List of rows that were added
+        deleted: List of rows that were deleted
+        updated: List of (old_row,new_row) tuples of updated cereals
+    """
+    db_invalidate_cereal_cache()
+    for listener in _cereal_listeners:
+        listener.apply_write(before,after,inserted,deleted,updated)
+
+def db_reset_cereal_structures():
+    """
+    Invalidates the table cache and drops the in memory structures, used when the cereal table was changed without 
+    knowing which rows changed. The structures are built again from the table the next time they are needed
+    """
+    db_invalidate_cereal_cache()
+    for listener in _cereal_listeners:
+        listener.reset()
+
+def db_get_cereal_structure(structure,load,name):
+    """
+    Returns an in memory structure matching the current version of the cereal table. If the table changed since the structure was built,
+    by a write it did not see, it is built again from the table. The version is read before and after loading so a structure is never built
+    from rows missing a write
+    args:
+        structure: CerealStructure being returned
+        load: Function reading the table and returning what build of the structure takes, None on DB failure
+        name: String naming the structure in the log
+    returns:
+        The structure, None on DB failure or if the table was written to while it was loaded
+    """
+    version = db_get_cereal_table_version()
+    if version is None:
+        return None
+    if structure.is_current(version):
+        return structure
+    try:
+        data = load()
+    except sqlalchemy.exc.OperationalError:
+        current_app.logger.critical('DB Error occured when building cereal %s', name)
+        return None
+    #A write during the load could be missing from the data, the next call tries again
+    if data is None or db_get_cereal_table_version() != version:
+        return None
+    structure.build(data,version)
+    current_app.logger.info('Built cereal %s at table version %d', name, version)
+    return structure
+
+def db_get_cereal_indexes():
+    """
+    Returns the sorted secondary indexes of the numeric columns, see db_get_cereal_structure
+    returns:
+        CerealIndexes or None on DB failure
+    """
+    def load():
+        return db.session.execute(sqlalchemy.select(*cereal_columns())).all()
+    return db_get_cereal_structure(_cereal_indexes,load,'indexes')
+
+def db_get_cereal_name_index():
+    """
+    Returns the search index of the cereal names, see db_get_cereal_structure
+    returns:
+        CerealNameIndex or None on DB failure
+    """
+    def load():
+        return db.session.execute(sqlalchemy.select(Cereal.id,Cereal.name)).all()
+    return db_get_cereal_structure(_cereal_name_index,load,'name index')
+
+def db_search_cereals(query,limit):
+    """
+    Returns the cereals with the names best matching a search query, see CerealNameIndex.search for the ranking
+    args:
+        query: String searched for
+        limit: Integer value of the max amount of cereals
+    returns:
+        List of row tuples ordered as CEREAL_HEADERS_WITH_ID in ranked order, None on DB failure
+    """
+    index = db_get_cereal_name_index()
+    if index is None:
+        return None
+    ids = index.search(query,limit)
+    if not ids:
+        return []
+    found = db_get_cereal_rows_by_ids(ids)
+    if found is None:
+        return None
+    #A cereal deleted after the index was checked can be in the index but not in the table
+    return [found[id] for id in ids if id in found]
+
+def db_get_cereal_feature_matrix():
+    """
+    Returns the nutrition feature matrix used to find similar cereals, see db_get_cereal_structure
+    returns:
+        CerealFeatureMatrix or None on DB failure
+    """
+    columns = [Cereal.__table__.c[col] for col in ['id'] + SIMILARITY_COLUMNS]
+    def load():
+        return db.session.execute(sqlalchemy.select(*columns)).all()
+    return db_get_cereal_structure(_cereal_features,load,'feature matrix')
+
+def db_get_similar_cereals(ids,k):
+    """
+    Returns the k cereals with the nutrition most similar to each of the given cereals, see CerealFeatureMatrix.nearest
+    args:
+        ids: List of integer ids of the cereals to find similar cereals for
+        k: Integer value of the amount of similar cereals per cereal
+    returns:
+        List with an entry per id, None if the cereal does not exist, otherwise a list of (row tuple ordered as CEREAL_HEADERS_WITH_ID,distance)
+        tuples ordered by distance. None on DB failure
+    """
+    matrix = db_get_cereal_feature_matrix()
+    if matrix is None:
+        return None
+    results = matrix.nearest(ids,k)
+    found = db_get_cereal_rows_by_ids([id for result in results if result for (id,_) in result])
+    if found is None:
+        return None
+    #A cereal deleted after the matrix was checked can be in the matrix but not in the table
+    return [None if result is None else [(found[id],distance) for (id,distance) in result if id in found] for result in results]
+
+def db_query_cereal_group_stats(group_by,args):
+    """
+    Computes the stats of the groups of the cereals matching a list of filters in the database with a GROUP BY
+    args:
+        group_by: String of the column to group by, must be in STATS_GROUP_COLUMNS
+        args: List of tuples with (column,op,value), see filter_to_sql. Empty for every cereal
+    returns:
+        Dictionary of group value to GroupStats, None on DB failure
+    throws:
+        OperatorNotFoundError: If the operator does not exist
+        KeyError: If the column does not exist
+    """
+    group_column = Cereal.__table__.c[group_by]
+    selected = [group_column, sqlalchemy.func.count()]
+    for col in STATS_COLUMNS:
+        column = Cereal.__table__.c[col]
+        #Sums are done on wider types so they cant overflow the column type on databases that keep it
+        if column.type.python_type is int:
+            total = sqlalchemy.func.sum(sqlalchemy.cast(column,sqlalchemy.BigInteger))
+        else:
+            total = sqlalchemy.func.sum(column)
+        squared = sqlalchemy.cast(column,sqlalchemy.Float)
+        selected += [sqlalchemy.func.count(column), total, sqlalchemy.func.sum(squared * squared),
+                     sqlalchemy.func.min(column), sqlalchemy.func.max(column)]
+    stmt = sqlalchemy.select(*selected).where(filter_to_sql(args)).group_by(group_column)
+    try:
+        result = db.session.execute(stmt).all()
+    except sqlalchemy.exc.OperationalError:
+        current_app.logger.critical('DB Error occured when computing cereal stats')
+        return None
+
+    groups = dict()
+    for row in result:
+        group = GroupStats()
+        group.count = row[1]
+        for (i,col) in enumerate(STATS_COLUMNS):
+            (count,total,squares,low,high) = row[2 + i * 5 : 7 + i * 5]
+            python_type = Cereal.__table__.c[col].type.python_type
+            if count:
+                group.stats[col] = RunningStat(count,python_type(total),float(squares),low,high)
+        groups[row[0]] = group
+    return groups
+
+def db_get_cereal_aggregates():
+    """
+    Returns the running aggregates of the stat columns, they are computed by the database when built, see db_get_cereal_structure
+    returns:
+        CerealAggregates or None on DB failure
+    """
+    def load():
+        groups = dict()
+        for group_by in STATS_GROUP_COLUMNS:
+            groups[group_by] = db_query_cereal_group_stats(group_by,[])
+            if groups[group_by] is None:
+                return None
+        return groups
+    return db_get_cereal_structure(_cereal_aggregates,load,'aggregates')
+
+def group_filter(args):
+    """
+    Returns a function that checks if a group value fulfills a list of filters on the group column, missing values only fulfill !=
+    like the database filtering
+    """
+    def matches(key):
+        for (_,op,value) in args:
+            if key is None:
+                if op != '!=':
+                    return False
+            elif not SQL_OPERATORS[op](key,value):
+                return False
+        return True
+    return matches
+
+def db_get_cereal_stats(group_by,args):
+    """
+    Returns the count, mean, standard deviation, min and max of the stat columns for every group of the cereals matching a list of filters.
+    Without filters, or with filters only on the group column, the stats are read from the running aggregates in O(groups). 
+    Other filters are evaluated on the cached snapshot if there is one, otherwise the database groups the matching rows
+    args:
+        group_by: String of the column to group by, must be in STATS_GROUP_COLUMNS
+        args: List of tuples with (column,op,value), see filter_to_sql. Empty for every cereal
+    returns:
+        List of tuples (group value,dictionary of the stats, see GroupStats.to_dict) ordered by the group value, None on DB failure
+    throws:
+        OperatorNotFoundError: If the operator does not exist
+        KeyError: If the column does not exist or group_by is not in STATS_GROUP_COLUMNS
+    """
+    if group_by not in STATS_GROUP_COLUMNS:
+        raise KeyError(group_by)
+    #Validates the filters before any path is picked
+    filter_to_sql(args)
+
+    if all(column == group_by for (column,_,_) in args):
+        aggregates = db_get_cereal_aggregates()
+        if aggregates is not None:
+            version = aggregates.version
+            #Groups where a min or max was removed are recomputed by the database, only those groups are read
+            for key in aggregates.stale_groups(group_by):
+                groups = db_query_cereal_group_stats(group_by,[(group_by,'=',key)])
+                if groups is None:
+                    return None
+                #The group is only replaced if the table and the aggregates are still at the version the group was read at
+                if db_get_cereal_table_version() == version:
+                    aggregates.replace_group(group_by,key,groups.get(key),version)
+            stats = aggregates.stats(group_by,group_filter(args) if args else None)
+            #A write during the recompute can leave a group stale, then the database groups the rows below
+            if stats is not None:
+                return stats
+
+    (snapshot,store) = db_get_cached_cereal_store()
+    if store is not None:
+        rows = (snapshot[pos] for pos in store.mask(args).nonzero()[0].tolist()) if args else snapshot
+        groups = aggregate_rows(rows,group_by)
+    else:
+        groups = db_query_cereal_group_stats(group_by,args)
+        if groups is None:
+            return None
+    return [(key,group.to_dict()) for (key,group) in sorted_groups(groups)]
+
+def db_get_cached_cereal_store():
+    """
+    Returns the columnar store of the cached cereal table snapshot, it is built the first time it is asked for after the snapshot is loaded
+    returns:
+        Tuple of (list of snapshot rows, CerealColumnStore of the rows) or (None,None) if no snapshot of the current table version is cached
+    """
+    version = db_get_cereal_table_version()
+    with _cereal_cache_lock:
+        rows = _cereal_cache['rows']
+        if version is None or rows is None or _cereal_cache['version'] != version:
+            return None, None
+        if _cereal_cache['store'] is not None:
+            return rows, _cereal_cache['store']
+    store = CerealColumnStore.from_rows(rows)
+    with _cereal_cache_lock:
+        if _cereal_cache['rows'] is rows:
+            _cereal_cache['store'] = store
+    return rows, store
+
+def db_get_all_cereal_rows():
+    """
+    Returns all entries from the cereal table ordered by id as row tuples ordered as CEREAL_HEADERS_WITH_ID, the rows are served from the table cache 
+    when the table is still at the version they were loaded at. The returned list is shared and must not be modified
+    returns:
+        List of row tuples, empty on DB failure
+    """
+    version = db_get_cereal_table_version()
+    with _cereal_cache_lock:
+        if version is not None and _cereal_cache['rows'] is not None and _cereal_cache['version'] == version:
+            _cereal_cache['hits'] += 1
+            return _cereal_cache['rows']
+        _cereal_cache['misses'] += 1
+
+    try:
+        rows = [tuple(row) for row in db.session.execute(sqlalchemy.select(*cereal_columns()).order_by(Cereal.id))]
+    except sqlalchemy.exc.OperationalError:
+        current_app.logger.critical('DB Error occured when getting cereal data')
+        return []
+    #Only store the snapshot if no write happened while it was loading, otherwise it could be stale
+    if version is not None and db_get_cereal_table_version() == version:
+        with _cereal_cache_lock:
+            _cereal_cache['version'] = version
+            _cereal_cache['rows'] = rows
+            _cereal_cache['df'] = None
+            _cereal_cache['store'] = None
+    return rows
 
 def db_get_all_cereals_as_df():
     """
-    Returns all entries from cereal table into a pandas dataframe
+    Returns all entries from cereal table into a pandas dataframe, the dataframe is built from the cached table snapshot.
+    The returned dataframe is shared and must not be modified
     returns:
         Pandas Dataframe with all cereal values from DB
     """
-    sql = "SELECT * FROM cereal"
+    #pandas is imported by the few functions that build DataFrames so it is not loaded to serve the api
+    import pandas as pd
+    rows = db_get_all_cereal_rows()
+    with _cereal_cache_lock:
+        if _cereal_cache['df'] is not None and _cereal_cache['rows'] is rows:
+            return _cereal_cache['df']
+    df = pd.DataFrame(rows,columns=CEREAL_HEADERS_WITH_ID)
+    with _cereal_cache_lock:
+        if _cereal_cache['rows'] is rows:
+            _cereal_cache['df'] = df
+    return df
+
+def db_get_cereal_nan_positions():
+    """
+    Returns the columns a DataFrame of the whole cereal table has NaN in, so rows of part of the table are serialized like the whole table is.
+    They are counted on the snapshot when it is cached, otherwise with one query, and kept while the table is at the same version
+    returns:
+        Set of integer positions in CEREAL_HEADERS_WITH_ID, see nan_positions_of_counts. Empty on DB failure
+    """
+    version = db_get_cereal_table_version()
+    with _cereal_cache_lock:
+        if version is not None and _cereal_cache['nan_version'] == version:
+            return _cereal_cache['nan_positions']
+        rows = _cereal_cache['rows'] if version is not None and _cereal_cache['version'] == version else None
+
+    if rows is not None:
+        nan_positions = table_nan_positions(rows)
+    else:
+        #COUNT of a column only counts the values that are not NULL
+        stmt = sqlalchemy.select(sqlalchemy.func.count(),*[sqlalchemy.func.count(col) for col in cereal_columns()])
+        try:
+            counts = db.session.execute(stmt).one()
+        except sqlalchemy.exc.OperationalError:
+            current_app.logger.critical('DB Error occured when counting missing cereal values')
+            return set()
+        nan_positions = nan_positions_of_counts(counts[0],counts[1:])
+    if version is not None and db_get_cereal_table_version() == version:
+        with _cereal_cache_lock:
+            _cereal_cache['nan_version'] = version
+            _cereal_cache['nan_positions'] = nan_positions
+    return nan_positions
+
+def cereal_columns():
+    """
+    Returns the columns of the cereal table ordered as CEREAL_HEADERS_WITH_ID, used for selecting rows as plain tuples
+    """
+    return [Cereal.__table__.c[header] for header in CEREAL_HEADERS_WITH_ID]
+
+def db_get_cereals_page(limit,after_id=None):
+    """
+    Returns a page of cereals ordered by id using keyset pagination, the page starts after the given id so 
+    the database never has to skip over rows of earlier pages
+    args:
+        limit: Integer value of the max amount of cereals in the page
+        after_id: Integer value of the last id of the previous page, None for the first page
+    returns:
+        Tuple of (list of row tuples ordered as CEREAL_HEADERS_WITH_ID, id to pass as after_id for the next page or None if it was the last page)
+    """
+    stmt = sqlalchemy.select(*cereal_columns()).order_by(Cereal.id)
+    if after_id is not None:
+        stmt = stmt.where(Cereal.id > after_id)
+    #Fetch one extra row to know if there is a next page
+    stmt = stmt.limit(limit + 1)
     try:
-        df = pd.read_sql(sql, db.engine)
-        return df
+        rows = db.session.execute(stmt).all()
+    except sqlalchemy.exc.OperationalError:
+        current_app.logger.critical('DB Error occured when getting cereal page')
+        return [], None
+
+    next_id = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_id = rows[-1][0]
+    return rows, next_id
+
+def db_get_filtered_cereals_page(args,offset,limit):
+    """
+    Returns a page of the cereals matching a list of filters ordered by id and how many cereals match in total. If the table snapshot
+    is cached the page is sliced from it, otherwise the database counts the matching rows and returns the page with OFFSET and LIMIT
+    args:
+        args: List of tuples with (column,op,value), see filter_to_sql. Empty for every cereal
+        offset: Integer value of how many matching cereals come before the page
+        limit: Integer value of the max amount of cereals in the page
+    returns:
+        Tuple of (list of row tuples ordered as CEREAL_HEADERS_WITH_ID, integer value of the amount of matching cereals). Empty page and 0 on DB failure
+    throws:
+        OperatorNotFoundError: If the operator does not exist
+        KeyError: If the column does not exist
+    """
+    (snapshot,store) = db_get_cached_cereal_store()
+    if store is not None:
+        #The snapshot is ordered by id so the matching positions are too
+        if not args:
+            return snapshot[offset:offset + limit], len(snapshot)
+        positions = store.mask(args).nonzero()[0]
+        return [snapshot[pos] for pos in positions[offset:offset + limit].tolist()], len(positions)
+
+    where = filter_to_sql(args)
+    try:
+        total = db.session.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(Cereal).where(where)).scalar()
+        stmt = sqlalchemy.select(*cereal_columns()).where(where).order_by(Cereal.id).offset(offset).limit(limit)
+        rows = [tuple(row) for row in db.session.execute(stmt)]
+    except sqlalchemy.exc.OperationalError:
+        current_app.logger.critical('DB Error occured when getting cereal list page')
+        return [], 0
+    return rows, total
+
+def db_iter_cereals(after_id=None,chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Generator over all cereals ordered by id, rows are read from a server side cursor in chunks so the whole table is never held in memory.
+    Must be consumed inside an app context, use stream_with_context when returning it in a response
+    args:
+        after_id: Integer value of the id to start after, None to start from the first cereal
+        chunk_size: Integer value of how many rows are fetched from the cursor at a time
+    yields:
+        Lists of row tuples ordered as CEREAL_HEADERS_WITH_ID, each list being at most chunk_size long
+    throws:
+        sqlalchemy.exc.OperationalError: On DB failure, it is raised again so a streamed response is aborted instead of ending as if every row was sent
+    """
+    stmt = sqlalchemy.select(*cereal_columns()).order_by(Cereal.id)
+    if after_id is not None:
+        stmt = stmt.where(Cereal.id > after_id)
+    try:
+        with db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt)
+            for rows in result.partitions():
+                yield rows
+    except sqlalchemy.exc.OperationalError:
+        current_app.logger.critical('DB Error occured when streaming cereal data')
+        raise
+
+def db_get_filtered_cereal_rows(args):
+    """
+    Returns the cereals matching a list of filters as row tuples. If the table snapshot is cached the filters are evaluated 
+    on its columnar store, otherwise the filtering is done in the database so only matching rows are fetched
+    args:
+        args: List of tuples with (column,op,value), see filter_to_sql
+    returns:
+        Tuple of (list of integer keys, list of row tuples ordered as CEREAL_HEADERS_WITH_ID) ordered by id. The key of a cereal is its position
+        in the whole table ordered by id, starting at 0, the same whether it was filtered in memory or by the database
+    throws:
+        OperatorNotFoundError: If the operator does not exist
+        KeyError: If the column does not exist
+    """
+    (snapshot,store) = db_get_cached_cereal_store()
+    if store is not None:
+        #The snapshot is ordered by id so the positions of the matching rows are their keys
+        positions = store.mask(args).nonzero()[0].tolist()
+        return positions, [snapshot[pos] for pos in positions]
+
+    #Range filters on numeric columns are looked up in the sorted indexes, if few enough cereals match only those ids are fetched and
+    #their keys are found in the index of the id column. The indexes match the table at version, if the table is at another version after the select
+    #the rows are filtered again without them
+    indexes = db_get_cereal_indexes()
+    if indexes is not None:
+        version = indexes.version
+        ids = indexes.search(args,version)
+        if ids is not None and len(ids) <= INDEX_LOOKUP_LIMIT:
+            stmt = sqlalchemy.select(*cereal_columns()).where(filter_to_sql(args),Cereal.id.in_(sorted(ids))).order_by(Cereal.id)
+            try:
+                rows = [tuple(row) for row in db.session.execute(stmt)] if ids else []
+            except sqlalchemy.exc.OperationalError:
+                current_app.logger.critical('DB Error occured when getting filtered cereal data')
+                return [], []
+            keys = indexes.positions([row[0] for row in rows],version)
+            if keys is not None and db_get_cereal_table_version() == version:
+                return keys, rows
+
+    #Every row is numbered before the filters are applied so the keys are positions in the whole table
+    position = (sqlalchemy.func.row_number().over(order_by=Cereal.id) - 1).label('position')
+    numbered = sqlalchemy.select(*cereal_columns(),position).subquery()
+    stmt = sqlalchemy.select(numbered.c.position,*[numbered.c[header] for header in CEREAL_HEADERS_WITH_ID]) \
+        .where(filter_to_sql(args,numbered.c)).order_by(numbered.c.id)
+    try:
+        result = db.session.execute(stmt).all()
+    except sqlalchemy.exc.OperationalError:
+        current_app.logger.critical('DB Error occured when getting filtered cereal data')
+        return [], []
+    return [row[0] for row in result], [tuple(row[1:]) for row in result]
+
+def db_get_filtered_cereals_as_df(args):
+    """
+    Returns the cereals matching a list of filters into a pandas dataframe, see db_get_filtered_cereal_rows
+    args:
+        args: List of tuples with (column,op,value), see filter_to_sql
+    returns:
+        Pandas Dataframe with the cereal values matching the filters
+    throws:
+        OperatorNotFoundError: If the operator does not exist
+        KeyError: If the column does not exist
+    """
+    import pandas as pd
+    (keys,rows) = db_get_filtered_cereal_rows(args)
+    return pd.DataFrame(rows,index=keys,columns=CEREAL_HEADERS_WITH_ID)
+
+def db_get_sorted_cereal_rows(args,sort,limit=None):
+    """
+    Returns the cereals matching a list of filters in sort order. If the table snapshot is cached the best rows are picked from the matching
+    rows with a heap, otherwise the database filters, orders and limits the rows
+    args:
+        args: List of tuples with (column,op,value), see filter_to_sql. Empty for every cereal
+        sort: List of tuples (column,descending), see parse_sort. Empty sorts by id
+        limit: Integer value of the max amount of rows, None for every matching row
+    returns:
+        List of row tuples ordered as CEREAL_HEADERS_WITH_ID
+    throws:
+        OperatorNotFoundError: If the operator does not exist
+        KeyError: If the column does not exist
+    """
+    (snapshot,store) = db_get_cached_cereal_store()
+    if store is not None:
+        if args:
+            rows = (snapshot[pos] for pos in store.mask(args).nonzero()[0].tolist())
+        else:
+            rows = snapshot
+        return top_rows(rows,sort,limit)
+
+    stmt = sqlalchemy.select(*cereal_columns()).where(filter_to_sql(args)).order_by(*sort_to_sql(sort))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    try:
+        return [tuple(row) for row in db.session.execute(stmt)]
+    except sqlalchemy.exc.OperationalError:
+        current_app.logger.critical('DB Error occured when getting sorted cereal data')
+        return []
+
+def db_get_cereal_detail(id):
+    """
+    Returns the values and picture path of a cereal, loaded in one query by joining the picture through the child relationship
+    args:
+        id: Integer value of the id of the cereal
+    returns:
+        Dictionary of column header to value with the extra key picturepath, which is None if the cereal has no picture. None on DB failure
+    throws:
+        LookupError: If id dosent exist in DB
+    """
+    stmt = sqlalchemy.select(*cereal_columns(), CerealPicture.picturepath).select_from(Cereal).outerjoin(Cereal.child) \
+        .where(Cereal.id == id).limit(1)
+    try:
+        row = db.session.execute(stmt).first()
     except sqlalchemy.exc.OperationalError:
-        df = pd.DataFrame([],columns=CEREAL_HEADERS_WITH_ID)
         current_app.logger.critical('DB Error occured when getting cereal data')
-        return df
+        return None
+    if row is None:
+        raise LookupError('Id dosent exist')
+    detail = dict(zip(CEREAL_HEADERS_WITH_ID,row))
+    detail['picturepath'] = row[-1]
+    return detail
 
 def db_get_id_cereal_as_df(id):
     """
@@ -37,6 +652,7 @@ def db_get_id_cereal_as_df(id):
         LookupError: If id dosent exist in DB
 
     """
+    import pandas as pd
     try:
         cereal = Cereal.query.filter_by(id = id).first()
         if not cereal:
@@ -49,6 +665,31 @@ def db_get_id_cereal_as_df(id):
     except sqlalchemy.exc.OperationalError:
         current_app.logger.critical('DB Error occured when getting cereal data')
 
+def delete_cereal_rows(ids):
+    """
+    Deletes the cereals with the given ids in the current transaction without committing, the transaction must be started with begin_cereal_write.
+    Databases that support RETURNING get the deleted rows back from the DELETE itself, others select the rows first
+    args:
+        ids: List of integer ids
+    returns:
+        List of the deleted rows as lists ordered as CEREAL_HEADERS_WITH_ID
+    throws:
+        sqlalchemy.exc.OperationalError: On DB failure
+    """
+    table = Cereal.__table__
+    deleted = []
+    for start in range(0,len(ids),BATCH_IN_CHUNK_SIZE):
+        chunk = ids[start:start + BATCH_IN_CHUNK_SIZE]
+        stmt = table.delete().where(table.c.id.in_(chunk))
+        #MSSQL refuses OUTPUT clauses on tables with triggers, see CerealVersion
+        if db.engine.dialect.delete_returning and db.engine.dialect.name != 'mssql':
+            rows = db.session.execute(stmt.returning(*cereal_columns())).all()
+        else:
+            rows = db.session.execute(sqlalchemy.select(*cereal_columns()).where(table.c.id.in_(chunk))).all()
+            db.session.execute(stmt)
+        deleted.extend(list(row) for row in rows)
+    return deleted
+
 def db_delete_cereal(id):
     """
     Deletes a cereal with a specific ID from the database
@@ -61,22 +702,167 @@ def db_delete_cereal(id):
         LookupError: If the cereal does not exist
     """
     try:
-        cereal = Cereal.query.filter_by(id = id)
-
-        #Check if it exist before we attempt to delete
-        if cereal.first() == None:
+        before = begin_cereal_write()
+        deleted = delete_cereal_rows([id])
+        if not deleted:
+            db.session.rollback()
             raise LookupError('Cereal does not exist')
-
-        #Delete and commit if it exist
-        cereal.delete()
-        db.session.commit()
-        current_app.logger.info('Deleted cereal id %s from database' % id)
+        after = commit_cereal_write()
+        notify_cereal_write(before,after,deleted=deleted)
+        current_app.logger.info('Deleted cereal id %s from database', id)
         return True
 
     except sqlalchemy.exc.OperationalError:
-        current_app.logger.critical('DB Error occured when getting cereal image')
+        db.session.rollback()
+        current_app.logger.critical('DB Error occured when deleting cereal')
         return False
 
+def db_get_cereal_rows_by_ids(ids):
+    """
+    Returns the cereals with the given ids, fetched with IN (...) selects of at most BATCH_IN_CHUNK_SIZE ids
+    args:
+        ids: List of integer ids
+    returns:
+        Dictionary of id to row tuple ordered as CEREAL_HEADERS_WITH_ID, ids that dont exist are missing. None on DB failure
+    """
+    unique = sorted(set(ids))
+    found = dict()
+    try:
+        for start in range(0,len(unique),BATCH_IN_CHUNK_SIZE):
+            stmt = sqlalchemy.select(*cereal_columns()).where(Cereal.id.in_(unique[start:start + BATCH_IN_CHUNK_SIZE]))
+            for row in db.session.execute(stmt):
+                found[row[0]] = tuple(row)
+    except sqlalchemy.exc.OperationalError:
+        current_app.logger.critical('DB Error occured when getting cereal batch')
+        return None
+    return found
+
+def validate_cereal_patch(patch):
+    """
+    Validates a patch of a batch update and changes the values to their column datatypes
+    args:
+        patch: Dictionary with the id of the cereal and the columns being updated
+    returns:
+        Tuple of (integer id,dictionary of column to value)
+    throws:
+        ValueError: With the reason if the id is missing, a column dosent exist or a value is incorrect datatype
+    """
+    if not isinstance(patch,dict) or 'id' not in patch:
+        raise ValueError('Missing id')
+    try:
+        id = int(patch['id'])
+    except (TypeError,ValueError):
+        raise ValueError('Invalid id %r' % patch['id'])
+    values = dict()
+    for (col,val) in patch.items():
+        if col == 'id':
+            continue
+        if col not in CEREAL_HEADERS_WITHOUT_ID:
+            raise ValueError('Invalid column %s' % col)
+        try:
+            values[col] = change_to_column_type(col,val)
+        except (TypeError,ValueError):
+            raise ValueError('Invalid value %r for column %s' % (val,col))
+    return id, values
+
+def db_batch_update_cereals(patches):
+    """
+    Updates many cereals in one transaction. The cereals are selected with IN (...) and updated with one executemany per chunk of the cereals
+    patching the same columns, only the patched columns are set. Invalid patches and ids that dont exist are skipped and reported.
+    Patches of the same id are applied in order
+    args:
+        patches: List of dictionaries with the id of the cereal and the columns being updated
+    returns:
+        List of dictionaries with the id, the status updated, not_found or invalid and the reason of invalid patches, in the order of patches.
+        None on DB failure, then nothing is updated
+    """
+    results = []
+    valid = []
+    for patch in patches:
+        try:
+            (id,values) = validate_cereal_patch(patch)
+            valid.append((len(results),id,values))
+            results.append({'id' : id, 'status' : 'updated'})
+        except ValueError as e:
+            results.append({'id' : patch.get('id') if isinstance(patch,dict) else None, 'status' : 'invalid', 'reason' : str(e)})
+
+    #The rows are read after the version is bumped so no other write can change them before the commit
+    try:
+        before = begin_cereal_write()
+    except sqlalchemy.exc.OperationalError:
+        db.session.rollback()
+        current_app.logger.critical('DB Error occured when batch updating cereals')
+        return None
+    current = db_get_cereal_rows_by_ids([id for (_,id,_) in valid])
+    if current is None:
+        db.session.rollback()
+        return None
+    current = {id : list(row) for (id,row) in current.items()}
+    originals = {id : list(row) for (id,row) in current.items()}
+    #Columns patched per cereal, the other columns are not written so a concurrent write to them is not overwritten
+    changed = dict()
+    for (pos,id,values) in valid:
+        if id not in current:
+            results[pos]['status'] = 'not_found'
+            continue
+        for (col,val) in values.items():
+            current[id][CEREAL_HEADERS_WITH_ID.index(col)] = val
+        changed.setdefault(id,set()).update(values)
+
+    if changed:
+        table = Cereal.__table__
+        groups = dict()
+        for id in sorted(changed):
+            cols = tuple(col for col in CEREAL_HEADERS_WITHOUT_ID if col in changed[id])
+            groups.setdefault(cols,[]).append(id)
+        try:
+            for (cols,ids) in groups.items():
+                stmt = table.update().where(table.c.id == sqlalchemy.bindparam('b_id')) \
+                    .values({col : sqlalchemy.bindparam(col) for col in cols})
+                params = [dict({col : current[id][CEREAL_HEADERS_WITH_ID.index(col)] for col in cols},b_id=id) for id in ids]
+                for start in range(0,len(params),BATCH_IN_CHUNK_SIZE):
+                    db.session.execute(stmt,params[start:start + BATCH_IN_CHUNK_SIZE])
+            after = commit_cereal_write()
+        except sqlalchemy.exc.OperationalError:
+            db.session.rollback()
+            current_app.logger.critical('DB Error occured when batch updating cereals')
+            return None
+        notify_cereal_write(before,after,updated=[(originals[id],current[id]) for id in sorted(changed)])
+    else:
+        db.session.rollback()
+    current_app.logger.info('Batch updated %d cereals', len(changed))
+    return results
+
+def db_batch_delete_cereals(ids):
+    """
+    Deletes many cereals in one transaction with DELETE ... IN (...) statements
+    args:
+        ids: List of integer ids
+    returns:
+        List of dictionaries with the id and the status deleted or not_found, in the order of ids. None on DB failure, then nothing is deleted
+    """
+    try:
+        before = begin_cereal_write()
+        deleted = delete_cereal_rows(sorted(set(ids)))
+        after = commit_cereal_write()
+    except sqlalchemy.exc.OperationalError:
+        db.session.rollback()
+        current_app.logger.critical('DB Error occured when batch deleting cereals')
+        return None
+    if deleted:
+        notify_cereal_write(before,after,deleted=deleted)
+    current_app.logger.info('Batch deleted %d cereals', len(deleted))
+    found = set(row[0] for row in deleted)
+    results = []
+    for id in ids:
+        if id in found:
+            results.append({'id' : id, 'status' : 'deleted'})
+            #A repeated id was only deleted once
+            found.discard(id)
+        else:
+            results.append({'id' : id, 'status' : 'not_found'})
+    return results
+
 
 def db_add_cereal(input_dict):
     """
@@ -90,6 +876,7 @@ def db_add_cereal(input_dict):
         ValueError: If input_dict parameters are incorrect, invalid column or value types
     """
     try:
+        before = begin_cereal_write()
         #Create new cereal object
         cereal = Cereal()
         #Iterate over each column, value and add it to the cereal object
@@ -98,42 +885,191 @@ def db_add_cereal(input_dict):
 
         #Add cereal object to DB and commit
         db.session.add(cereal)
-        db.session.commit()
+        db.session.flush()
+        row = get_cereal_value(cereal)
+        after = commit_cereal_write()
+        notify_cereal_write(before,after,inserted=[row])
         current_app.logger.info('Added new cereal to DB')
         return True
 
     except sqlalchemy.exc.OperationalError:
+        #Ends the transaction so the lock taken on the version row by begin_cereal_write is released
+        db.session.rollback()
         current_app.logger.critical('DB Error occured when getting cereal image')
         return False
 
     except ValueError:
+        db.session.rollback()
         raise ValueError('Invalid input parameters')
 
-def db_bulk_add_cereal(cereals_list):
+def db_bulk_add_cereal(cereals_list,chunk_size=None,first_row=0,job_id=None):
     """
-    bulk add cereal to the DB
+    bulk add cereal to the DB. Rows are validated and inserted a chunk at a time with a single executemany insert per chunk,
+    each chunk is committed on its own. Invalid rows are not inserted and reported with the reason
     args:
         cereals_list: a list of dictionaries of cereal items 
+        chunk_size: Integer value of how many rows are inserted per executemany, None for the BULK_INSERT_CHUNK_SIZE config
+        first_row: Integer value of the row number of the first item, used for the row numbers in the report
+        job_id: String id of the import job the rows are from, its progress is updated in the transaction of each chunk. None if not imported by a job
     returns:
-        Integer value of how many cereals from set was uploaded
+        Dictionary report with
+            inserted: Integer value of how many cereals were inserted
+            rejected: List of dictionaries with the row number and the reason the row was not inserted
+            error: None, or a string if a DB failure stopped the insert. Rows of the failed chunk are not inserted
     """
-    try:
-        number_uploaded = 0
-        for cereal_item in cereals_list:
+    if chunk_size is None:
+        chunk_size = current_app.config.get('BULK_INSERT_CHUNK_SIZE',BULK_INSERT_CHUNK_SIZE)
+    report = {'inserted' : 0, 'rejected' : [], 'error' : None}
+    insert = Cereal.__table__.insert()
+    for start in range(0,len(cereals_list),chunk_size):
+        rows = []
+        rejected = []
+        items = cereals_list[start:start + chunk_size]
+        for (row_number,cereal_item) in enumerate(items, first_row + start):
             try:
-                cereal = Cereal()
-                for (col,val) in cereal_item.items():
-                    set_cereal_value(col,val,cereal)
-                db.session.add(cereal)
-                number_uploaded += 1
-            except ValueError:
-                pass
+                rows.append(validate_cereal_row(cereal_item))
+            except ValueError as e:
+                rejected.append({'row' : row_number, 'reason' : str(e)})
+        report['rejected'].extend(rejected)
+        if not rows and job_id is None:
+            continue
+        try:
+            if rows:
+                begin_cereal_write()
+                db.session.execute(insert,rows)
+            if job_id is not None:
+                add_import_progress(job_id,len(items),len(rows),len(rejected))
+            db.session.commit()
+            report['inserted'] += len(rows)
+        except sqlalchemy.exc.DBAPIError as e:
+            db.session.rollback()
+            report['error'] = str(e.orig)
+            current_app.logger.critical('DB Error occured when bulk adding cereals')
+            break
+
+    #Inserted ids are not known with executemany, the in memory structures are built again when needed instead of updated per row
+    if report['inserted']:
+        db_reset_cereal_structures()
+    current_app.logger.info('Added %d cereals to DB, rejected %d', report['inserted'], len(report['rejected']))
+    return report
+
+
+def db_import_cereal_csv(stream,chunk_size=None,skip_rows=0,progress=None,job_id=None):
+    """
+    Imports a csv of cereals from a file stream, each chunk of the file is validated and inserted before the next is read
+    args:
+        stream: Binary file stream of the csv
+        chunk_size: Integer value of how many rows are read and inserted at a time, None for the BULK_INSERT_CHUNK_SIZE config
+        skip_rows: Integer value of how many data rows are skipped, used to resume an import after the last committed chunk
+        progress: Function called as progress(chunk_report,rows_in_chunk) after each chunk is inserted, None to not report progress
+        job_id: String id of the import job, see db_bulk_add_cereal. None if not imported by a job
+    returns:
+        Dictionary report like db_bulk_add_cereal, row numbers count the data rows of the file starting at 1
+    throws:
+        ValueError: If the csv is missing columns or is not a valid csv
+    """
+    if chunk_size is None:
+        chunk_size = current_app.config.get('BULK_INSERT_CHUNK_SIZE',BULK_INSERT_CHUNK_SIZE)
+    report = {'inserted' : 0, 'rejected' : [], 'error' : None}
+    row_number = skip_rows + 1
+    for chunk in read_csv_chunks(stream,chunk_size,skip_rows):
+        chunk_report = db_bulk_add_cereal(chunk,chunk_size,row_number,job_id)
+        report['inserted'] += chunk_report['inserted']
+        report['rejected'].extend(chunk_report['rejected'])
+        row_number += len(chunk)
+        if progress is not None:
+            progress(chunk_report,len(chunk))
+        if chunk_report['error']:
+            report['error'] = chunk_report['error']
+            break
+    return report
+
+
+def add_import_progress(job_id,rows,inserted,rejected):
+    """
+    Adds a chunk to the progress of an import job in the current transaction, the caller commits it together with the rows of the chunk
+    args:
+        job_id: String id of the import job
+        rows: Integer value of the data rows of the chunk
+        inserted: Integer value of the rows of the chunk that were inserted
+        rejected: Integer value of the rows of the chunk that were rejected
+    """
+    table = ImportProgress.__table__
+    db.session.execute(table.update().where(table.c.job_id == job_id).values(committed_rows=table.c.committed_rows + rows,
+                                                                             rows_inserted=table.c.rows_inserted + inserted,
+                                                                             rows_rejected=table.c.rows_rejected + rejected))
+
+def db_get_import_progress(job_id):
+    """
+    Returns the progress of an import job, saved in the transactions of the chunks that were inserted. The progress starts at 0 the first time
+    args:
+        job_id: String id of the import job
+    returns:
+        Dictionary with committed_rows, rows_inserted and rows_rejected. None on DB failure
+    """
+    try:
+        progress = db.session.get(ImportProgress,job_id)
+        if progress is None:
+            progress = ImportProgress(job_id=job_id, committed_rows=0, rows_inserted=0, rows_rejected=0)
+            db.session.add(progress)
+        values = {'committed_rows' : progress.committed_rows, 'rows_inserted' : progress.rows_inserted, 'rows_rejected' : progress.rows_rejected}
         db.session.commit()
-        current_app.logger.info('Added %d cereals to DB' % number_uploaded)
-        return number_uploaded
+        return values
     except sqlalchemy.exc.OperationalError:
-        current_app.logger.critical('DB Error occured when getting cereal image')
-        return 0
+        db.session.rollback()
+        current_app.logger.critical('DB Error occured when getting import progress')
+        return None
+
+def db_delete_import_progress(job_ids):
+    """
+    Deletes the progress of import jobs that finished or expired
+    args:
+        job_ids: List of string ids of the import jobs
+    returns:
+        True: On success
+        False: On DB failure
+    """
+    try:
+        db.session.execute(ImportProgress.__table__.delete().where(ImportProgress.job_id.in_(job_ids)))
+        db.session.commit()
+        return True
+    except sqlalchemy.exc.OperationalError:
+        db.session.rollback()
+        current_app.logger.critical('DB Error occured when deleting import progress')
+        return False
+
+def db_bulk_load_cereals(chunks,progress=None):
+    """
+    Inserts chunks of already valid cereals, each chunk with one executemany in its own transaction. Used to seed the database
+    with generated cereals, the rows are not validated like in db_bulk_add_cereal
+    args:
+        chunks: Iterable of lists of dictionaries with the columns of CEREAL_HEADERS_WITHOUT_ID
+        progress: Function called as progress(inserted) with the total inserted after each chunk, None to not report progress
+    returns:
+        Integer value of how many cereals were inserted
+    throws:
+        sqlalchemy.exc.DBAPIError: If a chunk fails, the chunks before it stay inserted
+    """
+    inserted = 0
+    insert = Cereal.__table__.insert()
+    try:
+        for rows in chunks:
+            try:
+                begin_cereal_write()
+                db.session.execute(insert,rows)
+                db.session.commit()
+            except sqlalchemy.exc.DBAPIError:
+                db.session.rollback()
+                current_app.logger.critical('DB Error occured when bulk loading cereals')
+                raise
+            inserted += len(rows)
+            if progress is not None:
+                progress(inserted)
+    finally:
+        if inserted:
+            db_reset_cereal_structures()
+        current_app.logger.info('Bulk loaded %d cereals to DB', inserted)
+    return inserted
 
 
 def db_update_cereal(id,input_dict):
@@ -147,26 +1083,38 @@ def db_update_cereal(id,input_dict):
         False: On DB failure
     throws:
         LookupError: If cereal does not exist
+        ValueError: If input_dict parameters are incorrect, invalid column or value types
     """
     try:
+        before = begin_cereal_write()
         #Query the cereal in DB
         cereal = Cereal.query.filter_by(id=id).first()
 
         #Check if cereal exists, someone could delete during edit
         if cereal == None:
+            db.session.rollback()
             raise LookupError
         
         #Update values and commit
+        old_row = get_cereal_value(cereal)
         for (col,val) in input_dict.items():
             set_cereal_value(col,val,cereal)
-        db.session.commit()
-        current_app.logger.info('Updated cereal id %s' % id)
+        new_row = get_cereal_value(cereal)
+        after = commit_cereal_write()
+        notify_cereal_write(before,after,updated=[(old_row,new_row)])
+        current_app.logger.info('Updated cereal id %s', id)
         return True
 
     except sqlalchemy.exc.OperationalError:
+        #Ends the transaction so the lock taken on the version row by begin_cereal_write is released
+        db.session.rollback()
         current_app.logger.critical('DB Error occured when getting cereal image')
         return False
 
+    except ValueError:
+        db.session.rollback()
+        raise
+
 
 def db_get_cereal_imagepath(id):
     """
@@ -214,7 +1162,7 @@ def db_add_cereal_imagepath(cereal_id,filename):
         picture = CerealPicture(cerealid = cereal.id, picturepath = filename)
         db.session.add(picture)
         db.session.commit()
-        current_app.logger.info('Picturepath %s for cerealid %s added' % (filename,cereal_id))
+        current_app.logger.info('Picturepath %s for cerealid %s added', filename, cereal_id)
         return True
 
     except sqlalchemy.exc.OperationalError:
@@ -246,7 +1194,7 @@ def db_update_cereal_imagepath(cereal_id,filename):
         cereal_picture.picturepath = filename
         db.session.commit()
 
-        current_app.logger.info('Picturepath %s for cerealid %s updated' % (filename,cereal_id))
+        current_app.logger.info('Picturepath %s for cerealid %s updated', filename, cereal_id)
         return True
 
     except sqlalchemy.exc.OperationalError:
@@ -0,0 +1,169 @@
+from bisect import bisect_left, bisect_right, insort
+from ..constants import CEREAL_HEADERS_WITH_ID
+from .structure import CerealStructure
+
+"""
+In memory sorted secondary indexes on the numeric cereal columns. Each index is a sorted list of (value,id) pairs
+so range filters are answered with bisection instead of a scan, the indexes are kept up to date by the write functions in dbfunctions
+"""
+
+#Columns that get an index, every column that isnt a string
+INDEXED_COLUMNS = [col for col in CEREAL_HEADERS_WITH_ID if col not in ('name','mfr','type')]
+#Operators that can be answered with the sorted indexes
+INDEXED_OPERATORS = {'<', '<=', '>', '>=', '='}
+
+#Sentinel ids that sort before and after every id, used to bisect on the value alone
+LOWEST_ID = float('-inf')
+HIGHEST_ID = float('inf')
+
+class SortedColumnIndex():
+    """
+    Sorted (value,id) index of a single column, missing values are not indexed as no range filter can match them
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.values = dict()
+
+    def insert(self,id,value):
+        """
+        Adds the value of a cereal to the index, if the id is already indexed its value is replaced
+        """
+        if id in self.values:
+            self.delete(id)
+        if value is None or value != value:
+            return
+        insort(self.entries,(value,id))
+        self.values[id] = value
+
+    def delete(self,id):
+        """
+        Removes a cereal from the index, ids that are not indexed are ignored
+        """
+        value = self.values.pop(id,None)
+        if value is None:
+            return
+        pos = bisect_left(self.entries,(value,id))
+        if pos < len(self.entries) and self.entries[pos] == (value,id):
+            del self.entries[pos]
+
+    def bounds(self,op,value):
+        """
+        Returns the (start,end) slice of entries that fulfill the filter
+        """
+        if op == '<':
+            return (0, bisect_left(self.entries,(value,LOWEST_ID)))
+        elif op == '<=':
+            return (0, bisect_right(self.entries,(value,HIGHEST_ID)))
+        elif op == '>':
+            return (bisect_right(self.entries,(value,HIGHEST_ID)), len(self.entries))
+        elif op == '>=':
+            return (bisect_left(self.entries,(value,LOWEST_ID)), len(self.entries))
+        elif op == '=':
+            return (bisect_left(self.entries,(value,LOWEST_ID)), bisect_right(self.entries,(value,HIGHEST_ID)))
+        raise KeyError(op)
+
+    def matches(self,id,op,value):
+        """
+        Checks if the indexed value of a cereal fulfills the filter
+        """
+        if id not in self.values:
+            return False
+        indexed = self.values[id]
+        if op == '<':
+            return indexed < value
+        elif op == '<=':
+            return indexed <= value
+        elif op == '>':
+            return indexed > value
+        elif op == '>=':
+            return indexed >= value
+        return indexed == value
+
+
+class CerealIndexes(CerealStructure):
+    """
+    The sorted indexes of every column in INDEXED_COLUMNS. The indexes are empty until loaded with build, see CerealStructure
+    """
+
+    def _clear(self):
+        self.indexes = {col : SortedColumnIndex() for col in INDEXED_COLUMNS}
+
+    def _prepare(self,rows):
+        #rows is every row of the cereal table with the values ordered as CEREAL_HEADERS_WITH_ID
+        indexes = dict()
+        for col in INDEXED_COLUMNS:
+            pos = CEREAL_HEADERS_WITH_ID.index(col)
+            index = SortedColumnIndex()
+            pairs = [(row[pos],row[0]) for row in rows if row[pos] is not None and row[pos] == row[pos]]
+            pairs.sort()
+            index.entries = pairs
+            index.values = {id : value for (value,id) in pairs}
+            indexes[col] = index
+        return indexes
+
+    def _load(self,indexes):
+        self.indexes = indexes
+
+    def _insert_rows(self,rows):
+        for row in rows:
+            for (col,index) in self.indexes.items():
+                index.insert(row[0],row[CEREAL_HEADERS_WITH_ID.index(col)])
+
+    def _delete_rows(self,rows):
+        for row in rows:
+            for index in self.indexes.values():
+                index.delete(row[0])
+
+    def _update_row(self,old_row,new_row):
+        #Only the columns where the value changed are touched
+        for (col,index) in self.indexes.items():
+            pos = CEREAL_HEADERS_WITH_ID.index(col)
+            if old_row[pos] != new_row[pos]:
+                index.insert(new_row[0],new_row[pos])
+
+    def search(self,args,version):
+        """
+        Finds the ids of the cereals fulfilling the indexable filters. The filter matching the fewest entries is
+        used to get the candidate ids, the candidates are then checked against the other filters starting with the most selective
+        args:
+            args: List of tuples with (column,op,value)
+            version: Integer value of the table version the ids must be from
+        returns:
+            Set of ids fulfilling every indexable filter, None if no filter could use an index or the indexes are not at version
+        """
+        with self.lock:
+            if self.version != version:
+                return None
+            ranges = []
+            for (column,op,value) in args:
+                if column in self.indexes and op in INDEXED_OPERATORS:
+                    index = self.indexes[column]
+                    (start,end) = index.bounds(op,value)
+                    ranges.append((max(end - start,0),index,start,end,op,value))
+            if not ranges:
+                return None
+
+            ranges.sort(key=lambda entry: entry[0])
+            (_,index,start,end,_,_) = ranges[0]
+            candidates = [id for (_,id) in index.entries[start:end]]
+            for (_,index,_,_,op,value) in ranges[1:]:
+                if not candidates:
+                    break
+                candidates = [id for id in candidates if index.matches(id,op,value)]
+            return set(candidates)
+
+    def positions(self,ids,version):
+        """
+        Returns the positions of cereals in the whole table ordered by id, found by bisecting the index of the id column
+        args:
+            ids: List of integer ids of indexed cereals
+            version: Integer value of the table version the positions must be from
+        returns:
+            List of integer positions in the order of ids, None if the indexes are not at version
+        """
+        with self.lock:
+            if self.version != version:
+                return None
+            entries = self.indexes['id'].entries
+            return [bisect_left(entries,(id,LOWEST_ID)) for id in ids]
@@ -1,5 +1,6 @@
 from ... import db
 from flask_login import UserMixin
+import sqlalchemy
 
 class User(UserMixin,db.Model):
     __tablename__ = 'cerealuser'
@@ -15,6 +16,8 @@ class CerealPicture(db.Model):
 
 class Cereal(db.Model):
     __tablename__ = 'cereal'
+    #MSSQL refuses OUTPUT clauses on tables with triggers, see CerealVersion
+    __table_args__ = {'implicit_returning' : False}
     id = db.Column(db.Integer,primary_key=True)
     name = db.Column(db.String(50))
     mfr = db.Column(db.String(50))
@@ -34,7 +37,36 @@ class Cereal(db.Model):
     rating = db.Column(db.Integer)
     child = db.relationship(CerealPicture,backref="parent",passive_deletes=True)
 
+class CerealVersion(db.Model):
+    """
+    Single row with the version of the cereal table, the version is bumped by every write to the cereal table. The write functions in dbfunctions bump it
+    themselves and triggers on the cereal table bump it for writes made by anything else, so the in memory structures of every process can tell if the table changed
+    """
+    __tablename__ = 'cerealversion'
+    id = db.Column(db.Integer,primary_key=True,autoincrement=False)
+    version = db.Column(db.BigInteger,nullable=False)
 
+class ImportProgress(db.Model):
+    """
+    Progress of a csv import job. It is updated in the transaction that inserts each chunk of the file, so a resumed job never inserts a committed chunk again
+    """
+    __tablename__ = 'importprogress'
+    job_id = db.Column(db.String(32),primary_key=True)
+    #Data rows of the file that are committed or rejected
+    committed_rows = db.Column(db.Integer,nullable=False,default=0)
+    rows_inserted = db.Column(db.Integer,nullable=False,default=0)
+    rows_rejected = db.Column(db.Integer,nullable=False,default=0)
 
+#Triggers bumping the version on every write to the cereal table, per database dialect. Databases without triggers here only see the writes of the webapp
+VERSION_TRIGGERS = {
+    'sqlite' : ["CREATE TRIGGER cereal_version_%s AFTER %s ON cereal BEGIN UPDATE cerealversion SET version = version + 1; END" % (op.lower(),op)
+                for op in ('INSERT','UPDATE','DELETE')],
+    'mssql' : ["CREATE TRIGGER cereal_version ON cereal AFTER INSERT, UPDATE, DELETE AS BEGIN SET NOCOUNT ON; UPDATE cerealversion SET version = version + 1; END"],
+}
 
-
+@sqlalchemy.event.listens_for(CerealVersion.__table__, 'after_create')
+def create_version_row(target,connection,**kw):
+    #create_all creates the tables ordered by name so the cereal table already exists here
+    connection.execute(target.insert().values(id=1,version=0))
+    for trigger in VERSION_TRIGGERS.get(connection.dialect.name,[]):
+        connection.execute(sqlalchemy.text(trigger))
@@ -0,0 +1,142 @@
+from flask import current_app
+import sqlalchemy
+from sqlalchemy.pool import QueuePool
+import threading
+import time
+from ..constants import POOL_WAIT_BUCKETS
+from ..misc.histogram import Histogram
+from ... import db
+
+"""
+Database connection pool settings and instrumentation. The engine uses a queue pool that times how long every connection checkout takes,
+and pool events keep counters of the connections, both are reported by get_pool_stats
+"""
+
+class PoolMonitor():
+    """
+    Counters and checkout wait times of a connection pool
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.checked_out = 0
+        self.checkout_wait = Histogram(POOL_WAIT_BUCKETS)
+
+    def count(self,counter,amount=1):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def listen(self,engine):
+        """
+        Registers the pool event listeners of an engine, the listeners are kept when the pool is recreated
+        """
+        sqlalchemy.event.listen(engine, 'connect', lambda dbapi_conn,record: self.count('connects'))
+        sqlalchemy.event.listen(engine, 'checkout', self.on_checkout)
+        sqlalchemy.event.listen(engine, 'checkin', self.on_checkin)
+        sqlalchemy.event.listen(engine, 'invalidate', lambda dbapi_conn,record,exception: self.count('invalidations'))
+
+    def on_checkout(self,dbapi_conn,record,proxy):
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out += 1
+
+    def on_checkin(self,dbapi_conn,record):
+        with self.lock:
+            self.checkins += 1
+            self.checked_out -= 1
+
+    def stats(self):
+        with self.lock:
+            return {'connects' : self.connects, 'checkouts' : self.checkouts, 'checkins' : self.checkins, 'invalidations' : self.invalidations,
+                    'timeouts' : self.timeouts, 'checked_out' : self.checked_out}
+
+
+class TimedQueuePool(QueuePool):
+    """
+    Queue pool that records the time spent getting a connection in the monitor of the pool, including waiting for a free connection
+    and connecting when a new connection is made
+    """
+    monitor = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except sqlalchemy.exc.TimeoutError:
+            if self.monitor is not None:
+                self.monitor.count('timeouts')
+            raise
+        finally:
+            if self.monitor is not None:
+                self.monitor.checkout_wait.observe(time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.monitor = self.monitor
+        return pool
+
+
+def is_memory_sqlite(db_uri):
+    """
+    Returns true if the uri is an in memory sqlite database, those use a single shared connection and have no pool to configure
+    """
+    url = sqlalchemy.engine.make_url(db_uri)
+    return url.drivername in ('sqlite','sqlite+pysqlite') and url.database in (None,'',':memory:')
+
+def pool_engine_options(db_uri,pool_size=None,max_overflow=None,pool_timeout=None,pool_recycle=None,pool_pre_ping=True):
+    """
+    Returns the engine options of the connection pool, options that are None keep the SQLAlchemy default
+    args:
+        db_uri: String of the database uri
+        pool_size: Integer value of the connections kept open
+        max_overflow: Integer value of the connections allowed above pool_size when the pool is empty
+        pool_timeout: Seconds to wait for a free connection before failing
+        pool_recycle: Seconds a connection is used before it is replaced, -1 never replaces
+        pool_pre_ping: Boolean, test connections when they are checked out and replace stale connections
+    returns:
+        Dictionary of engine options
+    """
+    if is_memory_sqlite(db_uri):
+        return {}
+    options = {'poolclass' : TimedQueuePool, 'pool_pre_ping' : pool_pre_ping}
+    for (option,value) in (('pool_size',pool_size), ('max_overflow',max_overflow), ('pool_timeout',pool_timeout), ('pool_recycle',pool_recycle)):
+        if value is not None:
+            options[option] = value
+    return options
+
+def instrument_engine(engine):
+    """
+    Creates the monitor of an engine's connection pool, the checkout wait times are only measured when the engine uses TimedQueuePool
+    returns:
+        PoolMonitor
+    """
+    monitor = PoolMonitor()
+    monitor.listen(engine)
+    if isinstance(engine.pool, TimedQueuePool):
+        engine.pool.monitor = monitor
+    return monitor
+
+def get_pool_stats():
+    """
+    Returns a dictionary with the connection pool configuration, the checked out, idle and overflow connections,
+    the event counters and the checkout wait time histogram
+    """
+    pool = db.engine.pool
+    stats = {'pool' : type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats['size'] = pool.size()
+        stats['max_overflow'] = pool._max_overflow
+        stats['timeout'] = pool.timeout()
+        stats['idle'] = pool.checkedin()
+        #overflow() is negative while fewer than size connections have been opened
+        stats['overflow'] = max(pool.overflow(),0)
+    monitor = current_app.extensions.get('pool_monitor')
+    if monitor is not None:
+        stats.update(monitor.stats())
+        stats['checkout_wait'] = monitor.checkout_wait.snapshot()
+    return stats
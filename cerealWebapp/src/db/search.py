@@ -0,0 +1,266 @@
+from bisect import bisect_left, insort
+from collections import Counter
+import heapq
+from ..constants import CEREAL_HEADERS_WITH_ID
+from .structure import CerealStructure
+
+"""
+In memory search index over the cereal names. The names and every word of a name are kept in sorted lists of (name,id) and (word,id) pairs,
+so the names starting with the query or with a word starting with it are found with bisection. The distinct words of all names have a trigram index used to find the words containing the query
+or being a typo of it, the names are then found from those words. The index is kept up to date by the write functions in dbfunctions
+"""
+
+#Max amount of names looked at in each stage of a search, keeps the search time bounded when a short query matches most names
+SEARCH_CANDIDATE_LIMIT = 200
+#Max amount of words sharing the most trigrams with a query word whose edit distance is computed
+FUZZY_WORD_CANDIDATES = 50
+#Trigrams in more words than this are not counted when looking for typos, they are too common to tell words apart
+FUZZY_POSTING_LIMIT = 2000
+#Share of the query words a name must match to be a fuzzy match, a typo counts less than a whole match
+FUZZY_THRESHOLD = 0.5
+
+#Ranks of the kinds of matches, lower ranks are returned first
+EXACT_MATCH = 0
+NAME_PREFIX_MATCH = 1
+WORD_PREFIX_MATCH = 2
+SUBSTRING_MATCH = 3
+FUZZY_MATCH = 4
+
+NAME_POSITION = CEREAL_HEADERS_WITH_ID.index('name')
+
+
+def normalize_name(name):
+    """
+    Returns a name in lower case with apostrophes removed and every other character that isnt a letter or digit turned into a single space
+    """
+    if name is None or name != name:
+        return ''
+    name = name.lower().replace("'",'')
+    return ' '.join(''.join(char if char.isalnum() else ' ' for char in name).split())
+
+def word_trigrams(word,padded=True):
+    """
+    Returns the set of trigrams of a word. Padded words start with two spaces and end with one so the start and end of the word are trigrams too
+    """
+    if padded:
+        word = '  ' + word + ' '
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+def allowed_typos(word):
+    """
+    Returns the max edit distance of a typo of a word, short words must match exactly
+    """
+    if len(word) < 4:
+        return 0
+    if len(word) < 8:
+        return 1
+    return 2
+
+def edit_distance(a,b,limit):
+    """
+    Returns the edit distance between two words where swapping two neighbouring characters counts as one edit.
+    Returns limit + 1 as soon as the distance is known to be above limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = None
+    current = list(range(len(b) + 1))
+    for i in range(1,len(a) + 1):
+        (before,previous) = (previous,current)
+        current = [i] + [0] * len(b)
+        for j in range(1,len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return current[-1]
+
+def prefix_bounds(entries,prefix):
+    """
+    Returns the (start,end) slice of a sorted list of (word,id) pairs with the words starting with prefix
+    """
+    start = bisect_left(entries,(prefix,))
+    end = bisect_left(entries,(prefix[:-1] + chr(ord(prefix[-1]) + 1),))
+    return start, end
+
+def word_bounds(entries,word):
+    """
+    Returns the (start,end) slice of a sorted list of (word,id) pairs with exactly the given word
+    """
+    return bisect_left(entries,(word,)), bisect_left(entries,(word + '\0',))
+
+
+class CerealNameIndex(CerealStructure):
+    """
+    The name search index. The index is empty until loaded with build, see CerealStructure
+    """
+
+    def _clear(self):
+        self.names = dict()
+        self.sorted_names = []
+        self.words = []
+        #Amount of names with each word, a word is removed from the trigram index when no name has it anymore
+        self.vocabulary = Counter()
+        self.trigrams = dict()
+
+    def _prepare(self,pairs):
+        #pairs is (id,name) of every cereal of the table
+        names = dict()
+        sorted_names = []
+        words = []
+        vocabulary = Counter()
+        for (id,name) in pairs:
+            name = normalize_name(name)
+            names[id] = name
+            sorted_names.append((name,id))
+            for word in set(name.split()):
+                words.append((word,id))
+                vocabulary[word] += 1
+        sorted_names.sort()
+        words.sort()
+        trigrams = dict()
+        for word in vocabulary:
+            for trigram in word_trigrams(word):
+                trigrams.setdefault(trigram,set()).add(word)
+        return names, sorted_names, words, vocabulary, trigrams
+
+    def _load(self,prepared):
+        (self.names,self.sorted_names,self.words,self.vocabulary,self.trigrams) = prepared
+
+    def _add(self,id,name):
+        name = normalize_name(name)
+        self.names[id] = name
+        insort(self.sorted_names,(name,id))
+        for word in set(name.split()):
+            insort(self.words,(word,id))
+            self.vocabulary[word] += 1
+            if self.vocabulary[word] == 1:
+                for trigram in word_trigrams(word):
+                    self.trigrams.setdefault(trigram,set()).add(word)
+
+    def _remove(self,id):
+        name = self.names.pop(id,None)
+        if name is None:
+            return
+        pos = bisect_left(self.sorted_names,(name,id))
+        if pos < len(self.sorted_names) and self.sorted_names[pos] == (name,id):
+            del self.sorted_names[pos]
+        for word in set(name.split()):
+            pos = bisect_left(self.words,(word,id))
+            if pos < len(self.words) and self.words[pos] == (word,id):
+                del self.words[pos]
+            self.vocabulary[word] -= 1
+            if self.vocabulary[word] > 0:
+                continue
+            del self.vocabulary[word]
+            for trigram in word_trigrams(word):
+                posting = self.trigrams.get(trigram)
+                if posting is not None:
+                    posting.discard(word)
+                    if not posting:
+                        del self.trigrams[trigram]
+
+    def _insert_rows(self,rows):
+        for row in rows:
+            self._add(row[0],row[NAME_POSITION])
+
+    def _delete_rows(self,rows):
+        for row in rows:
+            self._remove(row[0])
+
+    def _update_row(self,old_row,new_row):
+        #The name is only moved when it changed
+        if old_row[NAME_POSITION] != new_row[NAME_POSITION]:
+            self._remove(old_row[0])
+            self._add(new_row[0],new_row[NAME_POSITION])
+
+    def _prefix_matches(self,query,query_words,ranked,limit):
+        #Names starting with the query are next to each other in the sorted names, the exact match is first
+        (start,end) = prefix_bounds(self.sorted_names,query)
+        for (name,id) in self.sorted_names[start:min(end,start + SEARCH_CANDIDATE_LIMIT)]:
+            ranked[id] = (EXACT_MATCH if name == query else NAME_PREFIX_MATCH,0.0,len(name),id)
+        if len(ranked) >= limit:
+            return
+        #The query word with the fewest entries gives the candidates, the other words are checked on the names of the candidates
+        bounds = [prefix_bounds(self.words,word) for word in query_words]
+        (start,end) = min(bounds,key=lambda bound: bound[1] - bound[0])
+        for (_,id) in self.words[start:min(end,start + SEARCH_CANDIDATE_LIMIT)]:
+            if id in ranked:
+                continue
+            name = self.names[id]
+            if len(query_words) > 1:
+                name_words = name.split()
+                if not all(any(word.startswith(query_word) for word in name_words) for query_word in query_words):
+                    continue
+            ranked[id] = (WORD_PREFIX_MATCH,0.0,len(name),id)
+
+    def _similar_words(self,query_word):
+        """
+        Returns a dictionary of the words containing query_word with the score 1 and the words that are a typo of it with a score below 1
+        """
+        similar = dict()
+        if len(query_word) >= 3:
+            postings = sorted((self.trigrams.get(trigram,set()) for trigram in word_trigrams(query_word,padded=False)),key=len)
+            for word in postings[0].intersection(*postings[1:]):
+                if query_word in word:
+                    similar[word] = 1.0
+        typos = allowed_typos(query_word)
+        if typos:
+            shared = Counter()
+            for trigram in word_trigrams(query_word):
+                posting = self.trigrams.get(trigram,())
+                if len(posting) <= FUZZY_POSTING_LIMIT:
+                    shared.update(posting)
+            for (word,_) in shared.most_common(FUZZY_WORD_CANDIDATES):
+                if word in similar:
+                    continue
+                distance = edit_distance(query_word,word,typos)
+                if distance <= typos:
+                    similar[word] = 1.0 - distance / (len(query_word) + 1)
+        return similar
+
+    def _word_matches(self,query_words,ranked):
+        #Every query word gets the words it is part of or a typo of, a name scores the best score of its words for each query word
+        similar = [self._similar_words(word) for word in query_words]
+        visited = 0
+        for words in similar:
+            for word in sorted(words,key=words.get,reverse=True):
+                (start,end) = word_bounds(self.words,word)
+                for (_,id) in self.words[start:min(end,start + SEARCH_CANDIDATE_LIMIT)]:
+                    if visited >= SEARCH_CANDIDATE_LIMIT:
+                        return
+                    if id in ranked:
+                        continue
+                    visited += 1
+                    name = self.names[id]
+                    name_words = name.split()
+                    scores = [max((scores.get(word,0.0) for word in name_words),default=0.0) for scores in similar]
+                    score = sum(scores) / len(scores)
+                    if score == 1.0:
+                        ranked[id] = (SUBSTRING_MATCH,0.0,len(name),id)
+                    elif score >= FUZZY_THRESHOLD:
+                        ranked[id] = (FUZZY_MATCH,-score,len(name),id)
+
+    def search(self,query,limit):
+        """
+        Finds the cereals with the names best matching a query. Names equal to the query come first, then names starting with the query,
+        names with words starting with every query word, names with words containing every query word and last names where the words
+        are typos of the query words. Matches of the same kind are ordered by shorter name and then id
+        args:
+            query: String searched for
+            limit: Integer value of the max amount of ids returned
+        returns:
+            List of ids in ranked order
+        """
+        query = normalize_name(query)
+        if not query:
+            return []
+        query_words = query.split()
+        ranked = dict()
+        with self.lock:
+            self._prefix_matches(query,query_words,ranked,limit)
+            if len(ranked) < limit:
+                self._word_matches(query_words,ranked)
+        return [key[-1] for key in heapq.nsmallest(limit,ranked.values())]
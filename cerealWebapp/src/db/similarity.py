@@ -0,0 +1,156 @@
+import numpy as np
+from ..constants import CEREAL_HEADERS_WITH_ID
+from .structure import CerealStructure
+
+"""
+In memory nutrition feature matrix of the cereals for finding the cereals with the most similar nutrition. The raw values are kept in a numpy matrix
+with a row per cereal that is kept up to date by the write functions in dbfunctions, the standardized matrix the distances are computed on is made
+again from it after a change, the next time it is needed
+"""
+
+#Nutrition columns the similarity is computed on
+SIMILARITY_COLUMNS = ['calories','protein','fat','sodium','fiber','carbo','sugars','potass','vitamins']
+#Max amount of distances computed at once for a block of query cereals, keeps the memory of a large batch bounded
+DISTANCE_BLOCK_SIZE = 4000000
+#Rows the matrix starts with, it doubles in size when full
+INITIAL_CAPACITY = 1024
+
+FEATURE_POSITIONS = [CEREAL_HEADERS_WITH_ID.index(col) for col in SIMILARITY_COLUMNS]
+
+
+def feature_values(values):
+    """
+    Returns the nutrition values of a cereal as floats. Missing values and negative values, which mark missing values in the data, are NaN
+    args:
+        values: Iterable of the values of SIMILARITY_COLUMNS
+    """
+    features = []
+    for value in values:
+        if value is None or value != value or value < 0:
+            features.append(np.nan)
+        else:
+            features.append(float(value))
+    return features
+
+
+class CerealFeatureMatrix(CerealStructure):
+    """
+    The nutrition values of every cereal. The matrix is empty until loaded with build, see CerealStructure
+    """
+
+    def _clear(self):
+        self.size = 0
+        self.ids = np.empty(0,dtype=np.int64)
+        self.values = np.empty((0,len(SIMILARITY_COLUMNS)))
+        self.positions = dict()
+        #Standardized values and their squared norms, None when the values changed since they were made
+        self.standardized = None
+        self.norms = None
+
+    def _prepare(self,rows):
+        #rows is (id,values of SIMILARITY_COLUMNS) of every cereal of the table
+        ids = np.array([row[0] for row in rows],dtype=np.int64)
+        values = np.array([feature_values(row[1:]) for row in rows],dtype=np.float64).reshape(len(rows),len(SIMILARITY_COLUMNS))
+        return ids, values
+
+    def _load(self,prepared):
+        self._clear()
+        (self.ids,self.values) = prepared
+        self.size = len(self.ids)
+        self.positions = {id : pos for (pos,id) in enumerate(self.ids.tolist())}
+
+    def _add(self,row):
+        id = row[0]
+        features = feature_values(row[pos] for pos in FEATURE_POSITIONS)
+        if id in self.positions:
+            self.values[self.positions[id]] = features
+            return
+        if self.size == len(self.ids):
+            capacity = max(INITIAL_CAPACITY,2 * len(self.ids))
+            self.ids = np.resize(self.ids,capacity)
+            self.values = np.resize(self.values,(capacity,len(SIMILARITY_COLUMNS)))
+        self.ids[self.size] = id
+        self.values[self.size] = features
+        self.positions[id] = self.size
+        self.size += 1
+
+    def _remove(self,id):
+        #The last row is moved into the place of the removed row so the rows stay packed
+        pos = self.positions.pop(id,None)
+        if pos is None:
+            return
+        last = self.size - 1
+        if pos != last:
+            self.ids[pos] = self.ids[last]
+            self.values[pos] = self.values[last]
+            self.positions[int(self.ids[pos])] = pos
+        self.size = last
+
+    def _insert_rows(self,rows):
+        for row in rows:
+            self._add(row)
+        self.standardized = None
+
+    def _delete_rows(self,rows):
+        for row in rows:
+            self._remove(row[0])
+        self.standardized = None
+
+    def _update_row(self,old_row,new_row):
+        #Nothing is done if none of the nutrition values changed
+        if any(old_row[pos] != new_row[pos] for pos in FEATURE_POSITIONS):
+            self._add(new_row)
+            self.standardized = None
+
+    def _standardize(self):
+        #Every column gets mean 0 and standard deviation 1 so each nutrition value counts the same, missing values get the mean
+        if self.standardized is not None:
+            return
+        values = self.values[:self.size]
+        missing = np.isnan(values)
+        counts = np.maximum((~missing).sum(axis=0),1)
+        mean = np.where(missing,0.0,values).sum(axis=0) / counts
+        centered = np.where(missing,0.0,values - mean)
+        std = np.sqrt(np.einsum('ij,ij->j',centered,centered) / counts)
+        std[std == 0] = 1.0
+        centered /= std
+        self.standardized = centered
+        self.norms = np.einsum('ij,ij->i',centered,centered)
+
+    def nearest(self,ids,k):
+        """
+        Finds the k cereals with the nutrition closest to each of the given cereals, as the euclidean distance of the standardized values
+        args:
+            ids: List of integer ids of the cereals to find similar cereals for
+            k: Integer value of the amount of similar cereals per cereal
+        returns:
+            List with an entry per id, None if the id is not in the matrix, otherwise a list of (id,distance) tuples ordered by distance and then id
+        """
+        with self.lock:
+            self._standardize()
+            found = [(i,self.positions[id]) for (i,id) in enumerate(ids) if id in self.positions]
+            results = [None] * len(ids)
+            #The cereal itself is not one of its similar cereals
+            k = min(k,self.size - 1)
+            if k <= 0:
+                for (i,_) in found:
+                    results[i] = []
+                return results
+
+            block = max(1,DISTANCE_BLOCK_SIZE // self.size)
+            for start in range(0,len(found),block):
+                chunk = found[start:start + block]
+                positions = np.array([pos for (_,pos) in chunk])
+                queries = self.standardized[positions]
+                #|a-b|^2 = |a|^2 + |b|^2 - 2ab lets every distance of the block be computed with one matrix product
+                distances = self.norms[None,:] + self.norms[positions][:,None] - 2.0 * (queries @ self.standardized.T)
+                np.maximum(distances,0.0,out=distances)
+                distances[np.arange(len(chunk)),positions] = np.inf
+                nearest = np.argpartition(distances,k - 1,axis=1)[:,:k]
+                for (row,(i,_)) in enumerate(chunk):
+                    candidates = nearest[row]
+                    candidate_distances = np.sqrt(distances[row,candidates])
+                    candidate_ids = self.ids[candidates]
+                    order = np.lexsort((candidate_ids,candidate_distances))
+                    results[i] = list(zip(candidate_ids[order].tolist(),candidate_distances[order].tolist()))
+            return results
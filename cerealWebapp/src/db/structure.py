@@ -0,0 +1,70 @@
+import threading
+
+"""
+Base of the in memory structures built from the cereal table, like the sorted indexes and the running aggregates. A structure matches one
+version of the cereal table, see db_get_cereal_table_version in dbfunctions, and is only used while the table is at that version.
+Writes made by this process move a structure to the version after the write, a write it did not see leaves it behind the table and it is built again
+"""
+
+
+class CerealStructure():
+    """
+    Keeps the table version of a structure and changes the structure under its lock, so a build and the writes of this process never interleave.
+    Subclasses implement _clear, _prepare, _load, _insert_rows, _delete_rows and _update_row, all but _prepare are called with the lock held
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        #Version of the cereal table the structure matches, None until it is built
+        self.version = None
+        self._clear()
+
+    @property
+    def ready(self):
+        return self.version is not None
+
+    def is_current(self,version):
+        """
+        Returns True if the structure matches the given version of the cereal table
+        """
+        return version is not None and self.version == version
+
+    def build(self,data,version):
+        """
+        Loads the structure from data read from the table at a version. The version can be lower than the one the structure had,
+        a database that was set up again starts over
+        """
+        prepared = self._prepare(data)
+        with self.lock:
+            self._load(prepared)
+            self.version = version
+
+    def reset(self):
+        """
+        Empties the structure, it has to be built again before it is used
+        """
+        with self.lock:
+            self.version = None
+            self._clear()
+
+    def apply_write(self,before,after,inserted=(),deleted=(),updated=()):
+        """
+        Applies a committed write that moved the table from version before to version after. Only a structure at version before
+        is changed, a structure built after the commit already has the write and one that is behind the table stays behind
+        args:
+            before: Integer value of the table version before the write
+            after: Integer value of the table version after the write
+            inserted: List of rows that were added
+            deleted: List of rows that were deleted
+            updated: List of (old_row,new_row) tuples of updated cereals
+        """
+        with self.lock:
+            if self.version is None or self.version != before:
+                return
+            if inserted:
+                self._insert_rows(inserted)
+            if deleted:
+                self._delete_rows(deleted)
+            for (old_row,new_row) in updated:
+                self._update_row(old_row,new_row)
+            self.version = after
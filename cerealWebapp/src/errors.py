@@ -13,3 +13,9 @@ class OperatorNotFoundError(Exception):
     Exception for if operator is not found
     """
     pass
+
+class ImportQueueFullError(Exception):
+    """
+    Exception for when too many import jobs are waiting to run
+    """
+    pass
@@ -0,0 +1,297 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+import time
+import uuid
+from flask import current_app
+from ..db.dbfunctions import db_delete_import_progress, db_get_import_progress, db_import_cereal_csv
+from ..errors import ImportQueueFullError
+
+"""
+Background csv import jobs. An upload is saved to the import spool folder and inserted by a bounded pool of worker threads,
+the request returns the job id at once. The rows and counters a job has committed are saved in the importprogress table
+in the transaction of each chunk, so a failed or interrupted job is resumed from the last committed chunk. The state of a job is
+saved next to its upload for the status requests, after a crash it can be a chunk behind the database
+"""
+
+#Max amount of rejected rows kept in the job status, the rejected count includes every row
+MAX_REPORTED_REJECTIONS = 100
+#Seconds between looking for expired jobs in the spool folder
+EXPIRY_INTERVAL = 60
+
+_jobs = dict()
+_jobs_lock = threading.Lock()
+_executor = None
+_last_expiry = 0.0
+
+
+class ImportJob():
+    """
+    State of a single csv import
+    """
+
+    def __init__(self,id,filename):
+        self.id = id
+        self.filename = filename
+        #queued, running, done or failed
+        self.state = 'queued'
+        self.rows_processed = 0
+        self.rows_inserted = 0
+        self.rows_rejected = 0
+        self.rejected = []
+        #Data rows of the file that are committed or rejected, a resumed job skips the rows committed in the importprogress table
+        self.committed_rows = 0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        #Seconds spent running in earlier attempts, used for the throughput of resumed jobs
+        self.elapsed = 0.0
+
+    def throughput(self):
+        """
+        Returns the rows processed per second while the job has been running
+        """
+        elapsed = self.elapsed
+        if self.started is not None:
+            elapsed += (self.finished or time.time()) - self.started
+        if elapsed <= 0:
+            return 0.0
+        return self.rows_processed / elapsed
+
+    def to_dict(self):
+        return {'id' : self.id, 'filename' : self.filename, 'state' : self.state, 'rows_processed' : self.rows_processed,
+                'rows_inserted' : self.rows_inserted, 'rows_rejected' : self.rows_rejected, 'rejected' : self.rejected,
+                'committed_rows' : self.committed_rows, 'error' : self.error, 'created' : self.created, 'started' : self.started,
+                'finished' : self.finished, 'elapsed' : self.elapsed, 'throughput' : self.throughput()}
+
+    @classmethod
+    def from_dict(cls,values):
+        job = cls(values['id'],values['filename'])
+        for (key,value) in values.items():
+            if key != 'throughput':
+                setattr(job,key,value)
+        return job
+
+
+def get_spool_dir():
+    """
+    Returns the folder uploads are saved to while they are imported, the folder is created if it dosent exist
+    """
+    spool_dir = current_app.config.get('IMPORT_SPOOL_DIR') or os.path.join(current_app.instance_path,'imports')
+    os.makedirs(spool_dir, exist_ok=True)
+    return spool_dir
+
+def get_executor():
+    """
+    Returns the worker pool of the import jobs, created with IMPORT_WORKERS threads the first time it is needed
+    """
+    global _executor
+    with _jobs_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=current_app.config.get('IMPORT_WORKERS',2), thread_name_prefix='import')
+        return _executor
+
+def save_job(job):
+    """
+    Saves the state of a job next to its upload so it can be resumed after a restart
+    """
+    path = os.path.join(get_spool_dir(), '%s.json' % job.id)
+    with open(path + '.tmp','w') as f:
+        json.dump(job.to_dict(), f)
+    os.replace(path + '.tmp', path)
+
+def expire_jobs():
+    """
+    Removes the jobs that finished more than IMPORT_JOB_TTL seconds ago, from memory and from the spool folder with their upload.
+    The spool folder is shared with other processes and survives restarts, so its files are expired by the time they were last saved.
+    Runs at most once every EXPIRY_INTERVAL seconds
+    """
+    global _last_expiry
+    now = time.time()
+    with _jobs_lock:
+        if now - _last_expiry < EXPIRY_INTERVAL:
+            return
+        _last_expiry = now
+        expires = now - current_app.config.get('IMPORT_JOB_TTL',86400)
+        expired = [job.id for job in _jobs.values() if job.state in ('done','failed') and job.finished is not None and job.finished < expires]
+        for job_id in expired:
+            del _jobs[job_id]
+    spool_dir = get_spool_dir()
+    for filename in os.listdir(spool_dir):
+        (job_id,ext) = os.path.splitext(filename)
+        if ext != '.json' or job_id in expired:
+            continue
+        with _jobs_lock:
+            if job_id in _jobs:
+                continue
+        try:
+            if os.path.getmtime(os.path.join(spool_dir,filename)) < expires:
+                expired.append(job_id)
+        except OSError:
+            continue
+    for job_id in expired:
+        for path in (os.path.join(spool_dir,'%s.json' % job_id),os.path.join(spool_dir,'%s.csv' % job_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                #Already removed, by the job itself or by another process
+                pass
+        current_app.logger.info('Expired import job %s', job_id)
+    #Failed jobs keep their progress for a resume until they expire
+    if expired:
+        db_delete_import_progress(expired)
+
+def get_import_job(job_id):
+    """
+    Returns an import job, jobs from before a restart are loaded from the spool folder and marked failed if they never finished
+    args:
+        job_id: String of the job id
+    returns:
+        ImportJob
+    throws:
+        LookupError: If the job dosent exist
+    """
+    expire_jobs()
+    with _jobs_lock:
+        if job_id in _jobs:
+            return _jobs[job_id]
+    #Only hex ids are valid, so the id can never point outside the spool folder
+    try:
+        uuid.UUID(hex=job_id)
+        with open(os.path.join(get_spool_dir(), '%s.json' % job_id)) as f:
+            job = ImportJob.from_dict(json.load(f))
+    except (ValueError,OSError):
+        raise LookupError('Import job does not exist')
+    if job.state in ('queued','running'):
+        job.state = 'failed'
+        job.error = 'Interrupted by a restart'
+    with _jobs_lock:
+        return _jobs.setdefault(job_id,job)
+
+def start_import_job(file):
+    """
+    Saves an uploaded csv to the spool folder and queues it for import
+    args:
+        file: File object uploaded
+    returns:
+        ImportJob of the queued import
+    throws:
+        ImportQueueFullError: If IMPORT_MAX_QUEUED jobs are already waiting
+    """
+    expire_jobs()
+    job = ImportJob(uuid.uuid4().hex, file.filename)
+    queue_job(job)
+    try:
+        file.save(os.path.join(get_spool_dir(), '%s.csv' % job.id))
+    except OSError:
+        with _jobs_lock:
+            del _jobs[job.id]
+        raise
+    save_job(job)
+    submit_job(job)
+    current_app.logger.info('Queued import job %s for %s', job.id, job.filename)
+    return job
+
+def resume_import_job(job_id):
+    """
+    Queues a failed import job again, it continues after the last committed chunk
+    args:
+        job_id: String of the job id
+    returns:
+        ImportJob
+    throws:
+        LookupError: If the job dosent exist
+        ValueError: If the job has not failed
+        ImportQueueFullError: If IMPORT_MAX_QUEUED jobs are already waiting
+    """
+    job = get_import_job(job_id)
+    queue_job(job,'failed')
+    save_job(job)
+    submit_job(job)
+    current_app.logger.info('Resumed import job %s at row %d', job.id, job.committed_rows)
+    return job
+
+def queue_job(job,required_state=None):
+    """
+    Marks a job queued and registers it. The queued jobs are counted and the job is registered under one lock,
+    so concurrent requests can never queue more than IMPORT_MAX_QUEUED jobs
+    args:
+        job: ImportJob being queued
+        required_state: String of the state the job must be in, None for a new job
+    throws:
+        ValueError: If the job is not in required_state
+        ImportQueueFullError: If IMPORT_MAX_QUEUED jobs are already waiting
+    """
+    max_queued = current_app.config.get('IMPORT_MAX_QUEUED',10)
+    with _jobs_lock:
+        if required_state is not None and job.state != required_state:
+            raise ValueError('Only %s jobs can be queued again' % required_state)
+        queued = sum(1 for other in _jobs.values() if other.state == 'queued')
+        if queued >= max_queued:
+            raise ImportQueueFullError()
+        job.state = 'queued'
+        job.error = None
+        _jobs[job.id] = job
+
+def submit_job(job):
+    app = current_app._get_current_object()
+    get_executor().submit(run_import_job, app, job)
+
+def run_import_job(app,job):
+    """
+    Runs an import job in a worker thread, the job state is updated and saved after each chunk
+    args:
+        app: The flask app, the import runs in its app context
+        job: ImportJob being run
+    """
+    with app.app_context():
+        job.state = 'running'
+        job.started = time.time()
+        job.finished = None
+        #The database has the chunks that were committed, the saved state misses the last one if the process stopped before saving it
+        saved = db_get_import_progress(job.id)
+        if saved is not None:
+            job.committed_rows = saved['committed_rows']
+            job.rows_processed = saved['committed_rows']
+            job.rows_inserted = saved['rows_inserted']
+            job.rows_rejected = saved['rows_rejected']
+        save_job(job)
+
+        def progress(chunk_report,rows_in_chunk):
+            #A chunk with a DB error was rolled back, its rows are counted when it is imported again by a resume
+            if chunk_report['error']:
+                return
+            job.rows_processed += rows_in_chunk
+            job.rows_inserted += chunk_report['inserted']
+            job.rows_rejected += len(chunk_report['rejected'])
+            space = MAX_REPORTED_REJECTIONS - len(job.rejected)
+            if space > 0:
+                job.rejected.extend(chunk_report['rejected'][:space])
+            job.committed_rows += rows_in_chunk
+            save_job(job)
+
+        path = os.path.join(get_spool_dir(), '%s.csv' % job.id)
+        try:
+            if saved is None:
+                raise RuntimeError('DB Error occured when getting import progress')
+            with open(path,'rb') as f:
+                report = db_import_cereal_csv(f, skip_rows=job.committed_rows, progress=progress, job_id=job.id)
+            job.error = report['error']
+        except Exception as e:
+            job.error = str(e)
+            current_app.logger.exception('Import job %s failed', job.id)
+
+        job.finished = time.time()
+        job.elapsed += job.finished - job.started
+        job.started = None
+        if job.error:
+            job.state = 'failed'
+            save_job(job)
+        else:
+            job.state = 'done'
+            save_job(job)
+            os.remove(path)
+            db_delete_import_progress([job.id])
+        current_app.logger.info('Import job %s %s, %d rows inserted', job.id, job.state, job.rows_inserted)
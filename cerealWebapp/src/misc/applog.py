@@ -0,0 +1,165 @@
+from flask import g, has_request_context, request
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+import datetime
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+
+"""
+Logging setup of the webapp. Log records are put on a queue by the thread that logs them and written as json lines by a single listener thread,
+so request threads never wait on the log file. Records made while handling a request get the request id and the time since the request started
+"""
+
+#Header a client or proxy can pass its own request id in, the id is sent back in the response
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+_listener = None
+_handler = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single line json object
+    """
+
+    def format(self,record):
+        entry = {'time' : datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+                 'level' : record.levelname,
+                 'logger' : record.name,
+                 'thread' : record.threadName,
+                 'message' : record.getMessage()}
+        for field in ('request_id','method','path','elapsed_ms','status','duration_ms'):
+            value = getattr(record,field,None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Adds the request id, method, path with the query string and the milliseconds since the request started to records made while handling a request.
+    Runs in the thread that logs the record, the listener thread has no request context
+    """
+
+    def filter(self,record):
+        if has_request_context() and 'request_id' in g:
+            record.request_id = g.request_id
+            record.method = request.method
+            #The query string is kept so the log can be replayed by the load test tool
+            record.path = request.full_path if request.query_string else request.path
+            record.elapsed_ms = round((time.perf_counter() - g.request_start) * 1000, 3)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a share of the info and debug records, warnings and above are always kept
+    """
+
+    def __init__(self,rate):
+        """
+        args:
+            rate: Share of the info and debug records that are kept, 1 keeps every record and 0 none
+        """
+        super().__init__()
+        self.rate = rate
+
+    def filter(self,record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Queue handler that drops records when the queue is full instead of waiting, the dropped records are counted
+    """
+
+    def __init__(self,log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self,record):
+        #The message and traceback are made here since the arguments can change before the listener writes the record
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self,record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def init_logging(app,filename='record.log',level='INFO',max_bytes=10485760,backup_count=5,info_sample_rate=1.0,queue_size=10000):
+    """
+    Sends the log records of the app to a rotating json lines file through a queue and registers the request id hooks
+    args:
+        app: The flask app
+        filename: String of the log file path
+        level: String or integer value of the lowest level that is logged
+        max_bytes: Integer value of the size in bytes the log file is rotated at, 0 never rotates
+        backup_count: Integer value of the amount of rotated files kept
+        info_sample_rate: Share of the info and debug records that are logged
+        queue_size: Integer value of the max amount of records waiting to be written, records are dropped when it is full
+    """
+    global _listener, _handler
+    with _setup_lock:
+        root = logging.getLogger()
+        #The app can be created more than once in a process, the previous pipeline is flushed and replaced
+        if _listener is not None:
+            _listener.stop()
+        if _handler is not None:
+            root.removeHandler(_handler)
+
+        file_handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        log_queue = queue.Queue(queue_size)
+        _handler = NonBlockingQueueHandler(log_queue)
+        _handler.addFilter(SamplingFilter(info_sample_rate))
+        _handler.addFilter(RequestContextFilter())
+        _listener = QueueListener(log_queue, file_handler)
+        _listener.start()
+        root.addHandler(_handler)
+        root.setLevel(level)
+        app.logger.setLevel(level)
+
+    @app.before_request
+    def start_request_log():
+        g.request_id = request.headers.get(REQUEST_ID_HEADER,'')[:128] or uuid.uuid4().hex
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def finish_request_log(response):
+        if 'request_id' in g:
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+            app.logger.info('Request handled', extra={'status' : response.status_code,
+                                                      'duration_ms' : round((time.perf_counter() - g.request_start) * 1000, 3)})
+        return response
+
+def stop_logging():
+    """
+    Writes the records left in the queue and stops the listener thread
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+atexit.register(stop_logging)
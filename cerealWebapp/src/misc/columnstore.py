@@ -0,0 +1,211 @@
+import operator
+import numpy as np
+from ..constants import CEREAL_HEADERS_WITH_ID
+from ..db.models import Cereal
+from ..errors import OperatorNotFoundError
+
+"""
+Columnar in memory copy of the cereal table. Each column is kept as one typed numpy array and the low cardinality
+string columns are dictionary encoded, a list of filters is evaluated into one boolean mask and rows are only
+materialized for the cereals that pass every filter
+"""
+
+#Columns stored as integer codes into a sorted dictionary of their distinct values
+DICTIONARY_COLUMNS = {'mfr', 'type'}
+#Rows are evaluated in blocks of this size so all the filters on a block run while it is still in the cpu cache
+BLOCK_SIZE = 65536
+
+NUMPY_OPERATORS = {'=' : operator.eq, '!=' : operator.ne, '<' : operator.lt, '>' : operator.gt, '<=' : operator.le, '>=' : operator.ge}
+
+def apply_operator(array,op,value,missing=None):
+    """
+    Compares a numpy array to a value with a filter operator
+    args:
+        array: numpy array of the column values
+        op: String of the operator for the filter, must be in FILTER_OPERATORS
+        value: Value for the filter
+        missing: Boolean numpy array with True for the missing values of an object array, see missing_values. None if it has none
+    returns:
+        Boolean numpy array of the rows fulfilling the filter
+    throws:
+        OperatorNotFoundError: If the operator does not exist
+    """
+    if op not in NUMPY_OPERATORS:
+        raise OperatorNotFoundError()
+    if missing is None or not missing.any():
+        return np.asarray(NUMPY_OPERATORS[op](array,value), dtype=bool)
+    #Missing values cant be compared to a string, like NULL in filter_to_sql they only fulfill !=
+    result = np.full(len(array), op == '!=', dtype=bool)
+    present = ~missing
+    result[present] = np.asarray(NUMPY_OPERATORS[op](array[present],value), dtype=bool)
+    return result
+
+def missing_values(array):
+    """
+    Returns a boolean numpy array with True for the missing values(None or NaN) of an object array
+    """
+    return np.fromiter((val is None or val != val for val in array), dtype=bool, count=len(array))
+
+def column_dtype(column):
+    """
+    Returns the numpy dtype used for a numeric cereal column, based on the column type of the Cereal model
+    """
+    if Cereal.__table__.c[column].type.python_type is int:
+        return np.int64
+    return np.float64
+
+
+class CerealColumnStore():
+    """
+    Columnar store of cereal rows, create it with from_rows or from_df
+    """
+
+    def __init__(self,columns,dictionaries,size):
+        """
+        args:
+            columns: Dictionary of column name to numpy array, dictionary encoded columns hold the codes
+            dictionaries: Dictionary of column name to the sorted numpy array of distinct values for dictionary encoded columns
+            size: Integer value of the amount of rows
+        """
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.size = size
+        #Missing values of the object columns, found once so filters dont have to look for them
+        self.missing = {col : missing_values(array) for (col,array) in columns.items() if array.dtype == object}
+
+    @classmethod
+    def from_rows(cls,rows):
+        """
+        Builds a store from rows of cereal values
+        args:
+            rows: List of tuples/lists with values ordered as CEREAL_HEADERS_WITH_ID
+        returns:
+            CerealColumnStore
+        """
+        values = list(zip(*rows)) if rows else [() for _ in CEREAL_HEADERS_WITH_ID]
+        return cls._from_columns(dict(zip(CEREAL_HEADERS_WITH_ID,values)), len(rows))
+
+    @classmethod
+    def from_df(cls,df):
+        """
+        Builds a store from a DataFrame with the columns of CEREAL_HEADERS_WITH_ID
+        """
+        return cls._from_columns({col : df[col].tolist() for col in CEREAL_HEADERS_WITH_ID}, len(df))
+
+    @classmethod
+    def _from_columns(cls,values,size):
+        columns = dict()
+        dictionaries = dict()
+        for col in CEREAL_HEADERS_WITH_ID:
+            col_values = values[col]
+            if col in DICTIONARY_COLUMNS:
+                #Sorted dictionary so comparing codes gives the same result as comparing the strings, missing values(None or NaN) get code -1
+                dictionary = np.array(sorted({val for val in col_values if val is not None and val == val}), dtype=object)
+                lookup = {val : code for (code,val) in enumerate(dictionary)}
+                columns[col] = np.fromiter((lookup.get(val,-1) for val in col_values), dtype=np.int16, count=size)
+                dictionaries[col] = dictionary
+            elif col == 'name':
+                columns[col] = np.array(col_values, dtype=object)
+            else:
+                dtype = column_dtype(col)
+                if dtype is np.int64 and any(val is None or val != val for val in col_values):
+                    #Integer arrays cant hold missing values so the column becomes float with NaN like pandas does
+                    dtype = np.float64
+                columns[col] = np.array([np.nan if val is None else val for val in col_values], dtype=dtype)
+        return cls(columns,dictionaries,size)
+
+    def _dictionary_predicate(self,column,op,value):
+        """
+        Translates a filter on a dictionary encoded column into an operator and value on the codes
+        returns:
+            Tuple of (op,code,exclude_missing)
+        """
+        dictionary = self.dictionaries[column]
+        left = int(np.searchsorted(dictionary,value,'left'))
+        right = int(np.searchsorted(dictionary,value,'right'))
+        if op == '=' or op == '!=':
+            #Value not in the dictionary gets a code no row has
+            code = left if left < right else -2
+            return (op,code,False)
+        elif op == '<':
+            return ('<',left,True)
+        elif op == '<=':
+            return ('<',right,True)
+        elif op == '>':
+            return ('>=',right,True)
+        elif op == '>=':
+            return ('>=',left,True)
+        raise OperatorNotFoundError()
+
+    def mask(self,args):
+        """
+        Evaluates a list of filters into one boolean mask, the filters are applied block by block in a single pass over the rows
+        args:
+            args: List of tuples with
+                column: String of the name of the column being filtered
+                op: String of the operator for the filter, must be in FILTER_OPERATORS
+                value: Value for the filter
+        returns:
+            Boolean numpy array with True for the rows fulfilling every filter
+        throws:
+            OperatorNotFoundError: If the operator does not exist
+            KeyError: If the column does not exist
+        """
+        predicates = []
+        for (column,op,value) in args:
+            array = self.columns[column]
+            if column in DICTIONARY_COLUMNS:
+                (op,value,exclude_missing) = self._dictionary_predicate(column,op,value)
+                predicates.append((array,op,value,exclude_missing,None))
+            else:
+                if op not in NUMPY_OPERATORS:
+                    raise OperatorNotFoundError()
+                predicates.append((array,op,value,False,self.missing.get(column)))
+
+        result = np.ones(self.size, dtype=bool)
+        for start in range(0,self.size,BLOCK_SIZE):
+            block = result[start:start + BLOCK_SIZE]
+            for (array,op,value,exclude_missing,missing) in predicates:
+                values = array[start:start + BLOCK_SIZE]
+                if missing is not None:
+                    missing = missing[start:start + BLOCK_SIZE]
+                np.logical_and(block, apply_operator(values,op,value,missing), out=block)
+                if exclude_missing:
+                    np.logical_and(block, values >= 0, out=block)
+        return result
+
+    def rows(self,mask=None):
+        """
+        Materializes the rows of a mask
+        args:
+            mask: Boolean numpy array from mask, None for every row
+        returns:
+            Tuple of (numpy array of row positions, dictionary of column name to numpy array of the decoded values)
+        """
+        if mask is None:
+            positions = np.arange(self.size)
+        else:
+            positions = np.flatnonzero(mask)
+        columns = dict()
+        for col in CEREAL_HEADERS_WITH_ID:
+            values = self.columns[col][positions]
+            if col in DICTIONARY_COLUMNS:
+                dictionary = np.append(self.dictionaries[col], None)
+                values = dictionary[values]
+            columns[col] = values
+        return positions, columns
+
+    def to_df(self,mask=None):
+        """
+        Materializes the rows of a mask into a DataFrame, the index is the row position in the store
+        """
+        #pandas is only imported when a DataFrame is built so it is not loaded to serve the api
+        import pandas as pd
+        (positions,columns) = self.rows(mask)
+        return pd.DataFrame(columns, index=positions, columns=CEREAL_HEADERS_WITH_ID)
+
+    def filter(self,args):
+        """
+        Filters the store and returns the rows fulfilling every filter as a DataFrame
+        """
+        return self.to_df(self.mask(args))
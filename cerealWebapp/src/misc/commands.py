@@ -0,0 +1,56 @@
+import click
+import sys
+from flask import current_app
+from ..db.dbfunctions import db_bulk_load_cereals
+from ... import db
+from .generator import CatalogModel, chunk_rows, generate_catalog, write_catalog_csv
+
+"""
+Flask cli commands of the webapp, run with flask <command> in the cerealWebapp folder
+"""
+
+def register_commands(app):
+
+    @app.cli.command('generate-cereals')
+    @click.argument('count', type=click.IntRange(min=1))
+    @click.option('--csv', 'csv_path', default=None, help='Write the cereals as a csv to this file, - writes to stdout')
+    @click.option('--db', 'to_db', is_flag=True, help='Insert the cereals into the database')
+    @click.option('--source', default='cereals.csv', show_default=True, help='Csv of real cereals the distributions are learned from')
+    @click.option('--seed', type=int, default=None, help='Seed of the random generator, the same seed gives the same cereals')
+    @click.option('--chunk-size', type=click.IntRange(min=1), default=None, help='Cereals generated and inserted per transaction, default is the bulk_insert_chunk_size config')
+    def generate_cereals(count,csv_path,to_db,source,seed,chunk_size):
+        """
+        Generates COUNT synthetic cereals with distributions learned from the source csv. The cereals are streamed to a csv
+        or inserted into the database a chunk at a time, so the amount of cereals is not limited by memory
+        """
+        if (csv_path is None) == (not to_db):
+            raise click.UsageError('Give either --csv or --db')
+        if chunk_size is None:
+            chunk_size = current_app.config.get('BULK_INSERT_CHUNK_SIZE',1000)
+        model = CatalogModel.from_csv(source)
+        chunks = generate_catalog(model,count,chunk_size,seed)
+
+        if csv_path is not None:
+            if csv_path == '-':
+                written = write_catalog_csv(chunks,sys.stdout)
+            else:
+                with open(csv_path,'w',newline='',encoding='utf-8') as f:
+                    written = write_catalog_csv(chunks,f)
+            click.echo('Wrote %d cereals' % written, err=True)
+            return
+
+        def progress(inserted):
+            if inserted % (chunk_size * 100) < chunk_size or inserted == count:
+                click.echo('Inserted %d of %d cereals' % (inserted,count), err=True)
+
+        inserted = db_bulk_load_cereals((chunk_rows(columns) for columns in chunks), progress)
+        click.echo('Inserted %d cereals' % inserted, err=True)
+
+    @app.cli.command('create-tables')
+    def create_tables():
+        """
+        Creates the tables a database made by an older version of the webapp is missing, like cerealversion with the triggers that bump it
+        and importprogress. Existing tables are not changed
+        """
+        db.create_all()
+        click.echo('Tables are in place', err=True)
@@ -1,4 +1,10 @@
+import operator
+import numpy as np
+import sqlalchemy
 from ..errors import FilterError, OperatorNotFoundError
+from ..constants import CEREAL_HEADERS_WITH_ID
+from ..db.models import Cereal
+from .columnstore import apply_operator, missing_values
 
 """
 Functions for filtering goes here, contains functions for basic filtering and validation if a list of filters can produce a result
@@ -133,7 +139,7 @@ def check_valid_filters(args):
 
 def filter_cereals(df,args):
     """
-    Takes a dataframe and performs a list of filters on it
+    Takes a dataframe and performs a list of filters on it, the filters are combined into one mask so the dataframe is only copied once
     args:
         df: DataFrame with the cereal data
         args: List of tuples with 
@@ -145,21 +151,46 @@ def filter_cereals(df,args):
         throws:
             OperatorNotFoundError: If the operator does not exist
     """
+    mask = np.ones(len(df), dtype=bool)
     for (column,op,value) in args:
-        if op == '=':
-            df = df.loc[df[column] == value] 
-        elif op == '!=':
-            df = df.loc[df[column] != value]   
-        elif op == '>':
-            df = df.loc[df[column] > value] 
-        elif op == '<':
-            df = df.loc[df[column] < value] 
-        elif op == '<=':
-            df = df.loc[df[column] <= value] 
-        elif op == '>=':
-            df = df.loc[df[column] >= value] 
-        else:
-            raise OperatorNotFoundError()
-    return df
+        array = df[column].to_numpy()
+        missing = missing_values(array) if array.dtype == object else None
+        np.logical_and(mask, apply_operator(array,op,value,missing), out=mask)
+    return df.loc[mask]
 
 
+#Maps the filter operators to the python operator used on SQLAlchemy columns
+SQL_OPERATORS = {'=' : operator.eq, '!=' : operator.ne, '<' : operator.lt, '>' : operator.gt, '<=' : operator.le, '>=' : operator.ge}
+
+def filter_to_sql(args,columns=None):
+    """
+    Compiles a list of filters into a SQLAlchemy WHERE clause on the Cereal model, so the filtering is done by the database
+    args:
+        args: List of tuples with 
+            column: String of the name of the column being filtered, must be in CEREAL_HEADERS_WITH_ID
+            op: String of the operator for the filter, must be in FILTER_OPERATORS
+            value: Value for the filter 
+        columns: Column collection the filters are on, like the c of a subquery selecting the cereal columns. None for the cereal table
+    returns:
+        SQLAlchemy clause that can be passed to a query filter
+    throws:
+        OperatorNotFoundError: If the operator does not exist
+        KeyError: If the column does not exist
+    """
+    if columns is None:
+        columns = Cereal.__table__.c
+    clauses = []
+    for (column,op,value) in args:
+        if column not in CEREAL_HEADERS_WITH_ID:
+            raise KeyError(column)
+        if op not in SQL_OPERATORS:
+            raise OperatorNotFoundError()
+        sql_column = columns[column]
+        clause = SQL_OPERATORS[op](sql_column,value)
+        #SQL comparisons with NULL are never true, pandas treats != NULL as true so we keep that behaviour
+        if op == '!=':
+            clause = sqlalchemy.or_(clause, sql_column.is_(None))
+        clauses.append(clause)
+    if not clauses:
+        return sqlalchemy.true()
+    return sqlalchemy.and_(*clauses)
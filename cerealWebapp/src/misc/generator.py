@@ -0,0 +1,126 @@
+import csv
+import numpy as np
+from ..constants import ALLOWED_MFR, ALLOWED_TYPES, CEREAL_HEADERS_WITHOUT_ID
+from ..db.models import Cereal
+
+"""
+Synthetic cereal catalog generator. The distributions are learned from a csv of real cereals, every generated cereal is a real cereal
+picked at random with noise added to its nutrition values. Picking whole rows keeps the manufacturer, type and the nutrition values of a cereal
+related like in the real data, the noise makes the values spread out around the real ones
+"""
+
+#Share of a column's standard deviation used as the standard deviation of the noise added to it
+NOISE_BANDWIDTH = 0.15
+#Columns with at most this many distinct values, like shelf and vitamins, are copied from the picked cereal without noise
+MAX_DISCRETE_VALUES = 10
+#Decimals the generated float values are rounded to
+FLOAT_DECIMALS = 2
+
+
+class CatalogModel():
+    """
+    The cereals a catalog is generated from and the noise scale and value range of each numeric column
+    """
+
+    def __init__(self,rows):
+        """
+        args:
+            rows: List of dictionaries of column to value of the cereals, only cereals with a mfr in ALLOWED_MFR and a type in ALLOWED_TYPES are used
+        throws:
+            ValueError: If no cereal is valid
+        """
+        rows = [row for row in rows if row['mfr'] in ALLOWED_MFR and row['type'] in ALLOWED_TYPES]
+        if not rows:
+            raise ValueError('No valid cereals to learn from')
+        self.size = len(rows)
+        self.columns = {col : np.array([row[col] for row in rows], dtype=object if col in ('name','mfr','type') else None)
+                        for col in CEREAL_HEADERS_WITHOUT_ID}
+        self.noise = dict()
+        self.bounds = dict()
+        for col in CEREAL_HEADERS_WITHOUT_ID:
+            values = self.columns[col]
+            if values.dtype == object or len(np.unique(values)) <= MAX_DISCRETE_VALUES:
+                continue
+            #Negative values mark missing values in the data, they are kept as they are
+            present = values[values >= 0]
+            self.noise[col] = NOISE_BANDWIDTH * float(present.std()) if len(present) else 0.0
+            self.bounds[col] = (float(present.min()),float(present.max())) if len(present) else (0.0,0.0)
+
+    @classmethod
+    def from_csv(cls,path):
+        """
+        Learns a model from a csv with the columns of CEREAL_HEADERS_WITHOUT_ID, like cereals.csv
+        """
+        rows = []
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                rows.append({col : Cereal.__table__.c[col].type.python_type(row[col]) for col in CEREAL_HEADERS_WITHOUT_ID})
+        return cls(rows)
+
+    def generate(self,count,rng,first_number=1):
+        """
+        Generates cereals as columns
+        args:
+            count: Integer value of the amount of cereals
+            rng: numpy random Generator
+            first_number: Integer value of the number in the name of the first cereal, names are the picked cereal's name and a number
+        returns:
+            Dictionary of column name to a list of count values, with the columns of CEREAL_HEADERS_WITHOUT_ID
+        """
+        picked = rng.integers(0,self.size,count)
+        columns = dict()
+        for col in CEREAL_HEADERS_WITHOUT_ID:
+            values = self.columns[col][picked]
+            if col == 'name':
+                columns[col] = ['%s %d' % (name[:36],number) for (name,number) in zip(values.tolist(),range(first_number,first_number + count))]
+                continue
+            if col in self.noise:
+                noisy = values + rng.normal(0.0,self.noise[col],count)
+                noisy = np.clip(noisy,*self.bounds[col])
+                values = np.where(values >= 0, noisy, values)
+                if Cereal.__table__.c[col].type.python_type is int:
+                    values = np.rint(values).astype(np.int64)
+                else:
+                    values = np.round(values,FLOAT_DECIMALS)
+            columns[col] = values.tolist()
+        return columns
+
+
+def generate_catalog(model,count,chunk_size,seed=None):
+    """
+    Generates a catalog a chunk at a time, so only one chunk is in memory
+    args:
+        model: CatalogModel
+        count: Integer value of the amount of cereals
+        chunk_size: Integer value of the cereals per chunk
+        seed: Integer seed of the random generator, the same seed gives the same catalog. None for a random catalog
+    yields:
+        Dictionaries of column name to a list of values, see CatalogModel.generate
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0,count,chunk_size):
+        yield model.generate(min(chunk_size,count - start),rng,start + 1)
+
+def chunk_rows(columns):
+    """
+    Returns the cereals of a generated chunk as a list of dictionaries of column to value
+    """
+    return [dict(zip(CEREAL_HEADERS_WITHOUT_ID,values)) for values in zip(*[columns[col] for col in CEREAL_HEADERS_WITHOUT_ID])]
+
+def write_catalog_csv(chunks,stream):
+    """
+    Writes generated chunks as a csv with a header of CEREAL_HEADERS_WITHOUT_ID, the csv can be imported with the csv import
+    args:
+        chunks: Iterable of generated chunks
+        stream: Text file stream written to
+    returns:
+        Integer value of the cereals written
+    """
+    writer = csv.writer(stream, lineterminator='\n')
+    writer.writerow(CEREAL_HEADERS_WITHOUT_ID)
+    written = 0
+    for columns in chunks:
+        rows = list(zip(*[columns[col] for col in CEREAL_HEADERS_WITHOUT_ID]))
+        writer.writerows(rows)
+        written += len(rows)
+    return written
@@ -1,8 +1,9 @@
+import hashlib
 import os
 from flask import current_app
 from werkzeug.utils import secure_filename
 
-from ..constants import ALLOWED_VALUES
+from ..constants import ALLOWED_VALUES, CEREAL_HEADERS_WITHOUT_ID, CONTENT_HASH_LENGTH
 
 
 """
@@ -21,8 +22,14 @@ def change_to_column_type(column,value):
         ValueError if value is not changeable into desired datatype
     """
     def check_int(value,constaints):
-        result_val = int(value) 
-        return result_val
+        try:
+            return int(value)
+        except ValueError:
+            #Csv files written by tools that store every number as a float have values like 110.0
+            result_val = float(value)
+            if result_val.is_integer():
+                return int(result_val)
+            raise
 
     def check_float(value,constraints):
         return float(value)
@@ -121,9 +128,62 @@ def get_cereal_value(cereal):
     
     
 
+def validate_cereal_row(cereal_item):
+    """
+    Validates a dictionary of cereal values and changes the values to their column datatypes, used for inserting without creating Cereal objects
+    args:
+        cereal_item: Dictionary of column header to value, id is ignored as it is assigned by the DB
+    returns:
+        Dictionary with every column of CEREAL_HEADERS_WITHOUT_ID, columns not given are None
+    throws:
+        ValueError: With the reason if a column dosent exist or a value is incorrect datatype
+    """
+    row = dict.fromkeys(CEREAL_HEADERS_WITHOUT_ID)
+    for (col,val) in cereal_item.items():
+        if col == 'id':
+            continue
+        if col not in row:
+            raise ValueError('Invalid column %s' % col)
+        try:
+            row[col] = change_to_column_type(col,val)
+        except (TypeError,ValueError):
+            raise ValueError('Invalid value %r for column %s' % (val,col))
+    return row
+
+
+def allowed_file(filename,allowed_extensions):
+    """
+    Checks if a filename has one of the allowed extensions
+    """
+    return '.' in filename and \
+        filename.rsplit('.', 1)[1].lower() in allowed_extensions
+
+
+def read_csv_chunks(stream,chunk_size,skip_rows=0):
+    """
+    Reads a csv of cereals from a file stream a chunk at a time, so only one chunk of the file is in memory
+    args:
+        stream: Binary file stream of the csv, must have a header with the columns of CEREAL_HEADERS_WITHOUT_ID
+        chunk_size: Integer value of how many rows are in each chunk
+        skip_rows: Integer value of how many data rows after the header are skipped
+    yields:
+        Lists of dictionaries of column header to the value as a string
+    throws:
+        ValueError: If the csv is missing columns or is not a valid csv
+    """
+    #pandas is only imported when a csv is read so it is not loaded to serve the api
+    import pandas as pd
+    #Values are kept as strings so they are validated the same way as form input, empty fields become empty strings
+    reader = pd.read_csv(stream, usecols=CEREAL_HEADERS_WITHOUT_ID, dtype=str, keep_default_na=False, chunksize=chunk_size,
+                         skiprows=range(1,skip_rows + 1))
+    for chunk in reader:
+        yield chunk.to_dict('records')
+
+
 def upload_file_func(file,allowed_extensions):
     """
-    Checks if a file is of an allowed extension type and saves it to the static location
+    Checks if a file is of an allowed extension type and saves it to the static location. The file is named after 
+    the hash of its content, so the same file is only stored once and a changed file always gets a new name
     args:
         file: File object uploaded
     returns:
@@ -131,14 +191,16 @@ def upload_file_func(file,allowed_extensions):
     throws:
         TypeError: If file extension is not allowed
     """
-    
-    def allowed_file(filename,allowed_extensions):
-        return '.' in filename and \
-            filename.rsplit('.', 1)[1].lower() in allowed_extensions
-
     if file and allowed_file(file.filename,allowed_extensions):
-        filename = secure_filename(file.filename)
-        file.save(get_static_path(filename))
+        digest = hashlib.sha256()
+        for block in iter(lambda: file.stream.read(65536), b''):
+            digest.update(block)
+        file.stream.seek(0)
+        extension = secure_filename(file.filename).rsplit('.', 1)[1].lower()
+        filename = '%s.%s' % (digest.hexdigest()[:CONTENT_HASH_LENGTH], extension)
+        path = get_static_path(filename)
+        if not os.path.exists(path):
+            file.save(path)
         return filename
     raise TypeError
 
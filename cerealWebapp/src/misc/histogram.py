@@ -0,0 +1,53 @@
+import bisect
+import threading
+
+"""
+Thread safe histogram with fixed bucket bounds, used for timing measurements
+"""
+
+def format_bound(bound):
+    """
+    Returns the string of a bucket bound, 0.5 as '0.5' and 1.0 as '1'
+    """
+    return '%g' % bound
+
+
+class Histogram():
+    """
+    Counts observed values in buckets by their upper bound, values above the last bound are counted in the +Inf bucket
+    """
+
+    def __init__(self,buckets):
+        """
+        args:
+            buckets: Sorted sequence of the upper bounds of the buckets
+        """
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        #One extra count for the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self,value):
+        pos = bisect.bisect_left(self.buckets,value)
+        with self.lock:
+            self.counts[pos] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """
+        Returns a dictionary with the count, the sum and a list of (upper bound,cumulative count) of every bucket.
+        The bounds are strings so the snapshot can be sent as json, the last bound is '+Inf'
+        """
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.sum
+        cumulative = []
+        running = 0
+        for (bound,bucket_count) in zip([format_bound(bound) for bound in self.buckets] + ['+Inf'], counts):
+            running += bucket_count
+            cumulative.append((bound,running))
+        return {'count' : count, 'sum' : total, 'buckets' : cumulative}
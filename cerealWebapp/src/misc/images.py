@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import threading
+from flask import current_app, url_for
+from ..constants import CONTENT_HASH_LENGTH, IMAGE_FORMATS, IMAGE_SIZES
+from .helperfuncs import get_static_path
+
+#Pillow is optional, without it no derivatives are made and the original images are served
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+"""
+Image derivatives of uploaded cereal pictures. After an upload, resized thumb and medium versions are generated in JPEG and WebP 
+by a pool of worker threads. Derivatives are stored in the derived folder of static and named after the content hash of the
+original, so every derivative url can be cached forever by the browser
+"""
+
+#Subfolder of static where derivatives are stored
+DERIVED_FOLDER = 'derived'
+#Filenames given by upload_file_func, the content hash and the extension
+HASHED_FILENAME = re.compile(r'^([0-9a-f]{%d})\.\w+$' % CONTENT_HASH_LENGTH)
+#Filenames of originals and derivatives, derivatives have the size name after the content hash
+HASHED_OR_DERIVED_FILENAME = re.compile(r'^[0-9a-f]{%d}(-\w+)?\.\w+$' % CONTENT_HASH_LENGTH)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def is_content_hashed(filename):
+    """
+    Checks if a filename is named after the hash of its content, these files never change
+    """
+    return HASHED_OR_DERIVED_FILENAME.match(os.path.basename(filename or '')) is not None
+
+def derivative_filename(filename,size,image_format):
+    """
+    Returns the filename relative to static of a derivative, None if the image isnt content hashed and has no derivatives
+    args:
+        filename: String of the original image filename
+        size: String of the size name, a key of IMAGE_SIZES
+        image_format: String of the format, a key of IMAGE_FORMATS
+    """
+    match = HASHED_FILENAME.match(filename or '')
+    if match is None:
+        return None
+    return '%s/%s-%s.%s' % (DERIVED_FOLDER, match.group(1), size, IMAGE_FORMATS[image_format])
+
+def get_image_filename(filename,size,image_format):
+    """
+    Returns the filename relative to static to serve for an image, the derivative if it has been generated and the original otherwise
+    args:
+        filename: String of the original image filename
+        size: String of the size name, a key of IMAGE_SIZES or 'original'
+        image_format: String of the format, a key of IMAGE_FORMATS
+    """
+    if size == 'original':
+        return filename
+    derivative = derivative_filename(filename,size,image_format)
+    if derivative is not None and os.path.exists(get_static_path(derivative)):
+        return derivative
+    return filename
+
+def image_url(filename,size,image_format,fallback=True):
+    """
+    Returns the url of an image, served with immutable caching when content hashed
+    args:
+        filename: String of the original image filename
+        size: String of the size name, a key of IMAGE_SIZES or 'original'
+        image_format: String of the format, a key of IMAGE_FORMATS
+        fallback: If the url of the original is returned when the derivative dosent exist, otherwise None is returned
+    """
+    served = get_image_filename(filename,size,image_format)
+    if not fallback and served == filename and size != 'original':
+        return None
+    return url_for('cereal.image', filename=served)
+
+def queue_image_derivatives(filename):
+    """
+    Queues the generation of every size and format of an uploaded image in the image worker pool, nothing is done without pillow
+    args:
+        filename: String of the content hashed filename in static
+    """
+    if Image is None or not is_content_hashed(filename):
+        return
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=current_app.config.get('IMAGE_WORKERS',2), thread_name_prefix='images')
+    #Paths are resolved here as the worker threads have no app context
+    path = get_static_path(filename)
+    targets = [(size,image_format,get_static_path(derivative_filename(filename,size,image_format)))
+               for size in IMAGE_SIZES for image_format in IMAGE_FORMATS]
+    logger = current_app.logger
+    _executor.submit(generate_derivatives, path, targets, logger)
+
+def generate_derivatives(path,targets,logger):
+    """
+    Generates the derivatives of an image, existing derivatives are skipped
+    args:
+        path: String of the path to the original image
+        targets: List of (size,image_format,path) tuples of the derivatives
+        logger: Logger for errors
+    """
+    try:
+        with Image.open(path) as original:
+            original = ImageOps.exif_transpose(original)
+            #JPEG has no alpha channel
+            original = original.convert('RGB')
+            for (size,image_format,target) in targets:
+                if os.path.exists(target):
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                image = original.copy()
+                image.thumbnail((IMAGE_SIZES[size],IMAGE_SIZES[size]))
+                #Written to a temporary file first so a half written derivative is never served
+                temp = target + '.tmp'
+                if image_format == 'jpeg':
+                    image.save(temp, 'JPEG', quality=85, optimize=True, progressive=True)
+                else:
+                    image.save(temp, 'WEBP', quality=80)
+                os.replace(temp, target)
+    except (OSError,ValueError):
+        logger.exception('Failed to generate derivatives of %s', path)
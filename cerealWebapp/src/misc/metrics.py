@@ -0,0 +1,196 @@
+from flask import Response, current_app, g, has_request_context, request
+import sqlalchemy
+import threading
+import time
+from ..constants import LATENCY_BUCKETS, RESPONSE_SIZE_BUCKETS
+from .histogram import Histogram
+from ..db.pool import get_pool_stats
+
+"""
+Request instrumentation exposed in the Prometheus text format on /metrics. Every request is counted per route, method and status
+with histograms of its latency, the time spent in database queries and the response size, and a gauge of the requests in flight.
+Routes are labeled by their url rule like /api/cereals/<int:id> so the amount of series stays small
+"""
+
+#Label of requests that did not match any route
+UNMATCHED_ROUTE = 'unmatched'
+
+class RequestMetrics():
+    """
+    Registry of the request metrics, series are created the first time a route, method and status is seen
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        #Keyed by (route,method,status)
+        self.requests = dict()
+        self.latency = dict()
+        self.response_size = dict()
+        #Keyed by (route,method)
+        self.db_time = dict()
+        self.in_flight = dict()
+
+    def histogram(self,series,key,buckets):
+        histogram = series.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = series.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def start(self,key):
+        with self.lock:
+            self.in_flight[key] = self.in_flight.get(key,0) + 1
+
+    def finish(self,key):
+        with self.lock:
+            self.in_flight[key] -= 1
+
+    def observe(self,route,method,status,latency,db_time,size):
+        """
+        Records a finished request
+        args:
+            route: String of the url rule of the request
+            method: String of the http method
+            status: Integer value of the response status code
+            latency: Seconds from the start of the request until the response was made
+            db_time: Seconds spent executing database queries
+            size: Integer value of the response body size in bytes, None for streamed responses where the size isnt known
+        """
+        key = (route,method,str(status))
+        with self.lock:
+            self.requests[key] = self.requests.get(key,0) + 1
+        self.histogram(self.latency,key,LATENCY_BUCKETS).observe(latency)
+        self.histogram(self.db_time,(route,method),LATENCY_BUCKETS).observe(db_time)
+        if size is not None:
+            self.histogram(self.response_size,key,RESPONSE_SIZE_BUCKETS).observe(size)
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text format
+        """
+        with self.lock:
+            requests = dict(self.requests)
+            in_flight = dict(self.in_flight)
+            latency = dict(self.latency)
+            db_time = dict(self.db_time)
+            response_size = dict(self.response_size)
+        lines = []
+        render_counter(lines, 'cereal_http_requests_total', 'Requests handled', ('route','method','status'), requests)
+        render_gauge(lines, 'cereal_http_requests_in_flight', 'Requests being handled', ('route','method'), in_flight)
+        render_histogram(lines, 'cereal_http_request_duration_seconds', 'Time until the response is made, streamed responses are timed until the stream starts',
+                         ('route','method','status'), latency)
+        render_histogram(lines, 'cereal_http_request_db_seconds', 'Time spent executing database queries per request', ('route','method'), db_time)
+        render_histogram(lines, 'cereal_http_response_size_bytes', 'Size of the response bodies, streamed responses are not included',
+                         ('route','method','status'), response_size)
+        return lines
+
+
+def escape_label(value):
+    return value.replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+def format_labels(names,values,extra=''):
+    labels = ','.join('%s="%s"' % (name,escape_label(value)) for (name,value) in zip(names,values))
+    if extra:
+        labels = labels + ',' + extra if labels else extra
+    return '{%s}' % labels if labels else ''
+
+def format_value(value):
+    return '%d' % value if isinstance(value,int) else repr(float(value))
+
+def render_counter(lines,name,help,label_names,series):
+    lines.append('# HELP %s %s' % (name,help))
+    lines.append('# TYPE %s counter' % name)
+    for (key,value) in sorted(series.items()):
+        lines.append('%s%s %s' % (name,format_labels(label_names,key),format_value(value)))
+
+def render_gauge(lines,name,help,label_names,series):
+    lines.append('# HELP %s %s' % (name,help))
+    lines.append('# TYPE %s gauge' % name)
+    for (key,value) in sorted(series.items()):
+        lines.append('%s%s %s' % (name,format_labels(label_names,key),format_value(value)))
+
+def render_histogram(lines,name,help,label_names,series):
+    lines.append('# HELP %s %s' % (name,help))
+    lines.append('# TYPE %s histogram' % name)
+    for (key,histogram) in sorted(series.items()):
+        snapshot = histogram.snapshot()
+        for (bound,count) in snapshot['buckets']:
+            lines.append('%s_bucket%s %d' % (name,format_labels(label_names,key,'le="%s"' % bound),count))
+        lines.append('%s_sum%s %s' % (name,format_labels(label_names,key),format_value(snapshot['sum'])))
+        lines.append('%s_count%s %d' % (name,format_labels(label_names,key),snapshot['count']))
+
+def render_pool_metrics(lines):
+    """
+    Adds the connection pool gauges and checkout wait histogram of the app to the metric lines
+    """
+    stats = get_pool_stats()
+    for (stat,help) in (('checked_out','Connections in use'), ('idle','Open connections waiting in the pool'), ('overflow','Connections open above the pool size')):
+        if stat in stats:
+            render_gauge(lines, 'cereal_db_pool_%s' % stat, help, (), {() : stats[stat]})
+    monitor = current_app.extensions.get('pool_monitor')
+    if monitor is not None:
+        render_counter(lines, 'cereal_db_pool_timeouts_total', 'Checkouts that timed out waiting for a connection', (), {() : stats['timeouts']})
+        render_histogram(lines, 'cereal_db_pool_checkout_seconds', 'Time spent getting a connection from the pool', (), {() : monitor.checkout_wait})
+
+
+def request_route():
+    if request.url_rule is None:
+        return UNMATCHED_ROUTE
+    return request.url_rule.rule
+
+def init_metrics(app,engine):
+    """
+    Registers the request hooks, the database query timing of the engine and the /metrics endpoint on the app
+    args:
+        app: The flask app
+        engine: SQLAlchemy engine of the app's database
+    returns:
+        RequestMetrics
+    """
+    metrics = RequestMetrics()
+    app.extensions['metrics'] = metrics
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_db_time = 0.0
+        g.metrics_key = (request_route(),request.method)
+        metrics.start(g.metrics_key)
+
+    @app.after_request
+    def observe_request_metrics(response):
+        if 'metrics_start' in g:
+            size = None if response.is_streamed else response.calculate_content_length()
+            metrics.observe(g.metrics_key[0], g.metrics_key[1], response.status_code, time.perf_counter() - g.metrics_start, g.metrics_db_time, size)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exception):
+        key = g.pop('metrics_key',None)
+        if key is not None:
+            metrics.finish(key)
+
+    #Database time is only added up for queries made while handling a request, not for background jobs
+    @sqlalchemy.event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(conn,cursor,statement,parameters,context,executemany):
+        conn.info.setdefault('metrics_query_start',[]).append(time.perf_counter())
+
+    @sqlalchemy.event.listens_for(engine, 'after_cursor_execute')
+    def stop_query_timer(conn,cursor,statement,parameters,context,executemany):
+        start = conn.info['metrics_query_start'].pop()
+        if has_request_context() and 'metrics_db_time' in g:
+            g.metrics_db_time += time.perf_counter() - start
+
+    @sqlalchemy.event.listens_for(engine, 'handle_error')
+    def drop_query_timer(context):
+        #after_cursor_execute is not called for a failed query
+        if context.connection is not None and context.connection.info.get('metrics_query_start'):
+            context.connection.info['metrics_query_start'].pop()
+
+    def get_metrics():
+        lines = metrics.render()
+        render_pool_metrics(lines)
+        return Response('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    app.add_url_rule('/metrics', 'metrics', get_metrics, methods=['GET'])
+    return metrics
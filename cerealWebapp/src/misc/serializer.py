@@ -0,0 +1,153 @@
+from json.encoder import encode_basestring_ascii
+from ..constants import CEREAL_HEADERS_WITH_ID
+from ..db.models import Cereal
+
+"""
+JSON serialization of cereal rows without building dictionaries or DataFrames. Rows are tuples ordered as CEREAL_HEADERS_WITH_ID
+and are written with a template that has the keys already in place, the output is the same as flask's jsonify of the cereal dictionaries
+"""
+
+#Separators of flask's jsonify and of json.dumps
+COMPACT_SEPARATORS = (',', ':')
+DEFAULT_SEPARATORS = (', ', ': ')
+
+def encode_int(value):
+    if value is None:
+        return 'null'
+    return int.__repr__(value)
+
+def encode_float(value):
+    if value is None:
+        return 'null'
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return 'Infinity'
+    if value == float('-inf'):
+        return '-Infinity'
+    return float.__repr__(value)
+
+def encode_nan_float(value):
+    """
+    Encodes a value of a numeric column the way pandas has it after loading, where a missing value is NaN
+    """
+    if value is None:
+        return 'NaN'
+    return encode_float(value)
+
+def encode_string(value):
+    if value is None:
+        return 'null'
+    return encode_basestring_ascii(value)
+
+def encode_nan_string(value):
+    """
+    Encodes a value of a text column the way pandas has it after loading, where a missing value is NaN
+    """
+    if value is None:
+        return 'NaN'
+    return encode_basestring_ascii(value)
+
+
+def nan_positions_of_counts(total,counts):
+    """
+    Returns the positions of the columns a DataFrame of a table has NaN in, the columns where some but not every value is missing.
+    A column where every value is missing is kept as None by pandas
+    args:
+        total: Integer value of the amount of rows in the table
+        counts: List of the amount of values that are not missing of each column, ordered as CEREAL_HEADERS_WITH_ID
+    returns:
+        Set of integer column positions
+    """
+    return {pos for (pos,count) in enumerate(counts) if 0 < count < total}
+
+def table_nan_positions(rows):
+    """
+    Returns the nan_positions of a whole table given as row tuples, see nan_positions_of_counts
+    """
+    counts = [sum(1 for row in rows if row[pos] is not None) for pos in range(len(CEREAL_HEADERS_WITH_ID))]
+    return nan_positions_of_counts(len(rows),counts)
+
+
+class CerealSerializer():
+    """
+    Template based serializer of cereal rows, the keys are written in sorted order like jsonify does
+    """
+
+    def __init__(self,separators=COMPACT_SEPARATORS):
+        (item_separator,key_separator) = separators
+        self.item_separator = item_separator
+        #Column positions in the row in the order the keys are written
+        self.order = sorted(range(len(CEREAL_HEADERS_WITH_ID)), key=lambda pos: CEREAL_HEADERS_WITH_ID[pos])
+        self.template = '{' + item_separator.join('"%s"%s%%s' % (CEREAL_HEADERS_WITH_ID[pos],key_separator) for pos in self.order) + '}'
+        self.key_separator = key_separator
+        self.encoders = dict()
+        for (pos,col) in enumerate(CEREAL_HEADERS_WITH_ID):
+            python_type = Cereal.__table__.c[col].type.python_type
+            if python_type is int:
+                self.encoders[pos] = encode_int
+            elif python_type is float:
+                self.encoders[pos] = encode_float
+            else:
+                self.encoders[pos] = encode_string
+
+    def row_encoders(self,nan_positions=()):
+        """
+        Returns the encoder of every column in key order, columns in nan_positions are encoded with NaN for missing values
+        and numeric columns in nan_positions are encoded as floats
+        """
+        encoders = []
+        for pos in self.order:
+            if pos in nan_positions:
+                encoders.append((pos,encode_nan_string if self.encoders[pos] is encode_string else encode_nan_float))
+            else:
+                encoders.append((pos,self.encoders[pos]))
+        return encoders
+
+    def encode_row(self,row,encoders=None):
+        """
+        Returns the json object of a single row
+        """
+        if encoders is None:
+            encoders = self.row_encoders()
+        return self.template % tuple([encode(row[pos]) for (pos,encode) in encoders])
+
+    def encode_rows(self,rows):
+        """
+        Returns the json objects of a list of rows, each as a string
+        """
+        encoders = self.row_encoders()
+        template = self.template
+        return [template % tuple([encode(row[pos]) for (pos,encode) in encoders]) for row in rows]
+
+    def encode_list(self,rows):
+        """
+        Returns a json array of rows
+        """
+        return '[' + self.item_separator.join(self.encode_rows(rows)) + ']'
+
+    def encode_table(self,rows,keys=None,nan_positions=None):
+        """
+        Returns a json object of rows keyed by their index, the same as jsonify of a DataFrame's to_dict('index').
+        Like the DataFrame of the whole table, missing values are written as NaN and numeric columns with a missing value are written as floats
+        args:
+            rows: List of row tuples
+            keys: List of integer keys of the rows, None for 0 to len(rows)-1
+            nan_positions: Set of column positions written like a column with missing values, see nan_positions_of_counts.
+                           Must be counted on the whole table when rows are only part of it, None when rows are the whole table
+        """
+        if keys is None:
+            keys = range(len(rows))
+        if nan_positions is None:
+            nan_positions = table_nan_positions(rows)
+        encoders = self.row_encoders(nan_positions)
+        template = self.template
+        key_format = '"%d"' + self.key_separator
+        #json sorts the integer keys numerically
+        pairs = sorted(zip(keys,rows), key=lambda pair: pair[0])
+        return '{' + self.item_separator.join([key_format % key + template % tuple([encode(row[pos]) for (pos,encode) in encoders])
+                                               for (key,row) in pairs]) + '}'
+
+compact_serializer = CerealSerializer(COMPACT_SEPARATORS)
+default_serializer = CerealSerializer(DEFAULT_SEPARATORS)
@@ -0,0 +1,107 @@
+import heapq
+import sqlalchemy
+from ..constants import CEREAL_HEADERS_WITH_ID
+from ..db.models import Cereal
+
+"""
+Functions for sorting cereals, a sort is a list of (column,descending) keys. Missing values are sorted last in both directions and the id is
+always the last key, so the database and the in memory sorting give the same order for numeric columns. Strings are compared case sensitively
+in memory, which matches SQLite but not a database with a case insensitive collation like the default of the MSSQL database in Docker,
+there the order of string columns depends on whether the table snapshot is cached
+"""
+
+#Position of each column in the row tuples
+COLUMN_POSITIONS = {col : pos for (pos,col) in enumerate(CEREAL_HEADERS_WITH_ID)}
+
+
+class Descending():
+    """
+    Wraps a value so it sorts in the opposite order, used for descending keys of values that cant be negated like strings
+    """
+    __slots__ = ('value',)
+
+    def __init__(self,value):
+        self.value = value
+
+    def __lt__(self,other):
+        return other.value < self.value
+
+    def __eq__(self,other):
+        return self.value == other.value
+
+
+def parse_sort(value):
+    """
+    Parses the sort argument of a request, a comma separated list of columns where a column starting with - is sorted descending
+    args:
+        value: String like "-rating,name"
+    returns:
+        List of tuples (column,descending)
+    throws:
+        KeyError: If a column does not exist
+        ValueError: If the sort is empty or has the same column twice
+    """
+    sort = []
+    for key in value.split(','):
+        key = key.strip()
+        descending = key.startswith('-')
+        column = key[1:] if descending else key
+        if column not in COLUMN_POSITIONS:
+            raise KeyError(column)
+        sort.append((column,descending))
+    if len(set(column for (column,_) in sort)) != len(sort):
+        raise ValueError('Column sorted twice')
+    return sort
+
+def sort_to_sql(sort):
+    """
+    Returns the ORDER BY clauses of a sort. Missing values are ordered last with a CASE since not every database supports NULLS LAST
+    """
+    clauses = []
+    for (column,descending) in sort:
+        col = getattr(Cereal,column)
+        clauses.append(sqlalchemy.case((col.is_(None),1), else_=0))
+        clauses.append(col.desc() if descending else col.asc())
+    if 'id' not in [column for (column,_) in sort]:
+        clauses.append(Cereal.id.asc())
+    return clauses
+
+def sort_key(sort):
+    """
+    Returns a function that gives the sort key of a row tuple ordered as CEREAL_HEADERS_WITH_ID
+    """
+    keys = [(COLUMN_POSITIONS[column],descending) for (column,descending) in sort]
+    if 'id' not in [column for (column,_) in sort]:
+        keys.append((COLUMN_POSITIONS['id'],False))
+
+    def key(row):
+        result = []
+        for (pos,descending) in keys:
+            value = row[pos]
+            #Missing values are NaN in DataFrames and None in rows, both sort last
+            missing = value is None or value != value
+            result.append(missing)
+            if missing:
+                result.append(0)
+            elif descending:
+                result.append(-value if isinstance(value,(int,float)) else Descending(value))
+            else:
+                result.append(value)
+        return tuple(result)
+    return key
+
+def top_rows(rows,sort,limit=None):
+    """
+    Returns the first limit rows in sort order. With a limit only the best limit rows are kept in a heap while going through the rows,
+    so it takes O(n log limit) instead of sorting every row
+    args:
+        rows: Iterable of row tuples ordered as CEREAL_HEADERS_WITH_ID
+        sort: List of tuples (column,descending)
+        limit: Integer value of the max amount of rows, None sorts every row
+    returns:
+        List of row tuples
+    """
+    key = sort_key(sort)
+    if limit is None:
+        return sorted(rows,key=key)
+    return heapq.nsmallest(limit,rows,key=key)
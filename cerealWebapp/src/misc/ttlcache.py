@@ -0,0 +1,84 @@
+from collections import OrderedDict
+import threading
+import time
+
+"""
+Small thread safe cache with a max size and a time to live for each entry, the least recently used entry is evicted when it is full
+"""
+
+class TTLCache():
+    """
+    Bounded least recently used cache where entries expire after ttl seconds
+    """
+
+    def __init__(self,max_size,ttl):
+        """
+        args:
+            max_size: Integer value of the max amount of entries
+            ttl: Number of seconds an entry is valid after it is set
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self,key):
+        """
+        Returns the value of a key, None if the key isnt cached or has expired
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            (value,expires) = entry
+            if expires <= now:
+                del self.entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self,key,value):
+        """
+        Caches a value, evicts the least recently used entry if the cache is full
+        """
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value,time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def evict(self,matches):
+        """
+        Evicts every entry where matches(key,value) is true
+        returns:
+            Integer value of how many entries were evicted
+        """
+        with self.lock:
+            keys = [key for (key,(value,_)) in self.entries.items() if matches(key,value)]
+            for key in keys:
+                del self.entries[key]
+            self.evictions += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.evictions += len(self.entries)
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns a dictionary with the hit, miss and eviction counters and the amount of cached entries
+        """
+        with self.lock:
+            return {'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions, 'size' : len(self.entries)}
@@ -1,52 +1,133 @@
-from flask import Blueprint, render_template, request,flash,current_app
-from flask.helpers import url_for
+from flask import Blueprint, render_template, request,flash,current_app,get_flashed_messages,Response,stream_with_context
+from flask.helpers import url_for, send_from_directory
 from flask_login import login_required
 from werkzeug.utils import redirect
-from ..misc.filterfunctions import check_valid_filters, filter_cereals
+from ..misc.filterfunctions import check_valid_filters
 from .. import db
 from ..db.models import Cereal,CerealPicture
-import pandas as pd
-from ..misc.helperfuncs import change_to_column_type, get_static_path, upload_file_func
-from ..constants import ALLOWED_DATA_EXTENSIONS, ALLOWED_IMAGE_EXTENSIONS, ALLOWED_MFR, ALLOWED_TYPES, CEREAL_HEADERS_WITH_ID, CEREAL_HEADERS_WITHOUT_ID, FILTER_OPERATORS
-from ..db.dbfunctions import db_add_cereal, db_add_cereal_imagepath, db_bulk_add_cereal, db_delete_cereal, db_get_all_cereals_as_df,  db_get_cereal_imagepath, db_get_id_cereal_as_df, db_update_cereal, db_update_cereal_imagepath
+from ..misc.helperfuncs import allowed_file, change_to_column_type, upload_file_func
+from ..misc.images import image_url, is_content_hashed, queue_image_derivatives
+from ..errors import ImportQueueFullError
+from ..imports.jobs import start_import_job
+from ..constants import IMMUTABLE_CACHE_CONTROL, ALLOWED_DATA_EXTENSIONS, ALLOWED_IMAGE_EXTENSIONS, ALLOWED_MFR, ALLOWED_TYPES, CEREAL_HEADERS_WITH_ID, CEREAL_HEADERS_WITHOUT_ID, DEFAULT_LIST_PAGE_SIZE, FILTER_OPERATORS, LIST_PAGE_SIZES, MAX_PAGE_SIZE, TEMPLATE_STREAM_BUFFER
+from ..db.dbfunctions import begin_cereal_write, db_add_cereal, db_add_cereal_imagepath, db_bulk_add_cereal, db_delete_cereal, db_get_cereal_imagepath, db_get_cereal_detail, db_get_filtered_cereals_page, db_get_id_cereal_as_df, db_reset_cereal_structures, db_update_cereal, db_update_cereal_imagepath
 """
 Cereal blueprint functions are placed here
 """
 
 cereal = Blueprint('cereal', __name__)
 
+def parse_list_filters(columns,ops,values):
+    """
+    Packages the filter fields of the list page into filters
+    args:
+        columns: List of strings of the filtered columns
+        ops: List of strings of the operator names, keys of FILTER_OPERATORS
+        values: List of strings of the filter values
+    returns:
+        Tuple of (list of (column,operator,value) filters, list of (column,operator name,value) for filling the filter form again)
+    throws:
+        KeyError, ValueError, IndexError: If a filter is invalid
+    """
+    filter_args = []
+    prev_filters = []
+    for i in range(len(columns)):
+        cur_column = columns[i]
+        cur_value = change_to_column_type(cur_column,values[i])
+        cur_op = ops[i]
+        prev_filters.append((cur_column,cur_op,cur_value))
+
+        #Gotta package the filter operator from a string name to the operand like =
+        cur_op = FILTER_OPERATORS[cur_op]
+        filter_args.append((cur_column,cur_op,cur_value))
+    return filter_args, prev_filters
+
+def stream_page(template_name,**context):
+    """
+    Renders a template as a streamed response, the browser gets the page a part at a time while the rest is rendered
+    """
+    #Flashed messages are removed from the session when read, they have to be read before the response starts or the session is not saved
+    get_flashed_messages()
+    current_app.update_template_context(context)
+    stream = current_app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(TEMPLATE_STREAM_BUFFER)
+    return Response(stream_with_context(stream), mimetype='text/html')
+
 @cereal.route('/list')
 def list():
-    #Get all cereals in database
-    df = db_get_all_cereals_as_df()
+    """
+    Get request for the list of cereals a page at a time ordered by id. The filters of the filter form are query arguments,
+    so they are kept when going to another page
+    Optional query arguments:
+        field, op, value: The column, operator name and value of each filter
+        page: Number of the page starting at 1
+        page_size: Amount of cereals per page, default DEFAULT_LIST_PAGE_SIZE
+    """
+    columns = request.args.getlist('field')
+    ops = request.args.getlist('op')
+    values = request.args.getlist('value')
+    try:
+        page = max(int(request.args.get('page',1)),1)
+        page_size = min(max(int(request.args.get('page_size',DEFAULT_LIST_PAGE_SIZE)),1),MAX_PAGE_SIZE)
+        (filter_args,prev_filters) = parse_list_filters(columns,ops,values)
+    except (KeyError,ValueError,IndexError):
+        flash('invalid filter input given')
+        return redirect(url_for('cereal.list'))
+    if not check_valid_filters(filter_args):
+        flash('Filters would never give a result')
+        return redirect(url_for('cereal.list'))
 
-    #Get headers and data from the dataframe and display on webpage
-    cerealdata =df.to_dict('index')
-    return render_template('cereals.html', cereals = cerealdata, headers = CEREAL_HEADERS_WITH_ID, operators = FILTER_OPERATORS )
+    #Get the page of cereals in database matching the filters
+    (rows,total) = db_get_filtered_cereals_page(filter_args,(page - 1) * page_size,page_size)
+    pages = max((total + page_size - 1) // page_size,1)
+
+    def page_url(page,page_size):
+        return url_for('cereal.list', field=columns, op=ops, value=values, page=page, page_size=page_size)
+
+    pagination = {'page' : page, 'pages' : pages, 'total' : total, 'page_size' : page_size,
+                  'prev_url' : page_url(page - 1,page_size) if page > 1 else None,
+                  'next_url' : page_url(page + 1,page_size) if page < pages else None,
+                  'size_urls' : [(size,page_url(1,size)) for size in LIST_PAGE_SIZES]}
+    return stream_page('cereals.html', cereals = rows, headers = CEREAL_HEADERS_WITH_ID, operators = FILTER_OPERATORS,
+                       prevFilters = prev_filters, pagination = pagination)
 
 @cereal.route('/list/<int:id>')
 def list_with_id(id):
     """
     Get request function for listing specific cereals
     """
-    #Get specific ID Cereal 
+    #Get specific ID Cereal and its picture in one query
     try:
-        df = db_get_id_cereal_as_df(id)
+        detail = db_get_cereal_detail(id)
     except LookupError:
         #If ID dosent exist
         flash('Requested cereal ID dosent exists')
         return redirect(url_for('cereal.list'))
-    
-    #Get image, if no imagepath is set we set to default image
-    try:
-        imagepath = db_get_cereal_imagepath(id)
-        image = url_for('static', filename = imagepath)
-    except LookupError:
-        #If imagepath dosent exist
+    if detail is None:
+        flash('Error getting cereal')
+        return redirect(url_for('cereal.list'))
+
+    #Get image, if no imagepath is set we set to default image. The medium derivative is shown if it has been generated
+    imagepath = detail['picturepath']
+    if imagepath:
+        image = image_url(imagepath, 'medium', 'jpeg')
+        image_webp = image_url(imagepath, 'medium', 'webp', fallback=False)
+    else:
         image = url_for('static', filename = 'default.png')
+        image_webp = None
 
     #Pass data along to template
-    return render_template('cereal.html', cereals = df.to_dict(), headers = CEREAL_HEADERS_WITH_ID, id = id, image = image)
+    return render_template('cereal.html', cereal = detail, headers = CEREAL_HEADERS_WITH_ID, id = id, image = image, image_webp = image_webp)
+
+@cereal.route('/images/<path:filename>')
+def image(filename):
+    """
+    Get request for images in the static folder, content hashed images and their derivatives are cached forever by the browser
+    """
+    response = send_from_directory(current_app.static_folder, filename)
+    if is_content_hashed(filename):
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
 
 @cereal.route('/list/delete',methods = ["POST"])
 @login_required
@@ -69,41 +150,13 @@ def delete_with_id():
 @cereal.route('/list',methods=['POST'])
 def filter():
     """
-    Post function for when the user presses the filter button on the webpage, 
-    displays the list of cereal based on the given filter
+    Post function for when a filter form is posted, redirects to the first page of the list with the filters as query arguments
     """
     #Get user input
     column = request.form.getlist('field')
     op = request.form.getlist('op')
     value = request.form.getlist('value')
-    #Get entire cereals
-
-    #TODO: Fix html filter stuff
-    filter_args = []
-    prev_filters = []
-    try:
-        #Package arguments for filter function
-        for i in range(len(column)):
-            cur_column = column[i]
-            cur_value = change_to_column_type(cur_column,value[i])
-            cur_op = op[i]
-            prev_filters.append((cur_column,cur_op,cur_value))
-            
-            #Gotta package the filter operator from a string name to the operand like =
-            cur_op = FILTER_OPERATORS[cur_op]
-            filter_args.append((cur_column,cur_op,cur_value))
-        if check_valid_filters(filter_args):
-            df = db_get_all_cereals_as_df()
-            df = filter_cereals(df,filter_args)
-            cerealdata =df.to_dict('index')
-            return render_template('cereals.html', cereals = cerealdata, headers = CEREAL_HEADERS_WITH_ID,  operators = FILTER_OPERATORS, prevFilters = prev_filters)
-        else:
-            flash('Filters would never give a result')
-            return redirect(url_for('cereal.list'))
-    except Exception as e:
-        flash('invalid filter input given')
-        print(e)
-        return redirect(url_for('cereal.list'))
+    return redirect(url_for('cereal.list', field=column, op=op, value=value, page_size=request.form.get('page_size',DEFAULT_LIST_PAGE_SIZE)))
 
 
 @cereal.route('/list/add')
@@ -199,7 +252,8 @@ def upload_file():
     #Upload file
     try:
         filename = upload_file_func(file,ALLOWED_IMAGE_EXTENSIONS)
-        current_app.logger.info('Picture %s uploaded' %filename)
+        queue_image_derivatives(filename)
+        current_app.logger.info('Picture %s uploaded', filename)
     except TypeError:
         flash('File not allowed format')
         return redirect(url_for('cereal.list_with_id', id=int(id)))
@@ -244,27 +298,24 @@ def import_csv_post():
     if file.filename == '':
         flash('No selected file')
         return redirect(url_for('cereal.import_csv'))
-    #Upload file
-    try:
-        filename = upload_file_func(file,ALLOWED_DATA_EXTENSIONS)
-        current_app.logger.info('Uploaded %s for data import' %filename)
-    except TypeError:
+    if not allowed_file(file.filename,ALLOWED_DATA_EXTENSIONS):
         flash('File not allowed format')
         return redirect(url_for('cereal.import_csv'))
+
+    #The upload is imported by a background job, the file is saved to the import spool folder and never to the static folder
     try:
-        filename = get_static_path(filename)
-        df = pd.read_csv(filename,usecols=CEREAL_HEADERS_WITHOUT_ID).to_dict('records')
-    except FileNotFoundError:
-        flash('error reading file')
+        job = start_import_job(file)
+    except ImportQueueFullError:
+        flash('Too many imports are running, try again later')
         return redirect(url_for('cereal.import_csv'))
-    amount_uploaded = db_bulk_add_cereal(df)
-    flash('Uploaded csv to DB, added %d cereals' %amount_uploaded)
-    return redirect(url_for('cereal.list'))
+    flash('Import started, follow the progress at %s' % url_for('api.api_get_import_job', job_id=job.id))
+    return redirect(url_for('cereal.import_csv'))
 
 @cereal.route('/import')
 def import_data():
     #Function exist purely for importing data into database, TODO: Fix the docker import script to properly import when creating DB first time
     with open('cereals.csv') as f:
+        begin_cereal_write()
         for line in f.readlines()[1:]:
             args = line.split(',')
             newCereal = Cereal(name=args[0],mfr=args[1],type=args[2],calories=args[3],protein=args[4],fat=args[5],sodium=args[6],fiber=args[7],carbo=args[8],sugars=args[9],potass=args[10],vitamins=args[11],shelf=args[12],weight=args[13],cups=args[14],rating=args[15])
@@ -275,4 +326,5 @@ def import_data():
             db.session.flush()
 
         db.session.commit()
+        db_reset_cereal_structures()
     return "correct"
\ No newline at end of file
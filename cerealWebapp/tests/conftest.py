@@ -0,0 +1,31 @@
+import os
+import pytest
+from flask import Flask
+from .. import db
+from ..src.db.dbfunctions import db_import_cereal_csv, db_reset_cereal_structures
+
+"""
+Fixtures of the tests, the tests run on a SQLite database made from cereals.csv and dont need the config module of the webapp
+"""
+
+CEREALS_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cereals.csv')
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    Flask app with the tables created in a new SQLite database and the cereals of cereals.csv imported, the app context is pushed
+    """
+    app = Flask('tests')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///%s' % (tmp_path / 'cereals.db')
+    app.config['SECRET_KEY'] = 'tests'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        #The in memory structures live in the module, drop the ones of the previous test
+        db_reset_cereal_structures()
+        with open(CEREALS_CSV,'rb') as f:
+            report = db_import_cereal_csv(f)
+        assert report['error'] is None and report['inserted'] == 77
+        yield app
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,103 @@
+import math
+import sqlalchemy
+from .. import db
+from ..src.db.aggregates import STATS_COLUMNS, STATS_GROUP_COLUMNS, sorted_groups
+from ..src.db.dbfunctions import db_add_cereal, db_batch_delete_cereals, db_batch_update_cereals, db_delete_cereal, db_get_cereal_aggregates, \
+    db_get_cereal_stats, db_get_cereal_table_version, db_query_cereal_group_stats, db_update_cereal
+from ..src.db.models import Cereal
+
+"""
+Tests of the running aggregates, after every kind of write the stats read from the aggregates must be the stats of a fresh GROUP BY in the database
+"""
+
+def group_by_stats(group_by):
+    """
+    Returns the stats of every group of group_by computed by the database
+    """
+    return [(key,group.to_dict()) for (key,group) in sorted_groups(db_query_cereal_group_stats(group_by,[]))]
+
+def assert_same_stats(actual,expected):
+    assert [key for (key,_) in actual] == [key for (key,_) in expected]
+    for ((key,stats),(_,fresh)) in zip(actual,expected):
+        assert stats['count'] == fresh['count'], key
+        for col in STATS_COLUMNS:
+            for name in ('count','min','max'):
+                assert stats[col][name] == fresh[col][name], (key,col,name)
+            for name in ('mean','std'):
+                if fresh[col][name] is None:
+                    assert stats[col][name] is None, (key,col,name)
+                else:
+                    assert math.isclose(stats[col][name],fresh[col][name],rel_tol=1e-9,abs_tol=1e-6), (key,col,name)
+
+def assert_matches_database():
+    for group_by in STATS_GROUP_COLUMNS:
+        assert_same_stats(db_get_cereal_stats(group_by,[]),group_by_stats(group_by))
+
+def extreme_cereal(mfr,column,highest):
+    """
+    Returns the id of the cereal of a manufacturer with the lowest or highest value of a column
+    """
+    order = Cereal.__table__.c[column].desc() if highest else Cereal.__table__.c[column]
+    return db.session.execute(sqlalchemy.select(Cereal.id).where(Cereal.mfr == mfr).order_by(order,Cereal.id).limit(1)).scalar()
+
+
+def test_stats_after_inserts(app):
+    aggregates = db_get_cereal_aggregates()
+    groups = aggregates.groups
+    assert db_add_cereal({'name' : 'Lowest', 'mfr' : 'K', 'type' : 'C', 'calories' : '5', 'sugars' : '0', 'rating' : '1', 'shelf' : '2'})
+    assert db_add_cereal({'name' : 'Highest', 'mfr' : 'G', 'type' : 'H', 'calories' : '900', 'sugars' : '40', 'rating' : '99999999', 'shelf' : '4'})
+    assert db_add_cereal({'name' : 'Missing values', 'mfr' : 'Q', 'type' : 'C'})
+    #The inserts were applied to the aggregates, they were not built again
+    assert aggregates.groups is groups
+    assert aggregates.version == db_get_cereal_table_version()
+    assert_matches_database()
+
+def test_stats_after_deleting_min_and_max(app):
+    aggregates = db_get_cereal_aggregates()
+    groups = aggregates.groups
+    assert db_delete_cereal(extreme_cereal('K','calories',False))
+    assert db_delete_cereal(extreme_cereal('K','calories',True))
+    results = db_batch_delete_cereals([extreme_cereal('G','sugars',True),extreme_cereal('G','rating',False)])
+    assert [result['status'] for result in results] == ['deleted','deleted']
+    assert aggregates.groups is groups
+    assert aggregates.stale_groups('mfr')
+    assert_matches_database()
+    #The recomputed groups are no longer stale
+    assert not aggregates.stale_groups('mfr')
+
+def test_stats_after_deleting_last_cereal_of_group(app):
+    ids = db.session.execute(sqlalchemy.select(Cereal.id).where(Cereal.mfr == 'A')).scalars().all()
+    assert ids
+    db_get_cereal_aggregates()
+    db_batch_delete_cereals(ids)
+    assert 'A' not in [key for (key,_) in db_get_cereal_stats('mfr',[])]
+    assert_matches_database()
+
+def test_stats_after_updates(app):
+    aggregates = db_get_cereal_aggregates()
+    groups = aggregates.groups
+    #Moves the cereal with the most calories of K to another manufacturer, shelf and type
+    assert db_update_cereal(extreme_cereal('K','calories',True),{'mfr' : 'R', 'shelf' : '1', 'type' : 'H'})
+    #Lowers the max and raises the min of a column without moving the cereals
+    db_batch_update_cereals([{'id' : extreme_cereal('N','rating',True), 'rating' : 5},
+                             {'id' : extreme_cereal('P','sugars',False), 'sugars' : 50}])
+    assert aggregates.groups is groups
+    assert_matches_database()
+
+def test_stats_after_write_outside_webapp(app):
+    aggregates = db_get_cereal_aggregates()
+    version = aggregates.version
+    #Written with a connection of its own like another process would, only the triggers see the writes
+    with db.engine.begin() as conn:
+        conn.execute(Cereal.__table__.insert().values(name='External', mfr='K', type='C', calories=1000, sugars=0, rating=1, shelf=1))
+        conn.execute(Cereal.__table__.delete().where(Cereal.__table__.c.id == extreme_cereal('G','calories',False)))
+    assert db_get_cereal_table_version() > version
+    assert_matches_database()
+    assert aggregates.version == db_get_cereal_table_version()
+
+def test_filtered_stats_match_database(app):
+    db_add_cereal({'name' : 'Filtered', 'mfr' : 'K', 'type' : 'C', 'calories' : '300', 'sugars' : '3', 'rating' : '3', 'shelf' : '3'})
+    for group_by in STATS_GROUP_COLUMNS:
+        args = [('calories','>',100)]
+        expected = [(key,group.to_dict()) for (key,group) in sorted_groups(db_query_cereal_group_stats(group_by,args))]
+        assert_same_stats(db_get_cereal_stats(group_by,args),expected)
@@ -0,0 +1,66 @@
+import sqlalchemy
+from .. import db
+from ..src.db.dbfunctions import db_add_cereal, db_batch_delete_cereals, db_get_all_cereal_rows, db_get_cached_cereal_store, \
+    db_get_filtered_cereal_rows, db_get_sorted_cereal_rows, db_invalidate_cereal_cache, db_reset_cereal_structures
+from ..src.db.models import Cereal
+from ..src.misc.filterfunctions import filter_to_sql
+
+"""
+Tests of the keys of filtered cereals, a cereal is keyed by its position in the whole table ordered by id whichever way the filters are evaluated
+"""
+
+FILTERS = [[('calories','>',140)],
+           [('calories','<=',100),('mfr','=','K')],
+           [('name','!=','Trix')],
+           [('rating','>',50000000)],
+           [('shelf','=',2),('fat','>',1)],
+           [('mfr','=','G')],
+           [('calories','>',1000)]]
+
+def expected_keys(args):
+    """
+    Returns the positions of the matching cereals in the table ordered by id, found with filter_to_sql on the whole table
+    """
+    ids = db.session.execute(sqlalchemy.select(Cereal.id).order_by(Cereal.id)).scalars().all()
+    matching = set(db.session.execute(sqlalchemy.select(Cereal.id).where(filter_to_sql(args))).scalars().all())
+    return [pos for (pos,id) in enumerate(ids) if id in matching]
+
+def filtered_keys():
+    return [db_get_filtered_cereal_rows(args)[0] for args in FILTERS]
+
+
+def test_keys_are_table_positions_on_every_path(app):
+    #Deleted cereals make the positions differ from the ids
+    db_batch_delete_cereals([2,10,30])
+    expected = [expected_keys(args) for args in FILTERS]
+
+    #Filtered by the database, range filters get the ids from the sorted indexes and the keys from the id index,
+    #the other filters are evaluated on the numbered table
+    db_reset_cereal_structures()
+    assert filtered_keys() == expected
+
+    #Filtered in memory on the snapshot
+    db_get_all_cereal_rows()
+    assert db_get_cached_cereal_store()[1] is not None
+    assert filtered_keys() == expected
+
+def test_keys_match_rows(app):
+    db_invalidate_cereal_cache()
+    ids = db.session.execute(sqlalchemy.select(Cereal.id).order_by(Cereal.id)).scalars().all()
+    for args in FILTERS:
+        (keys,rows) = db_get_filtered_cereal_rows(args)
+        assert [ids[key] for key in keys] == [row[0] for row in rows]
+
+def test_missing_names_filter_the_same_cold_and_warm(app):
+    #Missing values only fulfill != like NULL in SQL, comparing them in memory must not fail
+    assert db_add_cereal({'mfr' : 'K', 'type' : 'C', 'calories' : '100'})
+    name_filters = [[('name','<','B')],[('name','>=','B')],[('name','=','Trix')],[('name','!=','Trix')],[('name','<','B'),('calories','<=',100)]]
+    db_invalidate_cereal_cache()
+    cold = [db_get_filtered_cereal_rows(args) for args in name_filters]
+    cold_sorted = [db_get_sorted_cereal_rows(args,[('name',False)]) for args in name_filters]
+    db_get_all_cereal_rows()
+    assert db_get_cached_cereal_store()[1] is not None
+    assert [db_get_filtered_cereal_rows(args) for args in name_filters] == cold
+    assert [db_get_sorted_cereal_rows(args,[('name',False)]) for args in name_filters] == cold_sorted
+    #The cereal without a name is only matched by !=
+    assert [any(row[1] is None for row in rows) for (_,rows) in cold] == [False,False,False,True,False]
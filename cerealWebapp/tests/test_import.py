@@ -0,0 +1,49 @@
+import io
+import pytest
+import sqlalchemy
+from .. import db
+from ..src.db.dbfunctions import db_get_import_progress, db_import_cereal_csv
+from ..src.db.models import Cereal
+from .conftest import CEREALS_CSV
+
+"""
+Tests of the csv import, the values are read as strings and validated the same way as form input
+"""
+
+HEADER = b'name,mfr,type,calories,protein,fat,sodium,fiber,carbo,sugars,potass,vitamins,shelf,weight,cups,rating\n'
+
+
+def test_integer_columns_written_as_floats(app):
+    data = HEADER + b'Float ints,K,C,110.0,2.0,1,180.00,1.5,10.5,3.0,60.0,25.0,1.0,1.0,0.75,50000000.0\n' \
+                  + b'Fractional int,K,C,110.5,2,1,180,1.5,10.5,3,60,25,1,1,0.75,1\n' \
+                  + b'Not a number,K,C,nan,2,1,180,1.5,10.5,3,60,25,1,1,0.75,1\n'
+    report = db_import_cereal_csv(io.BytesIO(data))
+    assert report['inserted'] == 1
+    assert [rejected['row'] for rejected in report['rejected']] == [2,3]
+    row = db.session.execute(sqlalchemy.select(Cereal.calories,Cereal.sodium,Cereal.shelf,Cereal.rating)
+                             .where(Cereal.name == 'Float ints')).one()
+    assert tuple(row) == (110,180,1,50000000)
+
+def test_resume_after_crash_skips_committed_chunks(app):
+    with open(CEREALS_CSV,'rb') as f:
+        data = f.read()
+    job_id = 'a' * 32
+    assert db_get_import_progress(job_id) == {'committed_rows' : 0, 'rows_inserted' : 0, 'rows_rejected' : 0}
+
+    #The process stops after the third chunk is committed, before the job state is saved
+    def crash(chunk_report,rows_in_chunk):
+        if crash.chunks == 2:
+            raise RuntimeError('Crash')
+        crash.chunks += 1
+    crash.chunks = 0
+    with pytest.raises(RuntimeError):
+        db_import_cereal_csv(io.BytesIO(data), chunk_size=10, progress=crash, job_id=job_id)
+    saved = db_get_import_progress(job_id)
+    assert saved == {'committed_rows' : 30, 'rows_inserted' : 30, 'rows_rejected' : 0}
+
+    report = db_import_cereal_csv(io.BytesIO(data), chunk_size=10, skip_rows=saved['committed_rows'], job_id=job_id)
+    assert report['inserted'] == 47
+    assert db_get_import_progress(job_id) == {'committed_rows' : 77, 'rows_inserted' : 77, 'rows_rejected' : 0}
+    #Every cereal of the file is in the table twice, once from the fixture and once from the import
+    counts = db.session.execute(sqlalchemy.select(Cereal.name,sqlalchemy.func.count()).group_by(Cereal.name)).all()
+    assert len(counts) == 77 and all(count == 2 for (_,count) in counts)
@@ -0,0 +1,49 @@
+import json
+import pandas as pd
+from .. import db
+from ..src.db.dbfunctions import db_get_all_cereal_rows, db_get_cached_cereal_store, db_get_cereal_nan_positions, db_get_filtered_cereal_rows, \
+    db_invalidate_cereal_cache
+from ..src.db.models import Cereal
+from ..src.misc.serializer import compact_serializer
+
+"""
+Tests of the json written by the serializer, it must be the same as jsonify of the DataFrame the api built before from the whole table
+"""
+
+FILTERS = [([('calories','<=',100)], lambda df: df['calories'] <= 100),
+           ([('mfr','=','K')], lambda df: df['mfr'] == 'K'),
+           ([('calories','<=',100),('mfr','=','K')], lambda df: (df['calories'] <= 100) & (df['mfr'] == 'K')),
+           ([('fiber','>',1)], lambda df: df['fiber'] > 1),
+           ([('protein','>',3)], lambda df: df['protein'] > 3)]
+
+def add_cereals_with_missing_values():
+    #No name, calories or fiber, and no type or calories. Every cereal is missing the vitamins
+    db.session.add(Cereal(mfr='K', type='C', protein=1, fat=1, sodium=1, carbo=1, sugars=1, potass=1, shelf=1, weight=1, cups=1, rating=1))
+    db.session.add(Cereal(name='Zed', mfr='G', protein=2, fat=2, sodium=2, fiber=2, carbo=2, sugars=2, potass=2, shelf=2, weight=2, cups=2, rating=2))
+    db.session.commit()
+    db.session.execute(Cereal.__table__.update().values(vitamins=None))
+    db.session.commit()
+
+def baseline_json(df):
+    """
+    Returns the json the api wrote with jsonify(df.to_dict('index'))
+    """
+    return json.dumps(df.to_dict('index'), sort_keys=True, separators=(',',':'))
+
+
+def test_filtered_cereals_are_written_like_the_whole_table(app):
+    add_cereals_with_missing_values()
+    table = pd.read_sql('SELECT * FROM cereal', db.engine)
+    db_invalidate_cereal_cache()
+    for warm in (False,True):
+        if warm:
+            db_get_all_cereal_rows()
+            assert db_get_cached_cereal_store()[1] is not None
+        for (args,mask) in FILTERS:
+            (keys,rows) = db_get_filtered_cereal_rows(args)
+            assert compact_serializer.encode_table(rows,keys,db_get_cereal_nan_positions()) == baseline_json(table[mask(table)]), (args,warm)
+
+def test_whole_table_is_written_like_the_dataframe(app):
+    add_cereals_with_missing_values()
+    table = pd.read_sql('SELECT * FROM cereal', db.engine)
+    assert compact_serializer.encode_table(db_get_all_cereal_rows()) == baseline_json(table)
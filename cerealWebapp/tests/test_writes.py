@@ -0,0 +1,28 @@
+import pytest
+from .. import db
+from ..src.db.dbfunctions import db_add_cereal, db_get_cereal_table_version, db_update_cereal
+from ..src.db.models import Cereal
+
+"""
+Tests of the single cereal writes, a failed write must end its transaction so the version row it locked is released
+"""
+
+def test_invalid_writes_end_the_transaction(app):
+    version = db_get_cereal_table_version()
+    with pytest.raises(ValueError):
+        db_update_cereal(1,{'calories' : 'many'})
+    assert not db.session().in_transaction()
+    with pytest.raises(ValueError):
+        db_add_cereal({'name' : 'Invalid', 'shelf' : 'top'})
+    assert not db.session().in_transaction()
+    assert db_get_cereal_table_version() == version
+
+def test_failed_writes_end_the_transaction(app):
+    version = db_get_cereal_table_version()
+    Cereal.__table__.drop(db.engine)
+    assert db_add_cereal({'name' : 'Lost', 'mfr' : 'K', 'type' : 'C'}) is False
+    assert not db.session().in_transaction()
+    assert db_update_cereal(1,{'calories' : '10'}) is False
+    assert not db.session().in_transaction()
+    #The version bump of the failed writes was rolled back
+    assert db_get_cereal_table_version() == version